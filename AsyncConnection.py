@@ -0,0 +1,69 @@
+import asyncio
+from FrameCodec import HEADER
+
+
+class AsyncConnection:
+    """
+    Socket-like wrapper around an asyncio stream pair.
+
+    The event loop owns the reader and writer and reads every frame. Action
+    handlers run in the server's executor threads and use the blocking
+    sendall and sendfile methods, which hand the write back to the loop and
+    wait for it.
+    """
+
+    def __init__(self, reader, writer, loop):
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+
+    async def read(self, size):
+        """Read up to size bytes (called on the event loop)."""
+        return await self.reader.read(size)
+
+    async def read_exactly(self, size):
+        """Read exactly size bytes, or whatever arrived before the peer closed (called on the event loop)."""
+        try:
+            return await self.reader.readexactly(size)
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+
+    async def read_frame(self, codec):
+        """
+        Read the next frame using the codec's header format (called on the event loop).
+        Returns None when the connection is closed.
+        """
+        header = await self.read_exactly(HEADER.size)
+        if len(header) < HEADER.size:
+            return None
+        length = codec.parse_header(header)[3]
+        payload = await self.read_exactly(length)
+        if len(payload) < length:
+            return None
+        return codec.decode(header, payload)
+
+    async def write(self, data):
+        """Write data and wait for the transport to drain (called on the event loop)."""
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def recv(self, size):
+        return self._run(self.read(size))
+
+    def send(self, data):
+        self._run(self.write(data))
+        return len(data)
+
+    def sendall(self, data):
+        self._run(self.write(data))
+
+    def sendfile(self, file, offset, count):
+        """Zero-copy send of part of a file through the loop's transport (os.sendfile where available)."""
+        return self._run(self.loop.sendfile(self.writer.transport, file, offset, count))
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.writer.close)
+
+    def _run(self, coroutine):
+        """Run a coroutine on the connection's loop from a worker thread and wait for it."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
@@ -0,0 +1,487 @@
+"""
+Benchmarks for the ShareFiles protocol.
+
+Run one benchmark by name, for example:
+    python Benchmark.py session
+    python Benchmark.py transfer --max-mb 128
+    python Benchmark.py startup
+    python Benchmark.py delta --size-mb 512
+    python Benchmark.py database --threads 1 2 4 8 16
+    python Benchmark.py logging --threads 300
+    python Benchmark.py receive --size-mb 512
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import statistics
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives import hashes
+from SessionCipher import SessionCipher
+from ClientSession import ClientSession
+from PreallocatedFile import PreallocatedFile
+from FrameCodec import FrameCodec, END, TRANSFER_CHUNK
+from KeyStore import load_or_create_private_key
+import DeltaSync
+from SqlDataBase import SqlDataBase
+from ServerLogging import start_logging, LOG_FORMAT, ACTION_RECEIVED
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Server.py")
+
+
+def rate(count, seconds):
+    return count / seconds if seconds else float("inf")
+
+
+def bench_session(requests=2000):
+    """
+    Compare requests/sec for the per-message RSA-OAEP path and the AES-GCM session path.
+    Each request is the JSON command the GUI sends on every refresh, encrypted by the
+    client and decrypted by the server.
+    """
+    message = json.dumps({"action": "sendAllGroups", "username": "benchmark"}).encode()
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_key = private_key.public_key()
+    oaep = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+
+    rsa_requests = max(1, requests // 10)  # the RSA path is slow enough that a tenth is plenty
+    start = time.perf_counter()
+    for _ in range(rsa_requests):
+        private_key.decrypt(public_key.encrypt(message, oaep), oaep)
+    rsa_seconds = time.perf_counter() - start
+
+    key = SessionCipher.generate_key()
+    client, server = SessionCipher(key, is_server=False), SessionCipher(key, is_server=True)
+    start = time.perf_counter()
+    for _ in range(requests):
+        server.open(client.seal(message))
+    session_seconds = time.perf_counter() - start
+
+    rsa_rate = rate(rsa_requests, rsa_seconds)
+    session_rate = rate(requests, session_seconds)
+    print(f"RSA-OAEP per message: {rsa_rate:12.0f} requests/sec")
+    print(f"AES-GCM session:      {session_rate:12.0f} requests/sec ({session_rate / rsa_rate:.0f}x)")
+
+
+class SendallOnly:
+    """Socket wrapper without sendfile, to force FrameCodec onto its readinto path."""
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+
+
+def make_file(directory, size_mb):
+    path = os.path.join(directory, f"{size_mb}MB.bin")
+    block = os.urandom(TRANSFER_CHUNK)
+    with open(path, "wb") as file:
+        for _ in range(size_mb):
+            file.write(block)
+    return path
+
+
+def loopback_pair():
+    listener = socket.create_server(("127.0.0.1", 0))
+    sender = socket.create_connection(listener.getsockname())
+    receiver, _ = listener.accept()
+    listener.close()
+    return sender, receiver
+
+
+def time_download(path, mode):
+    """
+    Send one file over loopback with the given download path and return the seconds taken
+    until the receiver has read every byte.
+    """
+    size = os.path.getsize(path)
+    sender, receiver = loopback_pair()
+    key = SessionCipher.generate_key()
+
+    def receive():
+        if mode == "legacy-4k":
+            remaining = size
+            buffer = bytearray(65536)
+            while remaining:
+                remaining -= receiver.recv_into(buffer, min(len(buffer), remaining))
+            return
+        codec = FrameCodec(receiver, SessionCipher(key, is_server=False))
+        codec.plain_data = mode != "sealed"
+        while codec.read_frame().type != END:
+            pass
+
+    reader = threading.Thread(target=receive)
+    reader.start()
+    start = time.perf_counter()
+    with open(path, "rb") as file:
+        if mode == "legacy-4k":
+            # The original send_all_files loop: one read and one sendall per 4 KB
+            while chunk := file.read(4096):
+                sender.sendall(chunk)
+        else:
+            transport = sender if mode == "sendfile" else SendallOnly(sender)
+            codec = FrameCodec(transport, SessionCipher(key, is_server=True))
+            codec.plain_data = mode != "sealed"
+            codec.send_file(1, file, size)
+            codec.send(END, 1)
+    reader.join()
+    seconds = time.perf_counter() - start
+    sender.close()
+    receiver.close()
+    return seconds
+
+
+def bench_transfer(max_mb=1024):
+    """
+    Download throughput over loopback for files of 1 MB up to max_mb, comparing the
+    original 4 KB loop, zero-copy sendfile, the plain readinto fallback and sealed
+    (AES-GCM) payloads.
+    """
+    sizes = [size for size in (1, 16, 128, 1024) if size <= max_mb]
+    modes = ["legacy-4k", "sendfile", "readinto", "sealed"]
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'size':>8} " + " ".join(f"{mode:>12}" for mode in modes) + "   (MB/s)")
+        for size_mb in sizes:
+            path = make_file(directory, size_mb)
+            rates = [rate(size_mb, time_download(path, mode)) for mode in modes]
+            print(f"{size_mb:>6}MB " + " ".join(f"{value:>12.0f}" for value in rates))
+            os.remove(path)
+
+
+def free_port():
+    with socket.create_server(("127.0.0.1", 0)) as listener:
+        return listener.getsockname()[1]
+
+
+def time_server_start(directory, key_file):
+    """Start Server.py in directory and return the seconds until it accepts connections."""
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, SERVER_SCRIPT, "--port", str(port), "--key-file", key_file],
+                               cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                return time.perf_counter() - start
+            except OSError:
+                if process.poll() is not None:
+                    raise RuntimeError("Server exited during startup")
+                time.sleep(0.005)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def bench_startup(runs=5):
+    """
+    Startup time with a freshly generated RSA key (first run) and with the saved key.
+    The server is timed from process start until it accepts connections. The GUI
+    client (C_2.py) cannot start headless, so its key setup is timed in-process.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        key_file = os.path.join(directory, "server_key.pem")
+        cold, warm = [], []
+        for _ in range(runs):
+            if os.path.exists(key_file):
+                os.remove(key_file)
+            cold.append(time_server_start(directory, key_file))
+            warm.append(time_server_start(directory, key_file))
+        print(f"Server.py     first run: {statistics.median(cold) * 1000:8.1f} ms   "
+              f"saved key:  {statistics.median(warm) * 1000:8.1f} ms")
+
+        client_key = os.path.join(directory, "profile", "client_key.pem")
+        cold, warm = [], []
+        for _ in range(runs):
+            if os.path.exists(client_key):
+                os.remove(client_key)
+            start = time.perf_counter()
+            load_or_create_private_key(client_key)
+            cold.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            load_or_create_private_key(client_key)
+            warm.append(time.perf_counter() - start)
+        print(f"Client keys   first run: {statistics.median(cold) * 1000:8.1f} ms   "
+              f"cached key: {statistics.median(warm) * 1000:8.1f} ms")
+
+
+def bench_delta(size_mb=256):
+    """
+    Signature and delta encoding speed for a file of size_mb with a few bytes
+    inserted and overwritten, and how much of it the delta has to send.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        old_path = make_file(directory, size_mb)
+        new_path = os.path.join(directory, "new.bin")
+        with open(old_path, "rb") as old, open(new_path, "wb") as new:
+            new.write(old.read(TRANSFER_CHUNK // 2) + b"inserted")
+            while chunk := old.read(TRANSFER_CHUNK):
+                new.write(chunk[:100] + os.urandom(16) + chunk[116:])
+
+        start = time.perf_counter()
+        with open(old_path, "rb") as old:
+            signature = DeltaSync.signatures(old, os.path.getsize(old_path))
+        signature_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        with open(new_path, "rb") as new:
+            sent = DeltaSync.encode_delta(new, signature, lambda ops: None)
+        delta_seconds = time.perf_counter() - start
+
+        print(f"numpy: {'yes' if DeltaSync.numpy is not None else 'no'}")
+        print(f"signatures: {rate(size_mb, signature_seconds):8.0f} MB/s  ({len(signature)} bytes)")
+        print(f"delta:      {rate(size_mb, delta_seconds):8.0f} MB/s  ({sent} of {os.path.getsize(new_path)} bytes sent)")
+
+
+class SharedConnectionDataBase(SqlDataBase):
+    """The previous SqlDataBase design: one connection for all threads, serialized by a lock."""
+
+    def __init__(self, db_name):
+        super().__init__(db_name=db_name)
+        self.shared = sqlite3.connect(db_name, check_same_thread=False)
+        self.lock = threading.Lock()
+
+    def check_credentials(self, username, password):
+        with self.lock:
+            self.local.conn = self.shared
+            return super().check_credentials(username, password)
+
+    def create_user(self, username, password):
+        with self.lock:
+            self.local.conn = self.shared
+            return super().create_user(username, password)
+
+
+def time_logins(data_base, threads, operations):
+    """Run operations logins and registrations (one in ten) split over threads; return ops/sec."""
+    per_thread = operations // threads
+
+    def work(worker):
+        for i in range(per_thread):
+            if i % 10 == 0:
+                data_base.create_user(f"bench-{threads}-{worker}-{i}", "password")
+            else:
+                data_base.check_credentials(f"user{i % 100}", "password")
+
+    workers = [threading.Thread(target=work, args=(worker,)) for worker in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return rate(per_thread * threads, time.perf_counter() - start)
+
+
+def bench_database(thread_counts=(1, 2, 4, 8, 16), operations=4000):
+    """
+    Concurrent login/register throughput of SqlDataBase with per-thread WAL
+    connections, against one shared connection behind a lock.
+    """
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()) as quiet:
+        designs = {}
+        for name, cls in (("shared", SharedConnectionDataBase), ("per-thread", SqlDataBase)):
+            data_base = cls(os.path.join(directory, f"{name}.db"))
+            for i in range(100):
+                data_base.create_user(f"user{i}", "password")
+            designs[name] = data_base
+        results = [(threads, [time_logins(data_base, threads, operations) for data_base in designs.values()])
+                   for threads in thread_counts]
+        quiet.truncate(0)
+
+    print(f"{'threads':>8} " + " ".join(f"{name:>12}" for name in designs) + "   (ops/sec)")
+    for threads, rates in results:
+        print(f"{threads:>8} " + " ".join(f"{value:>12.0f}" for value in rates))
+
+
+def time_logging(logger, threads, messages, pause):
+    """
+    Have threads log messages "Action received" records between them, pausing
+    between calls like the server's workers that wait on their clients between
+    requests. Returns (records/sec, p50 and p99 seconds per call).
+    """
+    per_thread = messages // threads
+    durations = [[] for _ in range(threads)]
+    ready = threading.Barrier(threads + 1)
+
+    def work(worker):
+        timings = durations[worker]
+        ready.wait()
+        for i in range(per_thread):
+            start = time.perf_counter()
+            logger.info(ACTION_RECEIVED, "sendAllGroups" if i % 4 else "verifyGroupPassword")
+            timings.append(time.perf_counter() - start)
+            time.sleep(pause)
+
+    workers = [threading.Thread(target=work, args=(worker,)) for worker in range(threads)]
+    for worker in workers:
+        worker.start()
+    ready.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    seconds = time.perf_counter() - start
+    calls = sorted(duration for timings in durations for duration in timings)
+    return rate(len(calls), seconds), calls[len(calls) // 2], calls[int(len(calls) * 0.99)]
+
+
+def bench_logging(threads=300, messages=300_000, sample=10, pause=0.001):
+    """
+    Cost of a log call on the request path: a plain FileHandler written inline
+    by every thread, the queue with its writer thread, and the queue with
+    polling actions sampled 1 in sample.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        results = []
+        for name, sample_every in (("inline", None), ("queued", 1), (f"queued 1/{sample}", sample)):
+            logger = logging.getLogger(f"Benchmark.{name}")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            path = os.path.join(directory, f"{len(results)}.log")
+            if sample_every is None:
+                handler = logging.FileHandler(path)
+                handler.setFormatter(logging.Formatter(LOG_FORMAT))
+                logger.addHandler(handler)
+                listener = None
+            else:
+                listener = start_logging(logger, path, 10 * 1024 * 1024, 5, sample_every)
+            records_rate, p50, p99 = time_logging(logger, threads, messages, pause)
+            if listener is not None:
+                start = time.perf_counter()
+                listener.stop()  # time until the writer caught up with the queue
+                drain = time.perf_counter() - start
+            else:
+                drain = 0.0
+            results.append((name, records_rate, p50, p99, drain))
+
+    print(f"{'handler':>16} {'calls/sec':>12} {'p50 us/call':>12} {'p99 us/call':>12} {'drain ms':>10}"
+          f"   ({threads} threads)")
+    for name, records_rate, p50, p99, drain in results:
+        print(f"{name:>16} {records_rate:>12.0f} {p50 * 1e6:>12.1f} {p99 * 1e6:>12.1f} {drain * 1000:>10.1f}")
+
+
+def time_receive(path, mode, sealed):
+    """
+    Upload one file over loopback into a server-style session: a reader thread
+    routes the frames to the request's inbox and the handler stores them as
+    receive_file does, hashing as it goes. mode "write" is the original loop
+    (a bytes object and an f.write per frame), "mmap" the preallocated file
+    the reader receives into. Returns (seconds, CPU seconds of the process).
+    """
+    size = os.path.getsize(path)
+    sender, receiver = loopback_pair()
+    key = SessionCipher.generate_key()
+    codec = FrameCodec(receiver, SessionCipher(key, is_server=True))
+    codec.plain_data = not sealed
+    session = ClientSession(codec, None)
+    session.open_inbox(1)
+    target = session.payload_target if mode == "mmap" else None
+
+    def read():
+        while (frame := codec.read_frame(target)) is not None:
+            session.route(frame)
+        session.close()
+
+    def send():
+        send_codec = FrameCodec(sender, SessionCipher(key, is_server=False))
+        send_codec.plain_data = not sealed
+        with open(path, "rb") as file:
+            send_codec.send_file(1, file, size)
+        send_codec.send(END, 1)
+        sender.shutdown(socket.SHUT_WR)
+
+    threads = [threading.Thread(target=read), threading.Thread(target=send)]
+    output_path = path + ".received"
+    digest = hashlib.sha256()
+    start, cpu_start = time.perf_counter(), time.process_time()
+    for thread in threads:
+        thread.start()
+    if mode == "write":
+        with open(output_path, "wb") as output:
+            while (frame := session.next_frame(1)).type != END:
+                output.write(frame.payload)
+                digest.update(frame.payload)
+    else:
+        with PreallocatedFile(output_path, size) as output:
+            session.receive_into(1, output)
+            while (frame := session.next_frame(1)).type != END:
+                digest.update(frame.payload)
+                output.write(frame.payload)
+    seconds, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+    for thread in threads:
+        thread.join()
+    sender.close()
+    receiver.close()
+    os.remove(output_path)
+    return seconds, cpu
+
+
+def bench_receive(size_mb=512):
+    """
+    Server receive path for a size_mb upload, plain and sealed: throughput, CPU
+    time, and the peak of Python allocations (traced in a second run, since
+    tracing slows the loop down).
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = make_file(directory, size_mb)
+        print(f"{'path':>14} {'MB/s':>8} {'CPU s':>8} {'peak alloc MB':>14}   ({size_mb} MB upload)")
+        for sealed in (False, True):
+            for mode in ("write", "mmap"):
+                seconds, cpu = time_receive(path, mode, sealed)
+                tracemalloc.start()
+                time_receive(path, mode, sealed)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                name = f"{'sealed' if sealed else 'plain'} {mode}"
+                print(f"{name:>14} {rate(size_mb, seconds):>8.0f} {cpu:>8.2f} {peak / 2 ** 20:>14.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ShareFiles benchmarks")
+    benchmarks = parser.add_subparsers(dest="benchmark", required=True)
+
+    session = benchmarks.add_parser("session", help="requests/sec for per-message RSA vs the AES-GCM session")
+    session.add_argument("--requests", type=int, default=2000)
+    session.set_defaults(run=lambda args: bench_session(args.requests))
+
+    transfer = benchmarks.add_parser("transfer", help="download throughput over loopback")
+    transfer.add_argument("--max-mb", type=int, default=1024, help="largest file size to send")
+    transfer.set_defaults(run=lambda args: bench_transfer(args.max_mb))
+
+    startup = benchmarks.add_parser("startup", help="Server and client startup time with and without saved keys")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.set_defaults(run=lambda args: bench_startup(args.runs))
+
+    delta = benchmarks.add_parser("delta", help="rsync-style signature and delta encoding speed")
+    delta.add_argument("--size-mb", type=int, default=256)
+    delta.set_defaults(run=lambda args: bench_delta(args.size_mb))
+
+    database = benchmarks.add_parser("database", help="concurrent login/register throughput of SqlDataBase")
+    database.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    database.add_argument("--operations", type=int, default=4000)
+    database.set_defaults(run=lambda args: bench_database(args.threads, args.operations))
+
+    log = benchmarks.add_parser("logging", help="cost of server log calls, inline file writes vs the queue")
+    log.add_argument("--threads", type=int, default=300)
+    log.add_argument("--messages", type=int, default=300_000)
+    log.add_argument("--sample", type=int, default=10, help="sampling rate of the third run")
+    log.add_argument("--pause", type=float, default=0.001, help="seconds each thread waits between log calls")
+    log.set_defaults(run=lambda args: bench_logging(args.threads, args.messages, args.sample, args.pause))
+
+    receive = benchmarks.add_parser("receive", help="server upload receive path, f.write loop vs preallocated mmap")
+    receive.add_argument("--size-mb", type=int, default=512)
+    receive.set_defaults(run=lambda args: bench_receive(args.size_mb))
+
+    args = parser.parse_args()
+    args.run(args)
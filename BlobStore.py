@@ -0,0 +1,228 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from FileLock import FileLock, file_id
+from FileManifest import file_sha256
+
+
+class BlobStore:
+    """
+    Content-addressed storage for the server's group files.
+
+    Every distinct file content is stored once, as a blob named by its SHA-256
+    under .objects/<first two hex digits>/<sha256>. Each group has an index,
+    .index/<group>.json, mapping its filenames to blob hashes, so the same file
+    shared with several groups (or uploaded twice) takes the disk space of one.
+    A blob is deleted when no group references it any more.
+
+    With shared set, several server processes use the same store: changes are
+    made holding an exclusive lock on root/.lock, an index is read again when
+    another process has replaced its file, and the changes found that way are
+    kept for take_changes().
+    """
+
+    def __init__(self, root, shared=False):
+        self.root = root
+        self.objects_dir = os.path.join(root, ".objects")
+        self.index_dir = os.path.join(root, ".index")
+        self.lock = threading.Lock()
+        self.file_lock = FileLock(os.path.join(root, ".lock")) if shared else None
+        self.indexes = {}
+        self.index_ids = {}  # group -> file_id of its index file when it was read
+        self.refcounts = Counter()
+        self.changes = []  # (event, group, filename) made by other processes
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.index_dir, exist_ok=True)
+        with self.lock:
+            self.load_all_indexes()
+
+    def locked(self):
+        """The lock other processes hold while they change the store, or nothing if it is not shared."""
+        return self.file_lock.hold() if self.file_lock else nullcontext()
+
+    def blob_path(self, sha256):
+        if len(sha256) != 64 or not all(c in "0123456789abcdef" for c in sha256):
+            raise ValueError("Invalid SHA-256.")
+        return os.path.join(self.objects_dir, sha256[:2], sha256)
+
+    def index_path(self, group_name):
+        return os.path.join(self.index_dir, f"{group_name}.json")
+
+    def load_index(self, group_name):
+        """
+        Return a group's index, reading it from disk on first use, or when shared
+        whenever another process replaced it (call with the lock held).
+        """
+        index = self.indexes.get(group_name)
+        if self.file_lock:
+            index_id = file_id(self.index_path(group_name))
+            if index is None or index_id != self.index_ids.get(group_name):
+                index = self.read_index(group_name, index_id)
+        elif index is None:
+            index = self.read_index(group_name)
+        return index
+
+    def load_all_indexes(self):
+        """Load every group's index, including groups another process created (call with the lock held)."""
+        for entry in os.listdir(self.index_dir):
+            if entry.endswith(".json"):
+                self.load_index(entry[:-len(".json")])
+
+    def read_index(self, group_name, index_id=None):
+        """Read a group's index from disk, moving the reference counts from its old contents to the new."""
+        try:
+            with open(self.index_path(group_name), "r", encoding="utf-8") as file:
+                index = json.load(file)
+        except FileNotFoundError:
+            index = {}
+        previous = self.indexes.get(group_name, {})
+        self.refcounts.update(item["sha256"] for item in index.values())
+        for item in previous.values():
+            self.refcounts[item["sha256"]] -= 1
+            if self.refcounts[item["sha256"]] <= 0:
+                del self.refcounts[item["sha256"]]
+        if self.file_lock:
+            for filename, item in index.items():
+                if filename not in previous or previous[filename]["sha256"] != item["sha256"]:
+                    self.changes.append(("file_added", group_name, filename))
+            self.changes.extend(("file_removed", group_name, filename)
+                                for filename in previous if filename not in index)
+        self.indexes[group_name] = index
+        self.index_ids[group_name] = index_id
+        return index
+
+    def save_index(self, group_name):
+        """Write a group's index atomically."""
+        path = self.index_path(group_name)
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(self.indexes[group_name], file, ensure_ascii=False)
+        os.replace(temporary_path, path)
+        if self.file_lock:
+            self.index_ids[group_name] = file_id(path)
+
+    def take_changes(self):
+        """
+        Return and forget the (event, group, filename) changes other processes
+        made to the store since the last call (shared mode only).
+        """
+        if self.file_lock is None:
+            return []
+        with self.lock:
+            self.load_all_indexes()
+            changes, self.changes = self.changes, []
+        return changes
+
+    def store(self, group_name, filename, path, sha256=None):
+        """
+        Move a finished file into the store under a group's filename and return
+        its hash. If a blob with the same content already exists the file is
+        simply deleted.
+        """
+        sha256 = sha256 or file_sha256(path)
+        blob_path = self.blob_path(sha256)
+        with self.lock, self.locked():
+            self.catch_up()
+            if os.path.exists(blob_path):
+                os.remove(path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(path, blob_path)
+            self.link_locked(group_name, filename, sha256)
+        return sha256
+
+    def link(self, group_name, filename, sha256):
+        """
+        Add a filename to a group for content the store already has, without any
+        upload. Returns False if there is no blob with that hash.
+        """
+        with self.lock, self.locked():
+            self.catch_up()
+            if not os.path.exists(self.blob_path(sha256)):
+                return False
+            self.link_locked(group_name, filename, sha256)
+        return True
+
+    def link_locked(self, group_name, filename, sha256):
+        """Point a group's filename at a stored blob, replacing what it pointed at before."""
+        index = self.load_index(group_name)
+        previous = index.get(filename)
+        index[filename] = {"sha256": sha256, "size": os.path.getsize(self.blob_path(sha256)),
+                           "mtime": time.time()}
+        self.refcounts[sha256] += 1
+        self.save_index(group_name)
+        if previous:
+            self.release(previous["sha256"])
+
+    def unlink(self, group_name, filename):
+        """Remove a filename from a group. Returns False if the group has no such file."""
+        with self.lock, self.locked():
+            self.catch_up()
+            index = self.load_index(group_name)
+            entry = index.pop(filename, None)
+            if entry is None:
+                return False
+            self.save_index(group_name)
+            self.release(entry["sha256"])
+        return True
+
+    def catch_up(self):
+        """
+        Before a change in shared mode, read every index other processes changed,
+        so the reference counts deciding which blobs to delete are complete
+        (call with both locks held).
+        """
+        if self.file_lock:
+            self.load_all_indexes()
+
+    def release(self, sha256):
+        """Drop one reference to a blob and delete it once unreferenced (call with the lock held)."""
+        self.refcounts[sha256] -= 1
+        if self.refcounts[sha256] <= 0:
+            del self.refcounts[sha256]
+            try:
+                os.remove(self.blob_path(sha256))
+            except FileNotFoundError:
+                pass
+
+    def files(self, group_name):
+        """Return a copy of a group's index: {filename: {"sha256", "size", "mtime"}}."""
+        with self.lock:
+            return {name: dict(entry) for name, entry in self.load_index(group_name).items()}
+
+    def entry(self, group_name, filename):
+        """Return a copy of the index entry of one file, or None."""
+        with self.lock:
+            entry = self.load_index(group_name).get(filename)
+            return dict(entry) if entry else None
+
+    def open(self, sha256):
+        return open(self.blob_path(sha256), "rb")
+
+    def migrate(self):
+        """
+        Move files left in plain group folders (root/<group>/<file>) by older
+        versions of the server into the store. Returns the number of files moved.
+        """
+        moved = 0
+        for group_name in os.listdir(self.root):
+            folder = os.path.join(self.root, group_name)
+            if group_name.startswith(".") or not os.path.isdir(folder):
+                continue
+            for filename in os.listdir(folder):
+                path = os.path.join(folder, filename)
+                if os.path.isfile(path):
+                    try:
+                        self.store(group_name, filename, path)
+                    except FileNotFoundError:
+                        continue  # moved by another process sharing the store
+                    moved += 1
+            try:
+                if not os.listdir(folder):
+                    os.rmdir(folder)
+            except OSError:
+                pass
+        return moved
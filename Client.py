@@ -1,59 +1,157 @@
 import socket
 import os
 import json
-from cryptography.hazmat.primitives.asymmetric import rsa
+import queue
+import threading
+import itertools
+import hashlib
+import base64
+import time
+from collections import namedtuple
 from cryptography.hazmat.primitives.serialization import load_pem_public_key
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives import serialization
-from  Engine import *
-from ftplib import FTP
+from SessionCipher import SessionCipher
+from FileManifest import FileManifest, file_sha256
+from KeyStore import load_or_create_private_key
+from TransferManager import TransferManager
+from Thumbnails import ThumbnailCache, ThumbnailService
+import DeltaSync
+import Compression
+from Compression import StreamCompressor, StreamDecompressor, TransferStats
+from FrameCodec import FrameCodec, ProtocolError, ServerBusy, HELLO, REQUEST, DATA, FILE, END, ERROR, EVENT, PING, PONG
+from FrameCodec import TRANSFER_CHUNK, UPLOAD_CHUNK, HEARTBEAT_INTERVAL
+
+# A file being received: open temporary file, where it goes when complete,
+# decompressor (None if sent uncompressed) and transfer stats
+Download = namedtuple("Download", ["file", "final_path", "decompressor", "stats"])
+THUMBNAIL_CACHE_SIZE = 64 * 1024 * 1024
+SERVER_TIMEOUT = 3 * HEARTBEAT_INTERVAL  # silence after which the connection counts as lost
+BUSY_RETRIES = 5  # times a transfer is retried when the server is busy
 
 
 class Client:
-    def __init__(self, server_host='127.0.0.1', tcp_port=65432):
+    def __init__(self, server_host='127.0.0.1', tcp_port=65432, profile="default", start_engine=True):
         """
-        Initialize the Client by generating keys, connecting to the server,
+        Initialize the Client by loading keys, connecting to the server,
         and starting the application engine.
+        The key pair is cached per user profile in ~/.sharefiles/<profile>.
+        With start_engine off the client is a plain connection, as used by the
+        transfer manager's connection pool.
         """
         self.save_dir = "ClientFiles"
+        # Last synced server manifests and in-progress downloads live outside the group folders
+        self.sync_dir = os.path.join(self.save_dir, ".sync")
+        self.file_manifest = FileManifest()
+        self.sync_lock = threading.Lock()
         self.server_host = server_host
         self.tcp_port = tcp_port
         self.running = False
-        # Generate RSA keys
+        self.profile = profile
+        self.profile_dir = os.path.join(os.path.expanduser("~"), ".sharefiles", profile)
+        # Load the cached RSA keys (generated on the profile's first run)
         self.private_key, self.public_key = self.make_keys()
         self.public_key_pem = self.public_key.public_bytes(
             encoding=serialization.Encoding.PEM,
             format=serialization.PublicFormat.SubjectPublicKeyInfo
         )
 
-        # Create TCP socket
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            self.client_socket.connect((server_host, tcp_port))
-            print(f"Connected to server at {server_host}:{tcp_port}")
-
-            self.client_socket.send(self.public_key_pem)
-            public_server_key_pem = self.client_socket.recv(1024)
-            self.public_server_key = load_pem_public_key(public_server_key_pem)
-
-            self.username = None
+        # Replies are matched to their request by id, so several requests can be in flight
+        self.request_ids = itertools.count(1)
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.event_listeners = []
+        self.subscribed = False
+        self.client_socket = None
+        self.reader_thread = None
+        self.receive_throttle = None
+        self.username = None
+        self.credentials = None  # (username, password) of the login, repeated on every new connection
+        # Last group list received and its version, for conditional sendAllGroups
+        self.groups = []
+        self.groups_version = None
+        # Previews of group files: sent by the server with the manifests, or rendered locally
+        self.thumbnails = None
+        if start_engine:
+            self.thumbnails = ThumbnailService(ThumbnailCache(os.path.join(self.sync_dir, "thumbnails"),
+                                                              THUMBNAIL_CACHE_SIZE))
 
-            app = Engine(self)
-            app.run()
+        try:
+            self.connect()
+
+            if start_engine:
+                # Uploads and downloads run in parallel on pooled connections
+                self.transfers = TransferManager(self)
+                from Engine import Engine  # Tk is only loaded for the GUI
+                app = Engine(self)
+                app.run()
         except Exception as e:
             print(f"Failed to connect to server: {e}")
-            self.client_socket.close()
+            if self.client_socket:
+                self.client_socket.close()
             raise
 
+    def connect(self):
+        """
+        Open the TCP connection, run the handshake and start the reader and
+        heartbeat threads. Called again to reconnect after the connection was lost.
+        Raises ServerBusy if the server has no room for another connection.
+        """
+        self.close_connection()
+
+        # Create TCP socket; the server answers heartbeats, so a long silence means it is gone
+        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.client_socket.settimeout(SERVER_TIMEOUT)
+        self.client_socket.connect((self.server_host, self.tcp_port))
+        print(f"Connected to server at {self.server_host}:{self.tcp_port}")
+
+        self.codec = FrameCodec(self.client_socket)
+        self.codec.send_json(HELLO, 0, {"public_key": self.public_key_pem.decode(),
+                                        "compression": Compression.supported()})
+        server_hello = json.loads(self.codec.read_frame().payload)
+        if server_hello.get("busy"):
+            raise ServerBusy(server_hello.get("error"), server_hello.get("retry_after", 1))
+        self.public_server_key = load_pem_public_key(server_hello["public_key"].encode())
+
+        # Agree on a session key once; every later frame is sealed with AES-GCM
+        session_key = SessionCipher.generate_key()
+        self.codec.send(HELLO, 0, self.encrypt(session_key))
+        self.codec.cipher = SessionCipher(session_key, is_server=False)
+        self.codec.plain_data = server_hello.get("plain_data", False)
+        self.codec.compression = server_hello.get("compression")
+
+        self.reader_thread = threading.Thread(target=self.read_frames, daemon=True)
+        self.reader_thread.start()
+        threading.Thread(target=self.send_heartbeats, args=(self.codec,), daemon=True).start()
+
+        if self.subscribed:
+            self.subscribe()
+        if self.credentials:
+            self.log_in(*self.credentials)  # a new connection starts logged out
+
+    def close_connection(self):
+        """Close the current connection and wait for its reader thread to fail pending requests."""
+        if self.client_socket is None:
+            return
+        try:
+            self.client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.client_socket.close()
+        if self.reader_thread is not None:
+            self.reader_thread.join()
+
     def make_keys(self):
-        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        private_key = load_or_create_private_key(os.path.join(self.profile_dir, "client_key.pem"))
         public_key = private_key.public_key()
         return private_key, public_key
 
     def encrypt(self, text):
+        if isinstance(text, str):
+            text = text.encode()
         return self.public_server_key.encrypt(
-            text.encode(),
+            text,
             padding.OAEP(
                 mgf=padding.MGF1(algorithm=hashes.SHA256()),
                 algorithm=hashes.SHA256(),
@@ -61,6 +159,115 @@ class Client:
             )
         )
 
+    def send_heartbeats(self, codec):
+        """Send a PING every HEARTBEAT_INTERVAL until the connection is replaced or lost."""
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            if codec is not self.codec:
+                return
+            try:
+                codec.send(PING, 0)
+            except OSError:
+                return
+
+    def read_frames(self):
+        """
+        Read every frame from the server and hand it to the request waiting for it.
+        """
+        try:
+            while True:
+                frame = self.codec.read_frame()
+                if frame is None:
+                    break
+                if frame.type == EVENT:
+                    self.dispatch_event(json.loads(frame.payload))
+                    continue
+                if frame.type == PONG:
+                    continue
+                if frame.type == DATA and self.receive_throttle is not None:
+                    # Slowing the reader down pushes back on the server through TCP
+                    self.receive_throttle(len(frame.payload))
+                with self.pending_lock:
+                    replies = self.pending.get(frame.request_id)
+                if replies is not None:
+                    replies.put(frame)
+        except Exception as e:
+            print(f"Server connection lost: {e}")
+        finally:
+            with self.pending_lock:
+                waiting = list(self.pending.values())
+            for replies in waiting:
+                replies.put(None)
+
+    def add_event_listener(self, callback):
+        """
+        Call callback(event) for every change event the server pushes. Callbacks run
+        on the reader thread, so GUI code must hand the work to Tk with root.after.
+        """
+        self.event_listeners.append(callback)
+
+    def remove_event_listener(self, callback):
+        if callback in self.event_listeners:
+            self.event_listeners.remove(callback)
+
+    def dispatch_event(self, event):
+        for callback in list(self.event_listeners):
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"Error handling event {event.get('event')}: {e}")
+
+    def subscribe(self):
+        """Ask the server to push group_added, file_added and file_removed events."""
+        try:
+            self.subscribed = self.request({"action": "subscribe"}).get("success", False)
+            return self.subscribed
+        except Exception as e:
+            print(f"Error subscribing to server events: {e}")
+            return False
+
+    def send_request(self, request):
+        """
+        Send a JSON request and return its request id; replies are queued until finish_request.
+        """
+        if not self.reader_thread.is_alive():  # e.g. the server closed the connection as idle
+            raise ConnectionError("Server connection lost")
+        request_id = next(self.request_ids)
+        with self.pending_lock:
+            self.pending[request_id] = queue.Queue()
+        self.codec.send_json(REQUEST, request_id, request)
+        return request_id
+
+    def next_frame(self, request_id, timeout=30):
+        """Wait for the next frame the server sent for a request."""
+        with self.pending_lock:
+            replies = self.pending[request_id]
+        frame = replies.get(timeout=timeout)
+        if frame is None:
+            raise ConnectionError("Server connection lost")
+        if frame.type == ERROR:
+            error = json.loads(frame.payload)
+            if error.get("busy"):
+                raise ServerBusy(error.get("error"), error.get("retry_after", 1))
+            raise ProtocolError(error.get("error"))
+        return frame
+
+    def finish_request(self, request_id):
+        with self.pending_lock:
+            self.pending.pop(request_id, None)
+
+    def request(self, request):
+        """Send a JSON request and wait for its JSON reply."""
+        request_id = self.send_request(request)
+        try:
+            return json.loads(self.next_frame(request_id).payload)
+        finally:
+            self.finish_request(request_id)
+
+    def notify(self, request):
+        """Send a JSON request without waiting for its reply."""
+        self.codec.send_json(REQUEST, next(self.request_ids), request)
+
     def log_in(self, login_username, login_password):
         try:
             # Create a dictionary to hold the login details
@@ -70,20 +277,14 @@ class Client:
                 "password": login_password
             }
 
-            # Convert the dictionary to a JSON string
-            json_data = json.dumps(login_data)
-
-            # Send the JSON data (encrypted, if necessary)
-            encrypted_data = self.encrypt(json_data)  # Assuming encrypt method exists
-            self.client_socket.send(encrypted_data)
-
-            # Receive the server's response
-            response = self.client_socket.recv(1024).decode('utf-8')
+            # Send the request over the encrypted session and wait for the server's response
+            response = self.request(login_data)
 
             # Check if login was successful
-            if response == 'True':
+            if response.get("success"):
                 print("Login successful!")
                 self.username = login_username
+                self.credentials = (login_username, login_password)
                 self.running = True
                 return True
             else:
@@ -106,18 +307,9 @@ class Client:
                 "password": password
             }
 
-            # Convert the dictionary to a JSON string
-            json_registration_data = json.dumps(registration_data)
-
-            # Encrypt the JSON string (if encryption is necessary)
-            encrypted_data = self.encrypt(json_registration_data)
-
-            # Send the encrypted data to the serve
-            self.client_socket.send(encrypted_data)  # Send encrypted registration data
-
-            # Receive the server's response
-            response = self.client_socket.recv(1024).decode('utf-8')
-            print(response)  # Print the server's response
+            # Send the registration data over the encrypted session and wait for the server's response
+            response = self.request(registration_data)
+            print(response.get("message"))  # Print the server's response
 
         except Exception as e:
             print(f"Error during registration: {e}")
@@ -127,48 +319,238 @@ class Client:
     def get_user(self):
         return self.username
 
-    def send_file(self, file_path, group_name):
+    def send_file(self, file_path, group_name, retries=3, progress=None):
         """
-        Send a file to the server using FTP.
+        Upload a file to a group with the resumable upload protocol.
+
+        The server keeps a partial file per upload id; the upload is sent in
+        UPLOAD_CHUNK pieces and committed once its SHA-256 checks out. If the
+        connection drops, the client reconnects and continues from the offset
+        the server reports instead of starting over. progress(count) is called
+        after every DATA frame sent.
         """
         if not os.path.isfile(file_path):
             print(f"File not found: {file_path}")
-            return
+            return False
 
         filename = os.path.basename(file_path)
         filesize = os.path.getsize(file_path)
+        sha256 = file_sha256(file_path)
+        print(f"Sending file: {filename} ({filesize} bytes)")
 
-        try:
-            print(f"Sending file: {filename} ({filesize} bytes)")
+        for attempt in range(retries + 1):
+            try:
+                self.upload_file(file_path, group_name, filename, filesize, sha256, progress)
+                print(f"File {filename} sent successfully!")
+                return True
+            except ServerBusy as e:
+                if attempt == retries:
+                    print(f"Error sending file: {e}")
+                    return False
+                print(f"Server busy, sending {filename} again in {e.retry_after}s")
+                time.sleep(e.retry_after)
+            except OSError as e:  # includes ConnectionError from a lost connection
+                if attempt == retries:
+                    print(f"Error sending file: {e}")
+                    return False
+                print(f"Connection lost while sending {filename}, resuming: {e}")
+                try:
+                    self.connect()
+                except (OSError, ServerBusy) as e:
+                    print(f"Reconnect failed: {e}")
+            except Exception as e:
+                print(f"Error sending file: {e}")
+                return False
 
-            # Connect to the FTP server
-            ftp = FTP(self.server_host)
-            ftp.login()  # Assuming anonymous login or modify for user authentication
+    def upload_file(self, file_path, group_name, filename, filesize, sha256, progress=None):
+        """
+        Run one attempt of the upload protocol, starting at the server's offset.
+        The server is first asked whether it already stores the content; if so
+        no bytes are sent at all.
+        """
+        linked = self.request({
+            "action": "linkBlob",
+            "group_name": group_name,
+            "filename": filename,
+            "sha256": sha256
+        })
+        if linked["stored"]:
+            print(f"Server already has the content of {filename}, upload skipped")
+            if progress:
+                progress(filesize)
+            return
+        if filesize >= DeltaSync.DELTA_MIN_SIZE and self.upload_delta(file_path, group_name, filename, filesize, sha256):
+            if progress:
+                progress(filesize)
+            return
 
-            # Change to the target directory (optional, based on your setup)
-            # ftp.cwd('/target/directory')
+        upload = self.request({
+            "action": "uploadBegin",
+            "group_name": group_name,
+            "filename": filename,
+            "filesize": filesize,
+            "sha256": sha256
+        })
+        upload_id, offset = upload["upload_id"], upload["offset"]
+        if offset:
+            print(f"Resuming {filename} at {offset} of {filesize} bytes")
+
+        # Each chunk is its own compressed stream so a resumed upload can start at any chunk
+        compression = Compression.choose_for_file(self.codec.compression, file_path)
+        stats = TransferStats(f"Sent {filename}", compression)
+        with open(file_path, "rb") as file:
+            buffer = bytearray(TRANSFER_CHUNK)
+            while offset < filesize:
+                count = min(UPLOAD_CHUNK, filesize - offset)
+                request_id = self.send_request({"action": "uploadChunk", "upload_id": upload_id, "offset": offset,
+                                                "compression": compression})
+                try:
+                    file.seek(offset)
+                    compressor = StreamCompressor(compression) if compression else None
+                    wire = self.codec.send_file(request_id, file, count, buffer, progress, compressor)
+                    self.codec.send(END, request_id)
+                    offset = json.loads(self.next_frame(request_id).payload)["offset"]
+                    stats.add(count, wire)
+                except ServerBusy:
+                    raise
+                except ProtocolError:
+                    # Uploads of the same file share the upload id, so another client may have moved it on
+                    current = self.shared_upload_offset(upload_id, group_name, filename, sha256)
+                    if current == offset:
+                        raise
+                    if current is None:
+                        print(f"{filename} was uploaded by another client")
+                        return
+                    offset = current
+                finally:
+                    self.finish_request(request_id)
 
-            # Open the file and upload it using FTP
-            with open(file_path, "rb") as file:
-                ftp.storbinary(f"STOR {filename}", file)
+        try:
+            self.request({"action": "uploadCommit", "upload_id": upload_id})
+        except ServerBusy:
+            raise
+        except ProtocolError:
+            if self.shared_upload_offset(upload_id, group_name, filename, sha256) is not None:
+                raise
+            print(f"{filename} was uploaded by another client")
+            return
+        print(stats.summary())
 
-            print(f"File {filename} sent successfully!")
+    def shared_upload_offset(self, upload_id, group_name, filename, sha256):
+        """
+        Where an upload stands after the server refused one of our requests for
+        it: its current offset, or None if another client uploading the same
+        file has committed it already. Raises ProtocolError if it is gone and
+        the group does not have the file.
+        """
+        try:
+            return self.request({"action": "uploadQuery", "upload_id": upload_id})["offset"]
+        except ServerBusy:
+            raise
+        except ProtocolError:
+            linked = self.request({"action": "linkBlob", "group_name": group_name,
+                                   "filename": filename, "sha256": sha256})
+            if not linked["stored"]:
+                raise
+            return None
+
+    def read_stream(self, request_id):
+        """Collect the DATA frames of a reply up to END. Returns (data, END trailer)."""
+        data = bytearray()
+        while True:
+            frame = self.next_frame(request_id)
+            if frame.type == END:
+                return bytes(data), json.loads(frame.payload) if frame.payload else {}
+            data += frame.payload
+
+    def upload_delta(self, file_path, group_name, filename, filesize, sha256):
+        """
+        Upload a changed file as an rsync-style delta against the group's current
+        copy. Returns False if the group has no copy, the server rejected the
+        delta or did not answer in time, in which case the caller uploads the
+        whole file.
+        """
+        request_id = self.send_request({"action": "blockSignatures", "group_name": group_name, "filename": filename})
+        try:
+            signature, trailer = self.read_stream(request_id)
+        except queue.Empty:
+            print(f"No block signatures for {filename} in time, sending the whole file")
+            return False
+        finally:
+            self.finish_request(request_id)
+        if not trailer.get("sha256"):
+            return False
 
-            # Close FTP connection
-            ftp.quit()
+        request_id = self.send_request({
+            "action": "deltaUpload",
+            "group_name": group_name,
+            "filename": filename,
+            "filesize": filesize,
+            "sha256": sha256,
+            "base_sha256": trailer["sha256"]
+        })
+        try:
+            with open(file_path, "rb") as file:
+                sent = DeltaSync.encode_delta(file, signature, lambda ops: self.codec.send(DATA, request_id, ops))
+            self.codec.send(END, request_id)
+            self.next_frame(request_id)
+        except ServerBusy:
+            raise
+        except ProtocolError as e:
+            print(f"Delta upload of {filename} failed, sending the whole file: {e}")
+            return False
+        except queue.Empty:
+            print(f"No reply to the delta upload of {filename} in time, sending the whole file")
+            return False
+        finally:
+            self.finish_request(request_id)
+        print(f"Sent {filename} as a {sent} byte delta ({filesize} bytes)")
+        return True
 
+    def receive_delta(self, group_name, filename, progress=None):
+        """
+        Update the local copy of a file by downloading only a delta against it.
+        Returns True if the file was updated and matches the server's checksum.
+        """
+        local_path = os.path.join(self.save_dir, group_name, filename)
+        temporary_path = os.path.join(self.sync_dir, f"{group_name}.{filename}.download")
+        request_id = self.send_request({"action": "sendDelta", "group_name": group_name, "filename": filename})
+        try:
+            with open(local_path, "rb") as base:
+                for piece in DeltaSync.signature_pieces(base, os.path.getsize(local_path)):
+                    self.codec.send(DATA, request_id, piece)
+                self.codec.send(END, request_id)
+
+                metadata = json.loads(self.next_frame(request_id).payload)
+                os.makedirs(self.sync_dir, exist_ok=True)
+                digest = hashlib.sha256()
+                with open(temporary_path, "wb") as output:
+                    while (frame := self.next_frame(request_id)).type != END:
+                        written = DeltaSync.apply_delta(frame.payload, base, output, digest)
+                        if progress is not None:
+                            progress(written)
+
+            if digest.hexdigest() != metadata["sha256"]:
+                raise ValueError("File rebuilt from the delta does not match its checksum.")
+            os.replace(temporary_path, local_path)
+            print(f"Updated {filename} from a delta")
+            return True
         except Exception as e:
-            print(f"Error sending file via FTP: {e}")
+            print(f"Delta download of {filename} failed: {e}")
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            return False
+        finally:
+            self.finish_request(request_id)
 
     def log_out(self):
+        self.credentials = None
         receive_num_data = {
             "action": "logout",
             "username": self.username
         }
 
-        log_out_json = json.dumps(receive_num_data)
-        encrypted_data = self.encrypt(log_out_json)  # Assuming encrypt method exists
-        self.client_socket.send(encrypted_data)
+        self.notify(receive_num_data)
 
     def disconnect(self):
         disconnect = {
@@ -176,9 +558,7 @@ class Client:
             "username": self.username
         }
 
-        log_out_json = json.dumps(disconnect)
-        encrypted_data = self.encrypt(log_out_json)  # Assuming encrypt method exists
-        self.client_socket.send(encrypted_data)
+        self.notify(disconnect)
 
     def add_group(self, group_name,  group_password):
         add_group = {
@@ -186,9 +566,7 @@ class Client:
             "group_name": group_name,
             "group_password": group_password
         }
-        add_group_json = json.dumps(add_group)
-        encrypted_data = self.encrypt(add_group_json)
-        self.client_socket.send(encrypted_data)
+        self.request(add_group)
 
     def verify_group_password(self, group_name, password):
         try:
@@ -199,20 +577,11 @@ class Client:
                 "password": password
             }
 
-            # המרת הנתונים למבנה JSON
-            password_json = json.dumps(password_data)
-
-            # הצפנת הנתונים
-            encrypted_data = self.encrypt(password_json)
+            # שליחה לשרת וקבלת התשובה (נכון או לא נכון)
+            response = self.request(password_data)
 
-            # שליחה לשרת
-            self.client_socket.send(encrypted_data)
-
-            # קבלת התשובה מהשרת (נכון או לא נכון)
-            response = self.client_socket.recv(1024).decode('utf-8')
-
-            # אם התשובה היא 'True', הסיסמה נכונה
-            if response == 'True':
+            # אם התשובה חיובית, הסיסמה נכונה
+            if response.get("success"):
                 print("Password verified successfully!")
                 return True
             else:
@@ -223,69 +592,201 @@ class Client:
             print(f"Error verifying group password: {e}")
             return False
 
-    def receive_groups(self):
-        """Connect to the server and receive group data."""
+    def receive_groups(self, changed_only=False):
+        """
+        Connect to the server and receive group data. The version of the last
+        list received is sent along, and if the groups did not change since the
+        server only answers "not modified" and the cached list is returned
+        (or None with changed_only).
+        """
         receive_groups_data = {
             "action": "sendAllGroups",
-            "username": self.username
+            "username": self.username,
+            "version": self.groups_version
         }
-        receive_groups_json = json.dumps(receive_groups_data)
-        encrypted_data = self.encrypt(receive_groups_json)  # Assuming encrypt method exists
-        self.client_socket.send(encrypted_data)
 
         try:
-            # Receive the length of the incoming message
-            data_length = self.client_socket.recv(10).decode().strip()  # Read the first 10 bytes to get the data length
-            if not data_length.isdigit():
-                raise ValueError("Received invalid data length")
-
-            # Receive the actual data based on the length
-            data = self.client_socket.recv(int(data_length)).decode()
-
-            # Parse the JSON data
-            groups = json.loads(data).get("groups", [])
-            if not groups:
+            # The reply is one frame, however large the group list is
+            reply = self.request(receive_groups_data)
+            if reply.get("not_modified"):
+                return None if changed_only else self.groups
+            self.groups = reply.get("groups", [])
+            self.groups_version = reply.get("version")
+            if not self.groups:
                 print("No groups found.")
-            return groups
+            return self.groups
 
         except Exception as e:
             print(f"Error receiving groups: {e}")
-            return []
+            return None if changed_only else []
 
-    def receive_all_files(self, group_name):
+    def list_groups(self, cursor=None, limit=50, prefix=None, search=None, version=None):
         """
-        Receive all files for a specific group from the FTP server.
+        Fetch one page of groups: {"groups", "next_cursor", "version"}. Pass the
+        previous page's next_cursor to continue; next_cursor is None on the last
+        page. With version set on the first page (no cursor), the reply is
+        {"not_modified": True} if the groups did not change since that version.
         """
+        request = {"action": "listGroups", "cursor": cursor, "limit": limit, "prefix": prefix, "search": search,
+                   "version": version}
         try:
-            print(f"Requesting files for group: {group_name}")
-
-            # Connect to the FTP server
-            ftp = FTP(self.server_host)
-            ftp.login()  # Assuming anonymous login or modify for user authentication
-
-            # List files in the target directory (optional, modify based on your setup)
-            files = ftp.nlst()  # List file names in the FTP server's current directory
-            print(f"Found {len(files)} files on server.")
+            return self.request(request)
+        except Exception as e:
+            print(f"Error listing groups: {e}")
+            return {"groups": [], "next_cursor": None, "version": None}
 
-            if len(files) == 0:
-                print("No files found.")
-                ftp.quit()
-                return
+    def receive_all_files(self, group_name, filenames=None, progress=None, busy_retries=BUSY_RETRIES):
+        """
+        Receive all files for a specific group from the server into save_dir/group_name,
+        or only the ones listed in filenames. Each file is written to a temporary
+        path and moved into place once it is complete. progress(count) is called
+        for every DATA frame written. Returns True if every file arrived.
+        If the server is busy the request is repeated up to busy_retries times.
+        """
+        request = {"action": "sendAllFiles", "group_name": group_name}
+        if filenames is not None:
+            request["filenames"] = list(filenames)
+        request_id = self.send_request(request)
+        download = None  # the file being received
+        try:
+            print(f"Requesting files for group: {group_name}")
+            group_folder_path = os.path.join(self.save_dir, group_name)
+            os.makedirs(group_folder_path, exist_ok=True)
+            os.makedirs(self.sync_dir, exist_ok=True)
+
+            while True:
+                frame = self.next_frame(request_id)
+                if frame.type == FILE:
+                    self.finish_download(download)
+                    metadata = json.loads(frame.payload)
+                    filename = os.path.basename(metadata["filename"])
+                    print(f"Receiving file: {filename}")
+                    temporary_path = os.path.join(self.sync_dir, f"{group_name}.{filename}.download")
+                    compression = metadata.get("compression")
+                    download = Download(open(temporary_path, "wb"), os.path.join(group_folder_path, filename),
+                                        StreamDecompressor(compression) if compression else None,
+                                        TransferStats(f"Received {filename}", compression))
+                elif frame.type == DATA:
+                    payload = frame.payload
+                    if download.decompressor is not None:
+                        payload = download.decompressor.decompress(payload)
+                    download.file.write(payload)
+                    download.stats.add(len(payload), len(frame.payload))
+                    if progress is not None:
+                        progress(len(frame.payload))
+                elif frame.type == END:
+                    self.finish_download(download)
+                    download = None
+                    print(f"Received {json.loads(frame.payload).get('count', 0)} files.")
+                    return True
+
+        except ServerBusy as e:  # turned away before any file was sent
+            if not busy_retries:
+                print(f"Error receiving files: {e}")
+                return False
+            print(f"Server busy, asking for the files of {group_name} again in {e.retry_after}s")
+            time.sleep(e.retry_after)
+            return self.receive_all_files(group_name, filenames, progress, busy_retries - 1)
 
-            for filename in files:
-                print(f"Receiving file: {filename}")
+        except Exception as e:
+            print(f"Error receiving files: {e}")
+            if download is not None:
+                download.file.close()
+                os.remove(download.file.name)
+            return False
+        finally:
+            self.finish_request(request_id)
 
-                # Open the local file for writing
-                with open(filename, "wb") as file:
-                    ftp.retrbinary(f"RETR {filename}", file.write)
+    def finish_download(self, download):
+        """Close a completed download and move it over the group copy."""
+        if download is not None:
+            download.file.close()
+            os.replace(download.file.name, download.final_path)
+            print(download.stats.summary())
 
-                print(f"File {filename} received successfully!")
+    def get_manifest(self, group_name):
+        """
+        Ask the server for the manifest of a group: {filename: {"size", "mtime", "sha256"}}.
+        Thumbnails the server has for the group's files come along and go into
+        the thumbnail cache; the ones already cached are not asked for again.
+        """
+        request = {"action": "groupManifest", "group_name": group_name}
+        if self.thumbnails is not None:
+            request["thumbnails"] = [entry["sha256"] for entry in self.load_synced_manifest(group_name).values()
+                                     if entry["sha256"] in self.thumbnails.cache]
+        reply = self.request(request)
+        for sha256, data in reply.get("thumbnails", {}).items():
+            self.thumbnails.cache.put(sha256, base64.b64decode(data))
+        return reply.get("files", {})
+
+    def synced_manifest_path(self, group_name):
+        return os.path.join(self.sync_dir, f"{group_name}.json")
+
+    def load_synced_manifest(self, group_name):
+        try:
+            with open(self.synced_manifest_path(group_name), "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save_synced_manifest(self, group_name, manifest):
+        os.makedirs(self.sync_dir, exist_ok=True)
+        path = self.synced_manifest_path(group_name)
+        with open(path + ".tmp", "w") as file:
+            json.dump(manifest, file)
+        os.replace(path + ".tmp", path)
+
+    def sync_group(self, group_name, fetch=None):
+        """
+        Bring save_dir/group_name up to date with the server.
 
-            # Close FTP connection
-            ftp.quit()
+        Compares the server's manifest with a scan of the local folder and downloads
+        only new or changed files. Files that were in the last synced manifest but
+        are gone from the server are deleted locally, unless they were changed
+        locally since. Returns {"fetched": [...], "deleted": [...]}, fetched
+        holding only the files that arrived.
 
-        except Exception as e:
-            print(f"Error receiving files via FTP: {e}")
+        fetch(group_name, filenames) downloads the changed files; it defaults to
+        receive_all_files on this connection.
+        """
+        with self.sync_lock:
+            return self.sync_group_locked(group_name, fetch or self.receive_all_files)
+
+    def sync_group_locked(self, group_name, fetch):
+        remote = self.get_manifest(group_name)
+        group_folder_path = os.path.join(self.save_dir, group_name)
+        local = self.file_manifest.scan(group_folder_path)
+        synced = self.load_synced_manifest(group_name)
+
+        fetched = [name for name, entry in remote.items()
+                   if local.get(name, {}).get("sha256") != entry["sha256"]]
+        deleted = [name for name, entry in synced.items()
+                   if name not in remote and local.get(name, {}).get("sha256") == entry["sha256"]]
+
+        # Changed files with a big enough local copy are updated with a delta
+        missing = [name for name in fetched
+                   if local.get(name, {}).get("size", 0) < DeltaSync.DELTA_MIN_SIZE
+                   or not self.receive_delta(group_name, name)]
+        failed = set()
+        if missing:
+            fetch(group_name, missing)
+            for name in missing:
+                path = os.path.join(group_folder_path, name)
+                try:
+                    sha256 = self.file_manifest.hash_for(path, os.stat(path))
+                except OSError:
+                    sha256 = None
+                if sha256 != remote[name]["sha256"]:
+                    failed.add(name)
+        for name in deleted:
+            os.remove(os.path.join(group_folder_path, name))
+            print(f"File {name} was removed from the group, deleted locally.")
+
+        # A file that did not arrive keeps its last synced entry, so a later removal still applies to it
+        self.save_synced_manifest(group_name, {name: synced[name] if name in failed else entry
+                                               for name, entry in remote.items()
+                                               if name not in failed or name in synced})
+        return {"fetched": [name for name in fetched if name not in failed], "deleted": deleted}
 
     def remove_file(self, group_name, file_path):
         """
@@ -301,7 +802,7 @@ class Client:
                 "group_name": group_name,
                 "filename": filename
             }
-            self.client_socket.send(self.encrypt(json.dumps(request_data)))
+            self.request(request_data)
 
             # Remove the file locally
             if os.path.exists(file_path):
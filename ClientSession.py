@@ -0,0 +1,161 @@
+import contextlib
+import json
+import queue
+import threading
+from FrameCodec import RESPONSE, DATA, ERROR
+
+INBOX_FRAMES = 32  # frames queued per request before the reader stops reading from the client
+INBOX_WAIT = 0.1  # seconds between checks whether a full inbox was closed meanwhile
+
+
+class ClientSession:
+    """
+    Server-side state of one client connection.
+
+    A single reader (a thread in threaded mode, the event loop in async mode)
+    reads every frame. REQUEST frames start an action on the worker pool; any
+    other frame is routed to the inbox of the request it belongs to, so several
+    requests can be in flight on one connection at the same time.
+
+    While a request is open its traffic is counted: payload bytes received and
+    sent for it, and whether it was answered with an ERROR.
+
+    Inboxes are bounded: when a request's handler falls behind, the reader
+    waits for room (see has_room in async mode) instead of queueing the
+    client's data without limit, and a handler waits at most frame_timeout
+    seconds for each frame.
+
+    A request receiving a file can register the file's PreallocatedFile with
+    receive_into; the threaded reader then reads the request's DATA frames
+    straight into it (see payload_target).
+    """
+
+    def __init__(self, codec, address, frame_timeout=None):
+        self.codec = codec
+        self.address = address
+        self.frame_timeout = frame_timeout
+        self.username = None
+        self.inboxes = {}
+        self.traffic = {}  # request id -> [bytes received, bytes sent, failed]
+        self.targets = {}  # request id -> PreallocatedFile its DATA frames are read into, or None
+        self.copied = {}  # request id -> bytes of DATA read before a file was registered
+        self.lock = threading.Lock()
+
+    def open_inbox(self, request_id, received=0):
+        with self.lock:
+            self.inboxes[request_id] = queue.Queue(INBOX_FRAMES)
+            self.traffic[request_id] = [received, 0, False]
+
+    def close_inbox(self, request_id):
+        """Close a request's inbox and return its traffic: (bytes received, bytes sent, failed)."""
+        with self.lock:
+            self.inboxes.pop(request_id, None)
+            self.targets.pop(request_id, None)
+            self.copied.pop(request_id, None)
+            traffic = self.traffic.pop(request_id, None)
+        return tuple(traffic) if traffic else (0, 0, False)
+
+    def receive_into(self, request_id, file):
+        """
+        Have the DATA frames of a request read straight into a PreallocatedFile.
+        Must be called before the handler takes any frame of the request; the
+        frames that arrived earlier are copied in by the handler, so the windows
+        start after them.
+        """
+        with self.lock:
+            if request_id in self.inboxes and request_id not in self.targets:
+                file.expect(self.copied.pop(request_id, 0))
+                self.targets[request_id] = file
+
+    def payload_target(self, frame_type, request_id, length):
+        """FrameCodec.read_frame target: the next window of the file a DATA frame belongs in, if any."""
+        if frame_type != DATA:
+            return None
+        with self.lock:
+            if request_id not in self.inboxes:
+                return None
+            if request_id not in self.targets:
+                self.copied[request_id] = self.copied.get(request_id, 0) + length
+                return None
+            file = self.targets[request_id]
+            window = file.window(length) if file is not None else None
+            if window is None:
+                self.targets[request_id] = None  # read around the file, so no later frame may use it
+            return window
+
+    def count_sent(self, request_id, count):
+        traffic = self.traffic.get(request_id)
+        if traffic is not None:
+            traffic[1] += count
+
+    def route(self, frame):
+        """Deliver a frame to the request waiting for it. Returns False if no request is."""
+        with self.lock:
+            inbox = self.inboxes.get(frame.request_id)
+            if inbox is not None:
+                self.traffic[frame.request_id][0] += len(frame.payload)
+        if inbox is None:
+            return False
+        while True:
+            try:
+                inbox.put(frame, timeout=INBOX_WAIT)
+                return True
+            except queue.Full:
+                with self.lock:
+                    if self.inboxes.get(frame.request_id) is not inbox:
+                        return False  # the request ended without reading the rest
+
+    def has_room(self, request_id):
+        """Whether a frame for the request can be routed without waiting."""
+        with self.lock:
+            inbox = self.inboxes.get(request_id)
+        return inbox is None or not inbox.full()
+
+    def next_frame(self, request_id, timeout=None):
+        """Wait for the next frame sent for a request, at most timeout (default frame_timeout) seconds."""
+        timeout = self.frame_timeout if timeout is None else timeout
+        with self.lock:
+            inbox = self.inboxes[request_id]
+        try:
+            frame = inbox.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No data for the request in {timeout} seconds.") from None
+        if frame is None:
+            raise ConnectionError("Connection lost during the request.")
+        return frame
+
+    def send(self, frame_type, request_id, payload=b""):
+        self.codec.send(frame_type, request_id, payload)
+        self.count_sent(request_id, len(payload))
+
+    def send_json(self, frame_type, request_id, data):
+        self.send(frame_type, request_id, json.dumps(data).encode())
+
+    def send_file(self, request_id, file, size, buffer=None, compressor=None):
+        sent = self.codec.send_file(request_id, file, size, buffer, compressor=compressor)
+        self.count_sent(request_id, sent)
+        return sent
+
+    def reply(self, request_id, data):
+        """Send the final JSON reply for a request."""
+        self.send_json(RESPONSE, request_id, data)
+
+    def error(self, request_id, message, **details):
+        """Send a final error reply for a request; details are extra fields of the reply."""
+        traffic = self.traffic.get(request_id)
+        if traffic is not None:
+            traffic[2] = True
+        self.send_json(ERROR, request_id, {"error": message, **details})
+
+    def close(self):
+        """Wake every handler still waiting for frames on this connection."""
+        with self.lock:
+            inboxes = list(self.inboxes.values())
+        for inbox in inboxes:
+            while True:
+                try:
+                    inbox.put_nowait(None)
+                    break
+                except queue.Full:
+                    with contextlib.suppress(queue.Empty):
+                        inbox.get_nowait()  # the request fails anyway, its data can go
@@ -0,0 +1,120 @@
+"""
+Per-file stream compression for transfers.
+
+Client and server agree on an algorithm in the handshake: zstd when the
+zstandard package is installed on both sides, zlib otherwise. Each file is then
+compressed as one stream across its DATA frames, unless its extension or a
+sample of its first chunk shows it would not shrink.
+"""
+import os
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SAMPLE_SIZE = 64 * 1024
+MIN_SAMPLE = 512  # files smaller than this are not worth a compressor
+MIN_SAVING = 0.05  # compress only if the sample shrinks by at least this much
+ZSTD_LEVEL = 3
+ZLIB_LEVEL = 6
+INCOMPRESSIBLE_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".mp3", ".mp4", ".m4a", ".mkv", ".mov", ".avi",
+    ".zip", ".gz", ".bz2", ".xz", ".zst", ".7z", ".rar", ".docx", ".xlsx", ".pptx",
+}
+
+
+def supported():
+    """Algorithms this side can use, most preferred first."""
+    return ["zstd", "zlib"] if zstandard is not None else ["zlib"]
+
+
+def negotiate(offered):
+    """Pick the algorithm for a session from the ones the client offered, or None."""
+    for algorithm in supported():
+        if algorithm in (offered or []):
+            return algorithm
+    return None
+
+
+def choose(algorithm, filename, sample):
+    """
+    Return algorithm if a file should be compressed with it, None if not: known
+    compressed formats and samples that zlib can barely shrink are sent as they are.
+    """
+    if algorithm is None or len(sample) < MIN_SAMPLE:
+        return None
+    if os.path.splitext(filename)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return None
+    if len(zlib.compress(sample, 1)) > len(sample) * (1 - MIN_SAVING):
+        return None
+    return algorithm
+
+
+def choose_for_file(algorithm, file_path):
+    """choose() with a sample read from the start of a file."""
+    if algorithm is None:
+        return None
+    with open(file_path, "rb") as file:
+        return choose(algorithm, file_path, file.read(SAMPLE_SIZE))
+
+
+class StreamCompressor:
+    """Compresses one file as a single stream, chunk by chunk."""
+
+    def __init__(self, algorithm):
+        self.algorithm = algorithm
+        if algorithm == "zstd":
+            self.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        else:
+            self.compressor = zlib.compressobj(ZLIB_LEVEL)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+
+class StreamDecompressor:
+    """Decompresses the DATA frames of one file compressed by StreamCompressor."""
+
+    def __init__(self, algorithm):
+        if algorithm == "zstd":
+            if zstandard is None:
+                raise ValueError("zstd compression requires the zstandard package.")
+            self.decompressor = zstandard.ZstdDecompressor().decompressobj()
+        elif algorithm == "zlib":
+            self.decompressor = zlib.decompressobj()
+        else:
+            raise ValueError(f"Unknown compression: {algorithm}")
+
+    def decompress(self, data):
+        return self.decompressor.decompress(data)
+
+
+class TransferStats:
+    """
+    File bytes, bytes on the wire and CPU time of one transfer. CPU time is
+    measured on the thread that created the stats, from creation until summary().
+    """
+
+    def __init__(self, name, algorithm=None):
+        self.name = name
+        self.algorithm = algorithm
+        self.size = 0
+        self.wire = 0
+        self.started = time.thread_time()
+
+    def add(self, size, wire):
+        self.size += size
+        self.wire += wire
+
+    def summary(self):
+        megabytes = self.size / (1024 * 1024)
+        cpu_ms = (time.thread_time() - self.started) * 1000
+        per_mb = f"{cpu_ms / megabytes:.1f} ms CPU/MB" if megabytes else f"{cpu_ms:.1f} ms CPU"
+        return (f"{self.name}: {self.size} bytes, {self.wire} on the wire "
+                f"({self.algorithm or 'uncompressed'}), {per_mb}")
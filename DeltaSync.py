@@ -0,0 +1,278 @@
+"""
+rsync-style delta encoding of a file against an older copy held by the other side.
+
+The receiver cuts its copy into fixed blocks and sends a signature per block:
+a rolling weak checksum and a strong BLAKE2b hash. The sender slides a window
+over the new file, looks every offset's weak checksum up in the signatures,
+confirms hits with the strong hash and sends only COPY references to matching
+blocks plus LITERAL bytes for everything else.
+
+Weak checksums for every offset of a window are computed in one go with numpy
+prefix sums when numpy is installed, and looked up in the signatures in one go
+too; without it a pure Python rolling loop produces the same checksums and
+looks each one up, just much slower.
+"""
+import bisect
+import hashlib
+import math
+import struct
+import time
+from itertools import accumulate
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DELTA_MIN_SIZE = 1024 * 1024  # smaller files are cheaper to send whole
+MIN_BLOCK = 2048
+MAX_BLOCKS = 500_000  # keeps a signature below 10 MB for any file size
+SCAN_WINDOW = 4 * 1024 * 1024
+OP_BATCH = 1024 * 1024
+FLUSH_INTERVAL = 1.0  # seconds pending operations may wait for more to batch with
+STRONG_SIZE = 16
+FILTER_MULTIPLIER = 0x9E3779B1  # spreads the clustered low bits of weak checksums over the filter
+
+SIGNATURE_HEADER = struct.Struct("!IQ")  # block size, file size
+SIGNATURE = struct.Struct("!I16s")  # weak checksum, strong hash
+COPY = 0
+LITERAL = 1
+COPY_OP = struct.Struct("!BQQ")  # COPY, offset and length in the old file
+LITERAL_OP = struct.Struct("!BI")  # LITERAL, length of the bytes that follow
+
+
+def block_size_for(size):
+    """About the square root of the file size, as a power of two, with at most MAX_BLOCKS blocks."""
+    block_size = 1 << max(MIN_BLOCK.bit_length() - 1, math.ceil(math.log2(math.sqrt(size or 1))))
+    while size // block_size > MAX_BLOCKS:
+        block_size *= 2
+    return block_size
+
+
+def strong_hash(block):
+    return hashlib.blake2b(block, digest_size=STRONG_SIZE).digest()
+
+
+def weak_checksum(a, b):
+    return ((b & 0xFFFF) << 16) | (a & 0xFFFF)
+
+
+def block_checksums(data, block_size):
+    """Weak checksums of the consecutive whole blocks in data."""
+    count = len(data) // block_size
+    if numpy is not None:
+        blocks = numpy.frombuffer(data, dtype=numpy.uint8, count=count * block_size).reshape(count, block_size)
+        a = blocks.sum(axis=1, dtype=numpy.uint64)
+        b = blocks.cumsum(axis=1, dtype=numpy.uint32).sum(axis=1, dtype=numpy.uint64)
+        return (((b & 0xFFFF) << 16) | (a & 0xFFFF)).tolist()
+    checksums = []
+    for start in range(0, count * block_size, block_size):
+        block = data[start:start + block_size]
+        checksums.append(weak_checksum(sum(block), sum(accumulate(block))))
+    return checksums
+
+
+def window_checksums(window, block_size):
+    """Weak checksums of the block starting at every offset of window."""
+    count = len(window) - block_size + 1
+    if numpy is not None:
+        if count <= 0:
+            return numpy.zeros(0, dtype=numpy.uint32)
+        # Only the low 16 bits of a and b count, so the sums are kept in wrapping uint16
+        sums = numpy.zeros(len(window) + 1, dtype=numpy.uint16)
+        numpy.cumsum(numpy.frombuffer(window, dtype=numpy.uint8), out=sums[1:])
+        sums_of_sums = numpy.cumsum(sums, dtype=numpy.uint16)
+        a = sums[block_size:] - sums[:count]
+        # sum of (block_size - i) * x[k + i] over the block starting at k
+        b = sums_of_sums[block_size:] - sums_of_sums[:count] - numpy.uint16(block_size & 0xFFFF) * sums[:count]
+        return (b.astype(numpy.uint32) << 16) | a
+    if count <= 0:
+        return []
+    a = sum(window[:block_size])
+    b = sum(accumulate(window[:block_size]))
+    checksums = [weak_checksum(a, b)]
+    for k in range(count - 1):
+        outgoing, incoming = window[k], window[k + block_size]
+        a += incoming - outgoing
+        b += a - block_size * outgoing
+        checksums.append(weak_checksum(a, b))
+    return checksums
+
+
+def signature_pieces(file, size):
+    """
+    Yield the packed block signatures of an open file of the given size piece
+    by piece as they are computed (the header, then one piece per SCAN_WINDOW
+    of the file), so they can be sent while the rest is still being read.
+    """
+    block_size = block_size_for(size)
+    yield SIGNATURE_HEADER.pack(block_size, size)
+    read_size = max(1, SCAN_WINDOW // block_size) * block_size
+    while data := file.read(read_size):
+        piece = bytearray()
+        for index, weak in enumerate(block_checksums(data, block_size)):
+            start = index * block_size
+            piece += SIGNATURE.pack(weak, strong_hash(data[start:start + block_size]))
+        yield bytes(piece)
+
+
+def signatures(file, size):
+    """Return the packed block signatures of an open file of the given size."""
+    return b"".join(signature_pieces(file, size))
+
+
+def parse_signatures(signature):
+    """Return the block size and {weak: {strong: offset}} of packed signatures."""
+    block_size, _ = SIGNATURE_HEADER.unpack_from(signature)
+    table = {}
+    for index, (weak, strong) in enumerate(SIGNATURE.iter_unpack(signature[SIGNATURE_HEADER.size:])):
+        table.setdefault(weak, {}).setdefault(strong, index * block_size)
+    return block_size, table
+
+
+class DeltaWriter:
+    """
+    Batches delta operations into payloads of about OP_BATCH bytes for send.
+    What is pending, a COPY still being extended included, also goes out once
+    FLUSH_INTERVAL seconds passed since the last send, so the other side hears
+    something while a long unchanged stretch is scanned.
+    """
+
+    def __init__(self, send):
+        self.send = send
+        self.ops = bytearray()
+        self.copy = None  # [offset, length] of a COPY still being extended
+        self.sent = 0
+        self.sent_at = time.monotonic()
+
+    def literal(self, data):
+        if not data:
+            return
+        self.flush_copy()
+        for start in range(0, len(data), OP_BATCH):
+            piece = data[start:start + OP_BATCH]
+            self.ops += LITERAL_OP.pack(LITERAL, len(piece))
+            self.ops += piece
+            self.flush(OP_BATCH)
+
+    def copy_block(self, offset, length):
+        if self.copy is not None and self.copy[0] + self.copy[1] == offset:
+            self.copy[1] += length
+            return
+        self.flush_copy()
+        self.copy = [offset, length]
+
+    def flush_copy(self):
+        if self.copy is not None:
+            self.ops += COPY_OP.pack(COPY, *self.copy)
+            self.copy = None
+
+    def flush(self, threshold=0):
+        if len(self.ops) >= max(threshold, 1):
+            self.send(bytes(self.ops))
+            self.sent += len(self.ops)
+            self.ops.clear()
+            self.sent_at = time.monotonic()
+
+    def flush_if_due(self):
+        if time.monotonic() - self.sent_at >= FLUSH_INTERVAL:
+            self.flush_copy()
+            self.flush()
+
+    def close(self):
+        self.flush_copy()
+        self.flush()
+
+
+def encode_delta(file, signature, send):
+    """
+    Encode an open file as a delta against the file the signature was made from.
+    send(payload) is called with batches of operations; returns the bytes sent.
+    """
+    block_size, table = parse_signatures(signature)
+    if numpy is not None:
+        # Bitmap over hashes of the known weak checksums, a cheap first filter kept
+        # small and sparse (about 1 in 64 bits set); its few hits are then checked
+        # against the sorted weak checksums, so Python only sees real weak matches
+        weak_sums = numpy.sort(numpy.fromiter(table, dtype=numpy.uint32, count=len(table)))
+        filter_shift = numpy.uint32(32 - min(24, max(16, len(table).bit_length() + 6)))
+        multiplier = numpy.uint32(FILTER_MULTIPLIER)
+        known = numpy.zeros(1 << (32 - int(filter_shift)), dtype=bool)
+        known[(weak_sums * multiplier) >> filter_shift] = True
+    writer = DeltaWriter(send)
+    window_size = SCAN_WINDOW + block_size - 1
+    position = 0  # offset of the window in the file
+    pending = 0   # offset of the first byte not sent yet
+    window = file.read(window_size)
+    while True:
+        at_end = len(window) < window_size
+        checksums = window_checksums(window, block_size)
+        if numpy is not None:
+            candidates = numpy.flatnonzero(known[(checksums * multiplier) >> filter_shift])
+            candidates = candidates[numpy.isin(checksums[candidates], weak_sums)].tolist()
+        else:
+            candidates = [k for k, weak in enumerate(checksums) if weak in table]
+
+        index = bisect.bisect_left(candidates, pending - position)
+        while index < len(candidates):
+            k = int(candidates[index])
+            blocks = table.get(int(checksums[k]))
+            offset = None if blocks is None else blocks.get(strong_hash(window[k:k + block_size]))
+            if offset is None:
+                index += 1
+                continue
+            if position + k > pending:
+                writer.literal(window[pending - position:k])
+            writer.copy_block(offset, block_size)
+            pending = position + k + block_size
+            index = bisect.bisect_left(candidates, pending - position, index + 1)
+
+        if at_end:
+            writer.literal(window[pending - position:])
+            break
+        # Slide on by SCAN_WINDOW, or past the last COPY if it reaches further
+        next_position = max(pending, position + SCAN_WINDOW)
+        if pending < next_position:
+            writer.literal(window[pending - position:next_position - position])
+            pending = next_position
+        keep = window[next_position - position:]
+        window = keep + file.read(window_size - len(keep))
+        position = next_position
+        writer.flush_if_due()
+    writer.close()
+    return writer.sent
+
+
+def apply_delta(ops, base, output, digest=None):
+    """
+    Apply one payload of delta operations: COPY ranges come from the open base
+    file, LITERAL bytes from the payload; everything is written to output and
+    fed to digest if given. Returns the number of bytes written.
+    """
+    view = memoryview(ops)
+    written = 0
+    position = 0
+    while position < len(view):
+        if view[position] == COPY:
+            _, offset, length = COPY_OP.unpack_from(view, position)
+            position += COPY_OP.size
+            base.seek(offset)
+            while length:
+                data = base.read(min(length, OP_BATCH))
+                if not data:
+                    raise ValueError("Delta refers past the end of the base file.")
+                output.write(data)
+                if digest is not None:
+                    digest.update(data)
+                length -= len(data)
+                written += len(data)
+        else:
+            _, length = LITERAL_OP.unpack_from(view, position)
+            position += LITERAL_OP.size
+            data = view[position:position + length]
+            position += length
+            output.write(data)
+            if digest is not None:
+                digest.update(data)
+            written += len(data)
+    return written
@@ -1,6 +1,7 @@
 import tkinter as tk
 from MenuState import *
 from tkinterdnd2 import TkinterDnD
+from RequestDispatcher import RequestDispatcher
 
 class Engine:
     def __init__(self, client, width=1280, height=720, title="Engine with States"):
@@ -16,6 +17,9 @@ class Engine:
 
         self.running = True
 
+        # Network calls of the states run here; their results come back in update()
+        self.dispatcher = RequestDispatcher()
+
         # State stack
         self.states = []
 
@@ -45,6 +49,8 @@ class Engine:
         if not self.running:
             return
 
+        self.dispatcher.deliver()
+
         state = self.current_state()
         if state:
             state.update()
@@ -54,6 +60,9 @@ class Engine:
 
     def on_close(self):
         self.running = False
+        self.dispatcher.shutdown()
+        self.client.transfers.close()
+        self.client.thumbnails.shutdown()
         self.root.destroy()
 
     def run(self):
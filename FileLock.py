@@ -0,0 +1,39 @@
+import contextlib
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows: the server runs as a single process there
+    fcntl = None
+
+
+def file_id(path):
+    """(inode, mtime, size) of a file, or None if it does not exist. Changes on every write or replace."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class FileLock:
+    """
+    Advisory lock on a file, shared by every process that uses the same path
+    (flock). Each hold() opens its own descriptor, so threads of one process
+    exclude each other as well; a thread must not nest two holds of the same
+    lock.
+    """
+
+    def __init__(self, path):
+        if fcntl is None:
+            raise OSError("File locks need fcntl, which this platform does not have.")
+        self.path = path
+
+    @contextlib.contextmanager
+    def hold(self, exclusive=True):
+        with open(self.path, "a") as file:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
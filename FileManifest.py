@@ -0,0 +1,56 @@
+import hashlib
+import os
+import threading
+
+HASH_CHUNK = 1024 * 1024
+
+
+def file_sha256(path):
+    """Return the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(HASH_CHUNK):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileManifest:
+    """
+    Content manifest of a folder: filename -> size, mtime and SHA-256.
+
+    Hashes are cached by path, size and mtime, so rescanning a folder that did
+    not change costs one stat per file. Used by the server for group folders
+    and by the client for its local copies.
+    """
+
+    def __init__(self):
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def scan(self, folder):
+        """Return {filename: {"size", "mtime", "sha256"}} for the regular files in a folder."""
+        manifest = {}
+        if not os.path.isdir(folder):
+            return manifest
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                manifest[entry.name] = {
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "sha256": self.hash_for(entry.path, stat),
+                }
+        return manifest
+
+    def hash_for(self, path, stat):
+        key = (stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            cached = self.cache.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+        digest = file_sha256(path)
+        with self.lock:
+            self.cache[path] = (key, digest)
+        return digest
@@ -0,0 +1,225 @@
+import json
+import struct
+import threading
+from collections import namedtuple
+
+# Frame types
+HELLO = 1      # handshake step (public keys, wrapped session key); never sealed
+REQUEST = 2    # JSON request from the client, starts a new request id
+RESPONSE = 3   # final JSON reply to a request
+DATA = 4       # raw payload chunk belonging to a request (upload or download)
+FILE = 5       # JSON metadata of the file whose DATA frames follow
+END = 6        # end of a streamed upload or download, optional JSON trailer
+ERROR = 7      # final JSON error reply: {"error": "..."}
+EVENT = 8      # JSON change notification pushed by the server to subscribed clients
+PING = 9       # heartbeat from the client, answered with PONG
+PONG = 10
+
+FRAME_TYPES = {HELLO, REQUEST, RESPONSE, DATA, FILE, END, ERROR, EVENT, PING, PONG}
+
+# Frame flags
+FLAG_SEALED = 0x01  # payload is AES-GCM ciphertext, the header is authenticated with it
+
+# type, flags, request id, payload length
+HEADER = struct.Struct("!BBII")
+TAG_SIZE = 16
+CHUNK_SIZE = 64 * 1024
+TRANSFER_CHUNK = 1024 * 1024  # DATA frame size used for file transfers
+UPLOAD_CHUNK = 4 * TRANSFER_CHUNK  # resumable uploads restart at a multiple of this
+MAX_PAYLOAD = 16 * 1024 * 1024
+HEARTBEAT_INTERVAL = 30  # seconds between a client's PINGs; the server drops connections silent for much longer
+
+Frame = namedtuple("Frame", ["type", "request_id", "payload"])
+
+
+class ProtocolError(Exception):
+    """Raised for malformed frames and for ERROR replies from the other side."""
+
+
+class ServerBusy(ProtocolError):
+    """The server turned a connection or request away at one of its limits; try again after retry_after seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def recv_exactly(transport, view):
+    """
+    Fill a writable memoryview completely from a socket-like transport with recv_into.
+    Returns the number of bytes read, which is less than len(view) only if the
+    peer closed the connection.
+    """
+    received = 0
+    size = len(view)
+    while received < size:
+        count = transport.recv_into(view[received:])
+        if not count:
+            break
+        received += count
+    return received
+
+
+class FrameCodec:
+    """
+    Length-prefixed framing shared by Client and Server.
+
+    Every message on a connection is a frame: a fixed 10-byte header (type,
+    flags, request id, payload length) followed by the payload. Replies carry
+    the request id of the request they answer, so several requests can be in
+    flight on one connection at once. Once a session cipher is set, payloads
+    are sealed with it and the header is authenticated as associated data.
+
+    When the session is set up with plain_data, DATA frames are sent unsealed
+    so file payloads can go out with zero-copy sendfile; everything else stays
+    sealed. compression is the stream compression algorithm agreed on in the
+    handshake (None if there is none); each file decides whether to use it.
+
+    Writes are serialized with a lock so frames from different threads never
+    interleave. Reads use a preallocated buffer; a larger frame is read into a
+    temporary one. read_frame must be called from a single reader thread.
+    """
+
+    def __init__(self, transport, cipher=None, buffer_size=CHUNK_SIZE + TAG_SIZE):
+        self.transport = transport
+        self.cipher = cipher
+        self.plain_data = False
+        self.compression = None
+        self.send_lock = threading.Lock()
+        self.header = bytearray(HEADER.size)
+        self.buffer = bytearray(buffer_size)
+
+    def seals(self, frame_type):
+        """Whether frames of this type are sealed on this session."""
+        if self.cipher is None or frame_type == HELLO:
+            return False
+        return not (frame_type == DATA and self.plain_data)
+
+    def encode_parts(self, frame_type, request_id, payload=b""):
+        """
+        Build the header and body of one frame. Sealing advances the cipher's nonce
+        counter, so frames must be written in the order they were encoded.
+        Unsealed bodies are returned as given, without copying.
+        """
+        if self.seals(frame_type):
+            header = HEADER.pack(frame_type, FLAG_SEALED, request_id, len(payload) + TAG_SIZE)
+            return header, self.cipher.seal(bytes(payload), header)
+        return HEADER.pack(frame_type, 0, request_id, len(payload)), payload
+
+    def encode(self, frame_type, request_id, payload=b""):
+        header, body = self.encode_parts(frame_type, request_id, payload)
+        return header + bytes(body)
+
+    def send(self, frame_type, request_id, payload=b""):
+        with self.send_lock:
+            header, body = self.encode_parts(frame_type, request_id, payload)
+            if len(body) < CHUNK_SIZE:
+                self.transport.sendall(header + bytes(body))
+            else:
+                # Large bodies go out separately instead of being copied behind the header
+                self.transport.sendall(header)
+                self.transport.sendall(body)
+
+    def send_file(self, request_id, file, size, buffer=None, progress=None, compressor=None):
+        """
+        Send size bytes of an open binary file as DATA frames of TRANSFER_CHUNK bytes.
+        Returns the number of payload bytes sent.
+
+        Uses kernel zero-copy sendfile when DATA frames go out unsealed and the
+        transport supports it. Otherwise reads the file with readinto into one
+        reused buffer (pass buffer to share it across several files); with a
+        compressor each chunk is compressed before it is framed.
+        progress(count) is called after each frame, outside the send lock, so it
+        may also sleep to limit bandwidth.
+        """
+        offset = file.tell()
+        end = offset + size
+        if compressor is None and not self.seals(DATA) and hasattr(self.transport, "sendfile"):
+            while offset < end:
+                count = min(TRANSFER_CHUNK, end - offset)
+                with self.send_lock:
+                    self.transport.sendall(HEADER.pack(DATA, 0, request_id, count))
+                    self.transport.sendfile(file, offset, count)
+                offset += count
+                if progress is not None:
+                    progress(count)
+            return size
+
+        view = memoryview(buffer if buffer is not None else bytearray(TRANSFER_CHUNK))
+        sent = 0
+        while offset < end:
+            count = file.readinto(view[:min(len(view), end - offset)])
+            if not count:
+                raise EOFError("File is shorter than its announced size.")
+            payload = view[:count] if compressor is None else compressor.compress(view[:count])
+            if payload:
+                self.send(DATA, request_id, payload)
+                sent += len(payload)
+            offset += count
+            if progress is not None:
+                progress(count)
+        if compressor is not None:
+            payload = compressor.flush()
+            self.send(DATA, request_id, payload)
+            sent += len(payload)
+        return sent
+
+    def send_json(self, frame_type, request_id, data):
+        self.send(frame_type, request_id, json.dumps(data).encode())
+
+    def parse_header(self, header):
+        """Validate a frame header and return (type, flags, request id, length)."""
+        frame_type, flags, request_id, length = HEADER.unpack(header)
+        if frame_type not in FRAME_TYPES:
+            raise ProtocolError(f"Unknown frame type {frame_type}")
+        if length > MAX_PAYLOAD + TAG_SIZE:
+            raise ProtocolError(f"Frame of {length} bytes exceeds the maximum size")
+        return frame_type, flags, request_id, length
+
+    def decode(self, header, payload, window=None):
+        """
+        Turn a header and its raw payload into a Frame, opening sealed payloads.
+        With a window (see read_frame) the plaintext is placed in it, and the
+        window becomes the frame's payload.
+        """
+        frame_type, flags, request_id, length = self.parse_header(header)
+        if flags & FLAG_SEALED:
+            if self.cipher is None:
+                raise ProtocolError("Sealed frame received before the handshake finished")
+            if window is None:
+                payload = self.cipher.open(bytes(payload), bytes(header))
+            else:
+                self.cipher.open_into(payload, bytes(header), window)
+                payload = window
+        elif self.seals(frame_type):
+            raise ProtocolError("Unsealed frame received on an encrypted session")
+        else:
+            payload = bytes(payload) if window is None else window
+        return Frame(frame_type, request_id, payload)
+
+    def read_frame(self, target=None):
+        """
+        Read the next frame from the transport (blocking).
+        Returns None when the connection is closed.
+
+        target(frame type, request id, length) may return a writable memoryview
+        of length bytes for a frame's plaintext (the place in a file it belongs
+        to). An unsealed payload is then received straight into it and a sealed
+        one decrypted into it, without copying the payload into a new object.
+        """
+        header = memoryview(self.header)
+        if recv_exactly(self.transport, header) < HEADER.size:
+            return None
+        frame_type, flags, request_id, length = self.parse_header(header)
+        window = None
+        if target is not None:
+            window = target(frame_type, request_id, length - TAG_SIZE if flags & FLAG_SEALED else length)
+        if window is not None and not flags & FLAG_SEALED:
+            payload = window
+        else:
+            # An oversized frame gets a buffer of its own, so idle sessions keep only the default one
+            buffer = self.buffer if length <= len(self.buffer) else bytearray(length)
+            payload = memoryview(buffer)[:length]
+        if recv_exactly(self.transport, payload) < length:
+            return None
+        return self.decode(header, payload, window)
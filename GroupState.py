@@ -1,14 +1,16 @@
-import threading
-import time
+import io
 import os
 import platform
 import subprocess
 from State import State
+from VirtualFileList import VirtualFileList, FolderSnapshot
 import tkinter as tk
 from tkinter import PhotoImage
 from tkinterdnd2 import DND_FILES, TkinterDnD
-import shutil
+from PIL import Image, ImageTk
 
+# File changes are pushed by the server; polling is only a slow safety net
+FALLBACK_SYNC_INTERVAL = 60
 class GroupState(State):
     def __init__(self, engine, group_name):
         super().__init__(engine)
@@ -17,8 +19,9 @@ class GroupState(State):
         # Enable DnD support
         self.engine.root.drop_target_register(DND_FILES)
 
-        # List to store file paths (full paths for opening later)
-        self.file_paths = []
+        # Cached listing of the local group folder, read again only when the folder changes
+        self.group_folder_path = os.path.join(self.engine.client.save_dir, group_name)
+        self.folder_snapshot = FolderSnapshot(self.group_folder_path)
 
         # Main frame
         self.frame = tk.Frame(self.engine.root, bg="#ECECEC")
@@ -53,6 +56,11 @@ class GroupState(State):
                              bg="#ECECEC", fg="#555")
         drop_hint.pack(pady=5)
 
+        # Preview of the selected file
+        self.preview_label = tk.Label(folder_area, bg="#ECECEC")
+        self.preview_label.pack(pady=20)
+        self.preview_image = None
+
         # File list panel (right side)
         list_panel = tk.Frame(content_frame, bg="#FFFFFF", bd=1, relief="solid")
         list_panel.pack(side="left", fill="both", expand=True, padx=10)
@@ -61,99 +69,167 @@ class GroupState(State):
                               bg="#F5F5F5", anchor="w", padx=10)
         list_title.pack(fill="x")
 
-        # Scrollable listbox for files
+        # Scrollable file list; only the rows in view are rendered
         listbox_frame = tk.Frame(list_panel, bg="#FFFFFF")
         listbox_frame.pack(fill="both", expand=True)
 
-        self.file_listbox = tk.Listbox(listbox_frame, font=("Helvetica", 12),
-                                       bg="white", fg="#333", bd=0, highlightthickness=0, activestyle="none")
-        self.file_listbox.pack(side="left", fill="both", expand=True, padx=5, pady=5)
-
-        scrollbar = tk.Scrollbar(listbox_frame, command=self.file_listbox.yview)
-        scrollbar.pack(side="right", fill="y")
-
-        self.file_listbox.config(yscrollcommand=scrollbar.set)
+        self.file_list = VirtualFileList(listbox_frame)
 
         remove_button = tk.Button(list_panel, text="🗑️ Remove Selected File", font=("Helvetica", 12),
                                   bg="#E53935", fg="white", command=self.remove_selected_file)
         remove_button.pack(fill="x", padx=10, pady=10)
 
+        # Progress of uploads and downloads running in the background
+        self.transfer_label = tk.Label(list_panel, text="", font=("Helvetica", 10),
+                                       bg="#FFFFFF", fg="#555", anchor="w", padx=10)
+        self.transfer_label.pack(fill="x")
+        self.transfers = {}
+
         # Bind drop event
         self.engine.root.dnd_bind('<<Drop>>', self.on_file_drop)
 
         # Bind double-click to open file
-        self.file_listbox.bind("<Double-Button-1>", self.open_selected_file)
+        self.file_list.bind("<Double-Button-1>", self.open_selected_file)
+        self.file_list.bind("<<ListboxSelect>>", self.on_file_selected)
 
-        # Periodically call receive_files_from_group every 5 seconds
+        # Sync whenever the server reports a change in this group
+        self.active = True
+        self.syncing = False
+        self.sync_requested = False
+        self.engine.client.add_event_listener(self.on_server_event)
+
+        # Sync now, then every FALLBACK_SYNC_INTERVAL seconds
         self.schedule_file_reception()
+        self.poll_transfers()
 
     def schedule_file_reception(self):
         """
-        Schedule file reception every 5 seconds.
+        Sync the group now and schedule the next fallback sync.
+        """
+        if not self.active:
+            return
+        self.sync_in_background()
+        self.sync_after_id = self.engine.root.after(FALLBACK_SYNC_INTERVAL * 1000, self.schedule_file_reception)
+
+    def sync_in_background(self):
+        """
+        Run receive_files_from_group on a request thread (called on the Tk thread).
+        Syncs asked for while one runs are folded into a single follow-up sync,
+        so a burst of events never ties up every request thread.
         """
-        self.receive_files_from_group()
-        # Schedule next call in 5 seconds
-        threading.Timer(5, self.schedule_file_reception).start()
+        if self.syncing:
+            self.sync_requested = True
+            return
+        self.syncing = True
+        self.engine.dispatcher.submit(self.receive_files_from_group, on_done=self.on_synced,
+                                      on_error=lambda e: self.on_synced(None))
+
+    def on_synced(self, entries):
+        self.syncing = False
+        self.show_files(entries)
+        if self.sync_requested and self.active:
+            self.sync_requested = False
+            self.sync_in_background()
+
+    def on_server_event(self, event):
+        """Called on the client's reader thread for every pushed event."""
+        if event.get("event") in ("file_added", "file_removed") and event.get("group_name") == self.group_name:
+            self.engine.dispatcher.call_in_ui(self.sync_in_background)
 
     def receive_files_from_group(self):
         """
-        Receive all files from the group and display them in the file list, replacing the current list.
+        Sync the group with the server and return the listing of the folder,
+        or None if it could not be read. Runs on a background thread.
         """
+        print(f"Attempting to receive files from group: {self.group_name}")
         try:
-            print(f"Attempting to receive files from group: {self.group_name}")
-
-            # Call the method to receive files from the server
-            self.engine.client.receive_all_files(self.group_name)
-
-            # Path to the group's folder
-            group_folder_path = os.path.join(self.engine.client.save_dir, self.group_name)
-            print(f"Group folder path: {group_folder_path}")
-
-            if os.path.exists(group_folder_path):
-                print(f"Folder found, listing files...")
-
-                # Clear the current list
-                self.file_listbox.delete(0, tk.END)
-                self.file_paths.clear()
-
-                # List and add files
-                for filename in os.listdir(group_folder_path):
-                    full_file_path = os.path.join(group_folder_path, filename)
-                    print(f"Adding file: {filename} at {full_file_path}")
-
-                    self.file_listbox.insert(tk.END, f"📄 {filename}")
-                    self.file_paths.append(full_file_path)
-
-                print(f"All files listed.")
-            else:
-                print(f"Error: Folder {group_folder_path} does not exist.")
-
+            # Fetch only new or changed files from the server in parallel, apply deletions
+            self.engine.client.transfers.sync_group(self.group_name)
         except Exception as e:
             print(f"Error receiving files: {e}")
+        try:
+            entries = self.folder_snapshot.scan()
+        except OSError as e:
+            print(f"Error listing files: {e}")
+            return None
+        return entries
+
+    def show_files(self, entries):
+        """
+        Display the files of the local group folder ({filename: (size, mtime)}),
+        inserting and removing only the rows that changed.
+        """
+        if self.active and entries is not None:
+            self.file_list.update(entries)
 
     def on_file_drop(self, event):
         files = self.engine.root.tk.splitlist(event.data)
         for file_path in files:
-            if file_path not in self.file_paths:  # Avoid duplicate files
-                self.engine.client.send_file(file_path, self.group_name)
-                filename = os.path.basename(file_path)
+            filename = os.path.basename(file_path)
+            # Copy file to the local save_dir/group_name and upload it in the background.
+            # A file dropped again replaces the group's copy; the upload then sends
+            # nothing if the content is unchanged and only a delta if it was edited.
+            os.makedirs(self.group_folder_path, exist_ok=True)
+            destination_path = os.path.join(self.group_folder_path, filename)
+            if os.path.exists(destination_path) and os.path.samefile(file_path, destination_path):
+                destination_path = None  # dropped from the group folder itself
+            self.engine.client.transfers.upload(file_path, self.group_name, copy_to=destination_path)
+
+            # Show it right away; the next folder scan fills in the final details
+            self.file_list.add(filename, os.path.getsize(file_path))
+
+    def poll_transfers(self):
+        """
+        Show the progress reported by the transfer manager (runs on the Tk thread).
+        """
+        if not self.active:
+            return
+        for update in self.engine.client.transfers.take_progress():
+            if update["status"] in ("done", "failed"):
+                self.transfers.pop(update["id"], None)
+                if update["status"] == "failed":
+                    print(f"{update['kind'].capitalize()} of {update['name']} failed")
+            else:
+                self.transfers[update["id"]] = update
+
+        if self.transfers:
+            uploads = sum(1 for t in self.transfers.values() if t["kind"] == "upload")
+            downloads = len(self.transfers) - uploads
+            megabytes = sum(t["done"] for t in self.transfers.values()) / (1024 * 1024)
+            self.transfer_label.config(text=f"⬆ {uploads}  ⬇ {downloads}  ({megabytes:.1f} MB transferred)")
+        else:
+            self.transfer_label.config(text="")
+        self.engine.root.after(200, self.poll_transfers)
 
-                # Copy file to the local save_dir/group_name
-                group_folder_path = os.path.join(self.engine.client.save_dir, self.group_name)
-                os.makedirs(group_folder_path, exist_ok=True)
-                destination_path = os.path.join(group_folder_path, filename)
-                shutil.copy2(file_path, destination_path)
+    def on_file_selected(self, event):
+        filename = self.file_list.selected()
+        if filename:
+            self.engine.dispatcher.submit(self.load_preview, filename, on_done=self.show_preview)
 
-                # Add to listbox and path list
-                self.file_listbox.insert(tk.END, f"📄 {filename}")
-                self.file_paths.append(destination_path)
+    def load_preview(self, filename):
+        """
+        Return (filename, JPEG thumbnail or None) of a local file: the one the
+        server sent with the manifest if the content matches, otherwise rendered
+        here. Runs on a background thread.
+        """
+        path = os.path.join(self.group_folder_path, filename)
+        try:
+            sha256 = self.engine.client.file_manifest.hash_for(path, os.stat(path))
+        except OSError:
+            return filename, None
+        return filename, self.engine.client.thumbnails.thumbnail(sha256, path, filename)
+
+    def show_preview(self, preview):
+        filename, data = preview
+        if not self.active or filename != self.file_list.selected():
+            return  # another file was selected meanwhile
+        self.preview_image = ImageTk.PhotoImage(Image.open(io.BytesIO(data))) if data else None
+        self.preview_label.config(image=self.preview_image or "")
 
     def open_selected_file(self, event):
-        selection = self.file_listbox.curselection()
-        if selection:
-            index = selection[0]
-            file_path = self.file_paths[index]
-            self.open_file(file_path)
+        filename = self.file_list.selected()
+        if filename:
+            self.open_file(os.path.join(self.group_folder_path, filename))
 
     def open_file(self, path):
         try:
@@ -167,14 +243,12 @@ class GroupState(State):
             print(f"Failed to open {path}: {e}")
 
     def remove_selected_file(self):
-        selection = self.file_listbox.curselection()
-        if selection:
-            index = selection[0]
-            file_path = self.file_paths[index]
+        filename = self.file_list.selected()
+        if filename:
+            file_path = os.path.join(self.group_folder_path, filename)
 
-            # Remove from listbox and file_paths
-            self.file_listbox.delete(index)
-            del self.file_paths[index]
+            # Remove from the list
+            self.file_list.remove(filename)
 
             # Remove the file locally
             if os.path.exists(file_path):
@@ -199,4 +273,7 @@ class GroupState(State):
         self.engine.pop_state()
 
     def destroy(self):
+        self.active = False
+        self.engine.root.after_cancel(self.sync_after_id)
+        self.engine.client.remove_event_listener(self.on_server_event)
         self.frame.destroy()
@@ -2,11 +2,14 @@ import socket
 import json
 import tkinter as tk
 from tkinter import PhotoImage
-import threading
-import time
 from GroupState import GroupState
 from State import State
 
+# New groups are pushed by the server; polling is only a slow safety net
+FALLBACK_REFRESH_INTERVAL = 60
+# Groups are listed a page at a time; the next page loads when the list is scrolled near its end
+GROUPS_PAGE_SIZE = 40
+SEARCH_DELAY_MS = 300
 
 class HomeState(State):
     def __init__(self, engine):
@@ -31,33 +34,137 @@ class HomeState(State):
         add_group_button.image = add_group_img  # Keep a reference to avoid garbage collection
         add_group_button.place(x=30, y=650)
 
+        # Search box: filters the groups by name as the user types
+        self.search_var = tk.StringVar()
+        search_entry = tk.Entry(self.frame, textvariable=self.search_var, font=("Helvetica", 14), width=24)
+        search_entry.place(x=1000, y=45)
+        self.search_var.trace_add("write", self.on_search_changed)
+        self.search_after_id = None
+
+        # Scrollable area holding the group buttons
+        self.groups_canvas = tk.Canvas(self.frame, bg="#DED1D1", highlightthickness=0)
+        self.groups_canvas.place(x=0, y=100, width=1260, height=540)
+        scrollbar = tk.Scrollbar(self.frame, orient="vertical", command=self.on_scrollbar)
+        scrollbar.place(x=1260, y=100, width=20, height=540)
+        self.groups_canvas.configure(yscrollcommand=scrollbar.set)
+        self.groups_frame = tk.Frame(self.groups_canvas, bg="#DED1D1")
+        self.groups_window = self.groups_canvas.create_window(0, 0, window=self.groups_frame, anchor="nw",
+                                                              width=1260, height=540)
+        self.frame.bind_all("<MouseWheel>", self.on_mouse_wheel)
+        self.frame.bind_all("<Button-4>", self.on_mouse_wheel)
+        self.frame.bind_all("<Button-5>", self.on_mouse_wheel)
+
         # Initialize variables to track the x and y positions of the group buttons
         self.group_x_position = 30  # Starting x-position for the first group button
-        self.group_y_position = 100  # Starting y-position for the first row of group buttons
+        self.group_y_position = 0  # Starting y-position for the first row of group buttons
         self.groups_in_current_line = 0  # Counter for groups in the current line
 
         # Store the group buttons for easy tracking later if needed
         self.group_buttons = []
 
-        # Start a background thread to refresh groups every 5 seconds
-        self.start_group_refresh_thread()
+        # Paging state: which listing is shown, where its next page starts and its version
+        self.listing = 0
+        self.next_cursor = None
+        self.loading = False
+        self.listing_version = None
 
-    def start_group_refresh_thread(self):
-        """Start a thread to refresh the groups every 5 seconds."""
-        refresh_thread = threading.Thread(target=self.refresh_groups_periodically)
-        refresh_thread.daemon = True  # Daemon thread will automatically close when the main program exits
-        refresh_thread.start()
+        # Listen for groups created by other clients
+        self.active = True
+        self.engine.client.add_event_listener(self.on_server_event)
 
-    def refresh_groups_periodically(self):
-        """Periodically refresh groups from the server every 5 seconds."""
-        while True:
-            self.load_groups_from_server()
-            time.sleep(5)  # Wait for 5 seconds before refreshing again
+        # Load the first page, subscribe to server events and check for missed changes now and then
+        self.load_page()
+        self.engine.dispatcher.submit(self.engine.client.subscribe)
+        self.refresh_after_id = self.engine.root.after(FALLBACK_REFRESH_INTERVAL * 1000, self.load_groups_from_server)
+
+    def on_server_event(self, event):
+        """Called on the client's reader thread for every pushed event."""
+        if event.get("event") == "group_added":
+            self.engine.dispatcher.call_in_ui(self.show_listed_groups, [{"name": event["group_name"]}])
 
     def load_groups_from_server(self):
-        """Load groups from the server and create buttons for them."""
-        groups = self.engine.client.receive_groups()
+        """
+        Reload the part of the list loaded so far in the background if the groups
+        changed on the server, then schedule the next check.
+        """
+        self.engine.dispatcher.submit(self.engine.client.list_groups, None,
+                                      max(len(self.group_buttons), GROUPS_PAGE_SIZE), None,
+                                      self.search_var.get().strip() or None, self.listing_version,
+                                      on_done=self.on_groups_reloaded)
+        self.refresh_after_id = self.engine.root.after(FALLBACK_REFRESH_INTERVAL * 1000, self.load_groups_from_server)
+
+    def on_groups_reloaded(self, reply):
+        """Add buttons for new groups from a reload (runs on the Tk thread)."""
+        if self.active and not reply.get("not_modified") and reply.get("version") is not None:
+            self.listing_version = reply["version"]
+            self.show_listed_groups(reply["groups"])
+
+    def load_page(self):
+        """Fetch the next page of the current listing in the background."""
+        if self.loading:
+            return
+        self.loading = True
+        listing = self.listing
+        self.engine.dispatcher.submit(self.engine.client.list_groups, self.next_cursor, GROUPS_PAGE_SIZE, None,
+                                      self.search_var.get().strip() or None,
+                                      on_done=lambda reply: self.show_page(listing, reply))
+
+    def show_page(self, listing, reply):
+        """Show a fetched page unless the search changed meanwhile (runs on the Tk thread)."""
+        if listing != self.listing or not self.active:
+            return
+        self.loading = False
+        self.next_cursor = reply.get("next_cursor")
+        self.listing_version = reply.get("version")
+        self.show_groups(reply.get("groups", []))
+        self.load_more_if_needed()
+
+    def load_more_if_needed(self):
+        """Load the next page once the list is scrolled near its end, or does not fill the view yet."""
+        if self.next_cursor is not None and self.groups_canvas.yview()[1] >= 0.9:
+            self.load_page()
+
+    def on_scrollbar(self, *args):
+        self.groups_canvas.yview(*args)
+        self.load_more_if_needed()
 
+    def on_mouse_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.groups_canvas.yview_scroll(-1, "units")
+        else:
+            self.groups_canvas.yview_scroll(1, "units")
+        self.load_more_if_needed()
+
+    def on_search_changed(self, *args):
+        """Restart the listing with the new search once the user stops typing."""
+        if self.search_after_id is not None:
+            self.engine.root.after_cancel(self.search_after_id)
+        self.search_after_id = self.engine.root.after(SEARCH_DELAY_MS, self.restart_listing)
+
+    def restart_listing(self):
+        self.search_after_id = None
+        for button in self.group_buttons:
+            button.destroy()
+        self.group_buttons = []
+        self.group_x_position, self.group_y_position, self.groups_in_current_line = 30, 0, 0
+        self.groups_canvas.yview_moveto(0)
+        self.listing += 1
+        self.next_cursor = None
+        self.loading = False
+        self.load_page()
+
+    def show_listed_groups(self, groups):
+        """
+        Show groups learned about outside of paging (pushed or polled) if they match
+        the search and fall within the pages loaded so far; later ones arrive with their page.
+        """
+        search = self.search_var.get().strip().lower()
+        self.show_groups([group for group in groups
+                          if search in group["name"].lower()
+                          and (self.next_cursor is None or group["name"] <= self.next_cursor)])
+
+    def show_groups(self, groups):
+        """Create buttons for groups that do not have one yet."""
         # Create a set of existing group names to avoid duplicates
         existing_groups = {button.cget("text") for button in self.group_buttons}
 
@@ -99,7 +206,7 @@ class HomeState(State):
         if group_name and group_password:
             self.add_group_button(group_name)
             print(f"{group_name} button added.")
-            self.engine.client.add_group(group_name, group_password)
+            self.engine.dispatcher.submit(self.engine.client.add_group, group_name, group_password)
         else:
             print("Group name and password cannot be empty!")
 
@@ -108,7 +215,7 @@ class HomeState(State):
     def add_group_button(self, group_name):
         """Create and add a group button."""
         # Create a button for the group with the entered name
-        group_button = tk.Button(self.frame, text=group_name, font=("Helvetica", 16), bg="#7D7979", fg="white", width=20, bd=0, activebackground="#7D7979",
+        group_button = tk.Button(self.groups_frame, text=group_name, font=("Helvetica", 16), bg="#7D7979", fg="white", width=20, bd=0, activebackground="#7D7979",
                                  height=5, command=lambda group=group_name: self.on_group_click(group))
 
         # Place the group button at the current x and y positions
@@ -130,6 +237,11 @@ class HomeState(State):
             # Reset the counter for groups in the current line
             self.groups_in_current_line = 0
 
+        # Grow the scrollable area to fit the rows
+        height = max(540, self.group_y_position + 200)
+        self.groups_canvas.itemconfigure(self.groups_window, height=height)
+        self.groups_canvas.configure(scrollregion=(0, 0, 1260, height))
+
     def on_group_click(self, group_name):
         password_popup = tk.Toplevel(self.engine.root)
         password_popup.title("Enter Password")
@@ -142,16 +254,31 @@ class HomeState(State):
         password_entry.pack(pady=10)
 
         def submit_password():
-            password = password_entry.get()
-            if self.engine.client.verify_group_password(group_name, password):
+            submit_button.config(state="disabled")
+            self.engine.dispatcher.submit(self.engine.client.verify_group_password, group_name, password_entry.get(),
+                                          on_done=on_verified, on_error=lambda e: on_verified(False))
+
+        def on_verified(verified):
+            if not self.active or not password_popup.winfo_exists():
+                return  # the popup was closed or the user left meanwhile
+            if verified:
                 password_popup.destroy()
                 from GroupState import GroupState
                 self.engine.push_state(GroupState(self.engine, group_name))
             else:
+                submit_button.config(state="normal")
                 print("Incorrect password")
 
         submit_button = tk.Button(password_popup, text="Enter", font=("Helvetica", 14), command=submit_password)
         submit_button.pack(pady=10)
 
     def destroy(self):
+        self.active = False
+        self.frame.unbind_all("<MouseWheel>")
+        self.frame.unbind_all("<Button-4>")
+        self.frame.unbind_all("<Button-5>")
+        if self.search_after_id is not None:
+            self.engine.root.after_cancel(self.search_after_id)
+        self.engine.root.after_cancel(self.refresh_after_id)
+        self.engine.client.remove_event_listener(self.on_server_event)
         self.frame.destroy()
@@ -1,37 +1,247 @@
+import bisect
 import json
+import os
+import threading
+from contextlib import nullcontext
+from FileLock import FileLock, file_id
+
+COMPACT_AFTER = 1000  # log entries before the log is folded into a new snapshot
 
 class JsonDataBase:
-    def __init__(self, filename="groups.json"):
+    def __init__(self, filename="groups.json", shared=False):
+        """
+        Groups are kept in memory in a dict keyed by name. The file holds a
+        snapshot; every new group is appended as one JSON line to a change log
+        next to it (filename + ".log"), and after COMPACT_AFTER entries the log
+        is folded into a new snapshot written to a temporary file and renamed
+        over the old one.
+
+        Reads only take the in-memory lock, which is never held during disk
+        I/O; writers are serialized by a separate write lock.
+
+        With shared set, several server processes use the same files. Writers
+        also hold an exclusive lock on filename + ".lock", and reads first check
+        (one stat of each file) whether another process appended to the log or
+        compacted it, and catch up.
+        """
         self.filename = filename
-        self.groups = self.load()
+        self.log_filename = filename + ".log"
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.file_lock = FileLock(filename + ".lock") if shared else None
+        self.listeners = []
+        with self.write_lock, self.locked():
+            self.groups = self.load()
+            self.sorted_names = sorted(self.groups)  # index for paging and prefix search
+            self.update_version()
+            if os.path.exists(self.log_filename) and os.path.getsize(self.log_filename):
+                self.write_snapshot()
+        self.log = open(self.log_filename, 'a', encoding='utf-8')
+
+    def locked(self, exclusive=True):
+        """The lock other processes' writers hold, or nothing if the files are not shared."""
+        return self.file_lock.hold(exclusive) if self.file_lock else nullcontext()
+
+    def update_version(self):
+        """
+        The version changes with every change, so callers can cache what they
+        derive from the groups. It is computed from the files (snapshot mtime and
+        log entries), so every process sharing them agrees on it and a version
+        never stands for two different group lists, even across restarts.
+        """
+        snapshot_id = self.snapshot_id
+        self.version = ((snapshot_id[1] // 1000 if snapshot_id else 0) << 20) + self.log_entries
+
+    def add_listener(self, callback):
+        """Call callback(group_name) whenever a new group is added."""
+        self.listeners.append(callback)
 
     def load(self):
-        """Load groups from the JSON file."""
+        """Load groups from the snapshot and replay the change log: {name: password}."""
+        groups = {}
+        self.snapshot_id = file_id(self.filename)
         try:
             with open(self.filename, 'r') as file:
-                data = json.load(file)
-                return data.get('groups', [])
+                for group in json.load(file).get('groups', []):
+                    groups[group['name']] = group['password']
         except (FileNotFoundError, json.JSONDecodeError):
-            return []
+            pass
+        self.log_offset = 0
+        self.log_entries = 0
+        self.read_log(groups)
+        return groups
+
+    def read_log(self, groups):
+        """
+        Apply the change log from log_offset on to groups and return the names
+        added. Stops at an incomplete or damaged line: in a single process it
+        was cut off by a crash and nothing after it was acknowledged, and when
+        shared it may still be being written.
+        """
+        added = []
+        try:
+            with open(self.log_filename, 'rb') as file:
+                file.seek(self.log_offset)
+                for line in file:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        group = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    if group['name'] not in groups:
+                        groups[group['name']] = group['password']
+                        added.append(group['name'])
+                    self.log_offset += len(line)
+                    self.log_entries += 1
+        except FileNotFoundError:
+            pass
+        return added
 
-    def save(self):
-        """Save groups to the JSON file."""
-        with open(self.filename, 'w') as file:
-            json.dump({"groups": self.groups}, file, indent=4)
+    def changed_on_disk(self):
+        log_id = file_id(self.log_filename)
+        return file_id(self.filename) != self.snapshot_id or (log_id[2] if log_id else 0) != self.log_offset
+
+    def catch_up(self):
+        """
+        Apply what other processes wrote since we last looked and return the
+        names of the groups they added (call with the write lock and the file
+        lock held).
+        """
+        log_id = file_id(self.log_filename)
+        log_size = log_id[2] if log_id else 0
+        if file_id(self.filename) != self.snapshot_id or log_size < self.log_offset:
+            groups = self.load()  # compacted by another process: read everything again
+            added = [name for name in groups if name not in self.groups]
+        else:
+            groups = dict(self.groups)
+            added = self.read_log(groups)
+        with self.lock:
+            self.groups = groups
+            for name in added:
+                bisect.insort(self.sorted_names, name)
+            self.update_version()
+        return added
+
+    def refresh(self):
+        """
+        Pick up groups other processes added (shared mode only) and tell the
+        listeners about them. Costs two stats when nothing changed.
+        """
+        if self.file_lock is None or not self.changed_on_disk():
+            return
+        with self.write_lock:
+            with self.locked(exclusive=False):
+                added = self.catch_up()
+        self.notify(added)
+
+    def notify(self, group_names):
+        for group_name in group_names:
+            for callback in self.listeners:
+                callback(group_name)
+
+    def compact(self):
+        """Write the groups to a new snapshot atomically and empty the change log."""
+        added = []
+        with self.write_lock, self.locked():
+            if self.file_lock:
+                added = self.catch_up()
+            self.write_snapshot()
+        self.notify(added)
+
+    def write_snapshot(self):
+        """compact() for a caller that holds the write lock and the file lock."""
+        with self.lock:
+            groups = [{"name": name, "password": password} for name, password in self.groups.items()]
+        temporary_path = f"{self.filename}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump({"groups": groups}, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self.filename)
+        # A crash before this truncate only replays groups the snapshot already has
+        with open(self.log_filename, 'w', encoding='utf-8'):
+            pass
+        self.snapshot_id = file_id(self.filename)
+        self.log_offset = 0
+        self.log_entries = 0
+        with self.lock:
+            self.update_version()
 
     def add_group(self, group_name, password):
-        """Add a new group with password."""
-        if not any(g['name'] == group_name for g in self.groups):
-            self.groups.append({"name": group_name, "password": password})
-            self.save()
+        """Add a new group with password. Returns True if the group was created."""
+        added = []
+        with self.write_lock, self.locked():
+            if self.file_lock:
+                added = self.catch_up()
+                if os.fstat(self.log.fileno()).st_size != self.log_offset:
+                    # Left by a process that died halfway through a line
+                    os.truncate(self.log.fileno(), self.log_offset)
+            with self.lock:
+                exists = group_name in self.groups
+            if not exists:
+                line = json.dumps({"name": group_name, "password": password}) + "\n"
+                self.log.write(line)
+                self.log.flush()
+                self.log_offset += len(line.encode('utf-8'))
+                self.log_entries += 1
+                with self.lock:
+                    self.groups[group_name] = password
+                    bisect.insort(self.sorted_names, group_name)
+                    self.update_version()
+                added.append(group_name)
+                if self.log_entries >= COMPACT_AFTER:
+                    self.write_snapshot()
+        self.notify(added)
+        return not exists
 
     def get_all_groups(self):
         """Return all group names."""
-        return [g['name'] for g in self.groups]
+        self.refresh()
+        with self.lock:
+            return list(self.groups)
+
+    def get_versioned_groups(self):
+        """Return the current version and all group names, read together."""
+        self.refresh()
+        with self.lock:
+            return self.version, list(self.groups)
+
+    def list_groups(self, cursor=None, limit=50, prefix=None, search=None):
+        """
+        Return (version, names, next_cursor): up to limit group names in sorted
+        order after cursor (the last name of the previous page), optionally only
+        names starting with prefix and containing search (case-insensitive).
+        next_cursor is None on the last page. A page holds at least one name.
+        """
+        limit = max(1, limit)
+        self.refresh()
+        with self.lock:
+            start = 0 if cursor is None else bisect.bisect_right(self.sorted_names, cursor)
+            if prefix:
+                start = max(start, bisect.bisect_left(self.sorted_names, prefix))
+            search = search.lower() if search else None
+            names = []
+            for index in range(start, len(self.sorted_names)):
+                name = self.sorted_names[index]
+                if prefix and not name.startswith(prefix):
+                    break
+                if search and search not in name.lower():
+                    continue
+                if len(names) == limit:  # one more match exists, so there is a next page
+                    return self.version, names, names[-1]
+                names.append(name)
+            return self.version, names, None
 
     def verify_password(self, group_name, password):
         """Verify password for a group."""
-        for group in self.groups:
-            if group['name'] == group_name:
-                return group['password'] == password
-        return False
+        self.refresh()
+        with self.lock:
+            stored = self.groups.get(group_name)
+        return stored is not None and stored == password
+
+    def current_version(self):
+        """Return the version, after catching up with other processes."""
+        self.refresh()
+        with self.lock:
+            return self.version
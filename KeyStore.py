@@ -0,0 +1,36 @@
+import os
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives import serialization
+
+
+def load_or_create_private_key(path, key_size=2048):
+    """
+    Load an RSA private key from a PEM file, generating and saving it on first use.
+    The file is created readable by the owner only and written atomically, so an
+    interrupted first run never leaves a truncated key behind.
+
+    The key was generated and written by us, so loading skips OpenSSL's RSA
+    consistency check, which otherwise costs about as much as generating a key.
+    """
+    try:
+        with open(path, "rb") as file:
+            return serialization.load_pem_private_key(file.read(), password=None,
+                                                      unsafe_skip_rsa_key_validation=True)
+    except FileNotFoundError:
+        pass
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+    pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, "wb") as file:
+        file.write(pem)
+    os.replace(temporary_path, path)
+    return private_key
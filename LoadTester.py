@@ -0,0 +1,421 @@
+"""
+Load generator for the ShareFiles server.
+
+Simulates concurrent users with the real Client protocol, headless (no Engine
+or Tk). Every user registers, logs in and joins one of a few shared groups,
+then until the run ends picks actions from a weighted mix: listing groups,
+verifying the group password, uploading and downloading files of sizes drawn
+from a size mix. Independently of the mix, every user polls the group list
+(conditional sendAllGroups) every poll interval, like the GUI does.
+
+Reports p50/p95/p99 latency per action, throughput, and the server's CPU and
+RSS, and can write the results as JSON to track regressions across server modes.
+The JSON also holds the server's own per-action statistics (its stats action).
+
+    python LoadTester.py --start-server threaded --users 50 --duration 60 --output threaded.json
+    python LoadTester.py --port 65432 --server-pid 1234 --sizes 64K:80 4M:20
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from Client import Client
+from KeyStore import load_or_create_private_key
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Server.py")
+PROFILE = "loadtest"
+GROUP_PASSWORD = "loadtest"
+ACTIONS = ("listGroups", "verifyGroupPassword", "upload", "download")
+
+
+def parse_size(text):
+    """'512', '64K', '4M' or '1G' -> bytes."""
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    text = text.strip().upper()
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def parse_weights(items, parse_key=str):
+    """['a:3', 'b:1'] -> {a: 3.0, b: 1.0}; an item without a weight counts 1."""
+    weights = {}
+    for item in items:
+        key, _, weight = item.partition(":")
+        weights[parse_key(key)] = float(weight or 1)
+    return weights
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def free_port():
+    with socket.create_server(("127.0.0.1", 0)) as listener:
+        return listener.getsockname()[1]
+
+
+class ServerMonitor:
+    """
+    Samples the CPU time and RSS of the server process once a second. Uses
+    psutil when installed, /proc otherwise (Linux only); without either the
+    server numbers are left out.
+    """
+
+    def __init__(self, pid, interval=1.0):
+        self.pid = pid
+        self.interval = interval
+        self.process = psutil.Process(pid) if psutil is not None else None
+        self.samples = []  # (wall time, cpu seconds, rss bytes)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def sample(self):
+        if self.process is not None:
+            times = self.process.cpu_times()
+            return times.user + times.system, self.process.memory_info().rss
+        with open(f"/proc/{self.pid}/stat") as file:
+            fields = file.read().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        cpu = (int(fields[11]) + int(fields[12])) / ticks  # utime and stime
+        rss = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+        return cpu, rss
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                self.samples.append((time.monotonic(), *self.sample()))
+            except (OSError, IndexError, ValueError) as e:
+                print(f"Stopped sampling the server: {e}", file=sys.stderr)
+                return
+            if self.stopped.wait(self.interval):
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        try:
+            self.samples.append((time.monotonic(), *self.sample()))
+        except (OSError, IndexError, ValueError):
+            pass
+
+    def summary(self):
+        if len(self.samples) < 2:
+            return None
+        (start, start_cpu, _), (end, end_cpu, end_rss) = self.samples[0], self.samples[-1]
+        return {
+            "pid": self.pid,
+            "cpu_seconds": end_cpu - start_cpu,
+            "cpu_percent": 100 * (end_cpu - start_cpu) / (end - start),
+            "rss_peak_mb": max(rss for _, _, rss in self.samples) / 1024 ** 2,
+            "rss_end_mb": end_rss / 1024 ** 2,
+        }
+
+
+def start_server(directory, mode, workers, port):
+    """Start Server.py in directory and wait until it accepts connections."""
+    process = subprocess.Popen([sys.executable, SERVER_SCRIPT, "--port", str(port), "--mode", mode,
+                                "--workers", str(workers)],
+                               cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError("Server exited during startup")
+            time.sleep(0.05)
+    process.terminate()
+    raise RuntimeError("Server did not start within 30 seconds")
+
+
+class User:
+    """
+    One simulated user on its own connection. Latencies are kept per user and
+    merged at the end, so recording them takes no locks.
+    """
+
+    def __init__(self, number, options, work_dir, run_id):
+        self.number = number
+        self.options = options
+        self.random = random.Random(options.seed + number)
+        self.username = f"load-{run_id}-{number}"
+        self.group_name = f"load-{run_id}-group-{number % options.groups}"
+        self.work_dir = os.path.join(work_dir, f"user{number}")
+        self.latencies = {}
+        self.errors = {}
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self.uploaded = []  # (filename, size) of what this user uploaded, to download later
+        self.uploads = 0
+        self.client = None
+        self.files = {}  # size -> path of this user's source file of that size
+
+    def timed(self, action, call, *args, check=None):
+        """
+        Run one action and record its latency. Exceptions and results that
+        check(result) rejects are counted as errors instead.
+        """
+        start = time.perf_counter()
+        try:
+            result = call(*args)
+        except Exception:
+            result = None
+            check = bool
+        if check is not None and not check(result):
+            self.errors[action] = self.errors.get(action, 0) + 1
+            return None
+        self.latencies.setdefault(action, []).append(time.perf_counter() - start)
+        return result
+
+    def connect(self):
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.client = self.timed("connect", Client, self.options.host, self.options.port, PROFILE, False)
+        if self.client is None:
+            return False
+        self.client.save_dir = os.path.join(self.work_dir, "downloads")
+        self.client.sync_dir = os.path.join(self.client.save_dir, ".sync")
+        self.timed("register", self.client.register, self.username, "password")
+        if not self.timed("login", self.client.log_in, self.username, "password", check=bool):
+            return False
+        self.timed("addGroup", self.client.add_group, self.group_name, GROUP_PASSWORD)
+        return True
+
+    def source_file(self, size):
+        """A file of random bytes of the given size, reused by this user's uploads."""
+        path = self.files.get(size)
+        if path is None:
+            path = os.path.join(self.work_dir, f"source-{size}.bin")
+            with open(path, "wb") as file:
+                remaining = size
+                while remaining:
+                    chunk = min(remaining, 1024 * 1024)
+                    file.write(self.random.randbytes(chunk))
+                    remaining -= chunk
+            self.files[size] = path
+        return path
+
+    def upload(self):
+        sizes = self.options.size_weights
+        size = self.random.choices(list(sizes), list(sizes.values()))[0]
+        path = self.source_file(size)
+        # A fresh header per upload, so the server cannot skip it as content it already has
+        self.uploads += 1
+        with open(path, "r+b") as file:
+            file.write(f"{self.username}:{self.uploads}:".encode().ljust(min(size, 64), b"\0")[:size])
+        filename = f"{self.username}-{self.uploads}.bin"
+        staged = os.path.join(self.work_dir, filename)
+        os.replace(path, staged)
+        try:
+            if self.timed("upload", self.client.send_file, staged, self.group_name, 0, check=bool):
+                self.bytes_up += size
+                self.uploaded.append((filename, size))
+        finally:
+            os.replace(staged, path)
+
+    def download(self):
+        if not self.uploaded:
+            return self.upload()
+        filename, size = self.random.choice(self.uploaded)
+        if self.timed("download", self.client.receive_all_files, self.group_name, [filename], check=bool):
+            self.bytes_down += size
+            os.remove(os.path.join(self.client.save_dir, self.group_name, filename))
+
+    def run(self, ready, clock):
+        connected = self.connect()
+        ready.wait()  # the clock starts once every user is connected and logged in
+        if connected:
+            self.run_actions(clock["deadline"])
+        if self.client is not None:
+            self.client.close_connection()
+
+    def run_actions(self, deadline):
+        actions = {
+            "listGroups": lambda: self.timed("listGroups", self.client.list_groups, None, self.options.page_size,
+                                             check=lambda reply: reply.get("version") is not None),
+            "verifyGroupPassword": lambda: self.timed("verifyGroupPassword", self.client.verify_group_password,
+                                                      self.group_name, GROUP_PASSWORD, check=bool),
+            "upload": self.upload,
+            "download": self.download,
+        }
+        mix = self.options.action_weights
+        next_poll = time.monotonic() + self.random.uniform(0, self.options.poll_interval)
+        while time.monotonic() < deadline:
+            if self.options.poll_interval and time.monotonic() >= next_poll:
+                self.timed("poll", self.client.receive_groups, True)
+                next_poll += self.options.poll_interval
+            actions[self.random.choices(list(mix), list(mix.values()))[0]]()
+            if self.options.think_time:
+                time.sleep(self.random.expovariate(1 / self.options.think_time))
+
+
+def run_load(options):
+    """Run the users against the server and return the results as a dict."""
+    run_id = f"{int(time.time())}-{os.getpid()}"
+    # Create the shared client key once, before the users load it concurrently
+    load_or_create_private_key(os.path.join(os.path.expanduser("~"), ".sharefiles", PROFILE, "client_key.pem"))
+    monitor = ServerMonitor(options.server_pid) if options.server_pid else None
+    clock = {}
+
+    def start_clock():
+        clock["started"] = time.monotonic()
+        clock["deadline"] = clock["started"] + options.duration
+        if monitor is not None:
+            monitor.start()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        users = [User(number, options, work_dir, run_id) for number in range(options.users)]
+        ready = threading.Barrier(options.users, action=start_clock)
+        threads = [threading.Thread(target=user.run, args=(ready, clock), daemon=True) for user in users]
+        # Client methods print as they go; keep the report readable
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        elapsed = time.monotonic() - clock["started"]
+        if monitor is not None:
+            monitor.stop()
+    return summarize(options, users, elapsed, monitor, server_stats(options))
+
+
+def server_stats(options):
+    """The server's own per-action statistics (the stats action), or None if it has none."""
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            client = Client(options.host, options.port, PROFILE, start_engine=False)
+            try:
+                return client.request({"action": "stats"})
+            finally:
+                client.close_connection()
+    except Exception:
+        return None
+
+
+def summarize(options, users, elapsed, monitor, server_actions):
+    latencies, errors = {}, {}
+    for user in users:
+        for action, values in user.latencies.items():
+            latencies.setdefault(action, []).extend(values)
+        for action, count in user.errors.items():
+            errors[action] = errors.get(action, 0) + count
+
+    actions = {}
+    for action in sorted(latencies.keys() | errors.keys()):
+        values = sorted(latencies.get(action, []))
+        actions[action] = {
+            "count": len(values),
+            "errors": errors.get(action, 0),
+            "mean_ms": 1000 * sum(values) / len(values) if values else None,
+            **{f"p{p}_ms": 1000 * percentile(values, p) if values else None for p in (50, 95, 99)},
+            "max_ms": 1000 * values[-1] if values else None,
+        }
+    # Connecting and logging in happen before the clock starts
+    timed_actions = [name for name in actions if name not in ("connect", "register", "login", "addGroup")]
+    return {
+        "label": options.label,
+        "server_mode": options.start_server,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {
+            "users": options.users, "duration": options.duration, "groups": options.groups,
+            "mix": options.action_weights, "sizes": options.size_weights,
+            "poll_interval": options.poll_interval, "think_time": options.think_time, "seed": options.seed,
+        },
+        "elapsed": elapsed,
+        "actions": actions,
+        "throughput": {
+            "actions_per_sec": sum(actions[name]["count"] for name in timed_actions) / elapsed,
+            "upload_mb_per_sec": sum(user.bytes_up for user in users) / 1024 ** 2 / elapsed,
+            "download_mb_per_sec": sum(user.bytes_down for user in users) / 1024 ** 2 / elapsed,
+        },
+        "server": monitor.summary() if monitor is not None else None,
+        "server_stats": server_actions,
+    }
+
+
+def print_report(results):
+    def ms(value):
+        return f"{value:9.1f}" if value is not None else f"{'-':>9}"
+
+    print(f"{results['config']['users']} users for {results['elapsed']:.1f} s"
+          + (f" against the {results['server_mode']} server" if results["server_mode"] else ""))
+    print(f"{'action':<20} {'count':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for action, stats in results["actions"].items():
+        print(f"{action:<20} {stats['count']:>7} {stats['errors']:>7} {ms(stats['p50_ms'])} "
+              f"{ms(stats['p95_ms'])} {ms(stats['p99_ms'])} {ms(stats['max_ms'])}")
+    throughput = results["throughput"]
+    print(f"{throughput['actions_per_sec']:.1f} actions/s, upload {throughput['upload_mb_per_sec']:.2f} MB/s, "
+          f"download {throughput['download_mb_per_sec']:.2f} MB/s")
+    server = results["server"]
+    if server is not None:
+        print(f"Server: {server['cpu_percent']:.1f}% CPU, RSS peak {server['rss_peak_mb']:.1f} MB, "
+              f"end {server['rss_end_mb']:.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ShareFiles load generator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=65432)
+    parser.add_argument("--start-server", choices=["threaded", "async"],
+                        help="start a fresh Server.py in this mode in a temporary folder instead of using --port")
+    parser.add_argument("--workers", type=int, default=32, help="worker pool size of a started server")
+    parser.add_argument("--server-pid", type=int, help="pid of an already running server to sample CPU/RSS of")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run after all users logged in")
+    parser.add_argument("--groups", type=int, default=4, help="number of groups the users are spread over")
+    parser.add_argument("--mix", nargs="+", default=["listGroups:4", "verifyGroupPassword:2", "upload:1", "download:2"],
+                        help=f"action weights as action:weight, actions: {', '.join(ACTIONS)}")
+    parser.add_argument("--sizes", nargs="+", default=["16K:6", "256K:3", "4M:1"],
+                        help="upload size weights as size:weight, sizes like 512, 64K, 4M")
+    parser.add_argument("--poll-interval", type=float, default=5, help="seconds between group list polls (0: off)")
+    parser.add_argument("--think-time", type=float, default=0.2, help="mean seconds between a user's actions")
+    parser.add_argument("--page-size", type=int, default=50, help="groups per listGroups request")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--label", help="name of this run in the results")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    options = parser.parse_args()
+
+    options.action_weights = parse_weights(options.mix)
+    unknown = options.action_weights.keys() - set(ACTIONS)
+    if unknown:
+        parser.error(f"unknown actions in --mix: {', '.join(sorted(unknown))}")
+    options.size_weights = parse_weights(options.sizes, parse_size)
+
+    server = None
+    with tempfile.TemporaryDirectory() as server_dir:
+        try:
+            if options.start_server:
+                options.host, options.port = "127.0.0.1", free_port()
+                server = start_server(server_dir, options.start_server, options.workers, options.port)
+                options.server_pid = server.pid
+            results = run_load(options)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    print_report(results)
+    if options.output:
+        with open(options.output, "w") as file:
+            json.dump(results, file, indent=4)
+        print(f"Results written to {options.output}")
@@ -34,9 +34,9 @@ class LogInState(State):
         password_entry.grid(row=1, column=1, padx=10, pady=5, ipadx=20, ipady=8)
 
         # Submit Button
-        submit_button = tk.Button(self.frame, text="Submit", font=("Helvetica", 16),
+        self.submit_button = tk.Button(self.frame, text="Submit", font=("Helvetica", 16),
                                   bg="#00B1E2", fg="white", command=self.submit_clicked)
-        submit_button.pack(pady=20, ipadx=10, ipady=5)
+        self.submit_button.pack(pady=20, ipadx=10, ipady=5)
 
         # Error message label
         self.error_label = tk.Label(self.frame, text="", font=("Helvetica", 14),
@@ -61,7 +61,18 @@ class LogInState(State):
         print(f"Username: {username}")
         print(f"Password: {password}")
 
-        if self.engine.client.log_in(username, password):
+        # Log in on a background thread; the button stays disabled until the reply is in
+        self.submit_button.config(state="disabled")
+        self.error_label.config(text="Logging in...")
+        self.engine.dispatcher.submit(self.engine.client.log_in, username, password,
+                                      on_done=self.on_log_in, on_error=lambda e: self.on_log_in(False))
+
+    def on_log_in(self, success):
+        """Called on the Tk thread with the result of log_in."""
+        if not self.frame.winfo_exists():
+            return  # the user left this screen meanwhile
+        self.submit_button.config(state="normal")
+        if success:
             self.error_label.config(text="")
             self.destroy()
             self.engine.push_state(HomeState(self.engine))
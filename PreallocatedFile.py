@@ -0,0 +1,118 @@
+import mmap
+import os
+import threading
+
+ALLOCATION_STEP = 4 * 1024 * 1024  # disk is reserved this far ahead of the data, never past the file's size
+
+
+class PreallocatedFile:
+    """
+    A file of known size received in order, written through a memory map.
+
+    The file is extended to size (sparsely, taking no disk) and mapped from
+    offset (where a resumed upload continues) to its end. Disk is reserved
+    with posix_fallocate in ALLOCATION_STEP pieces just ahead of the data, so
+    a full disk fails the transfer instead of faulting a write into the map,
+    and an abandoned transfer holds no more disk than it was sent.
+
+    Data is either copied into the map with write, or received straight into
+    it: the connection's reader asks for the next window of the file,
+    receives (or decrypts) a frame into it, and the handler then commits the
+    window with write, which copies nothing.
+
+    window runs on the reader thread and write and close on the handler
+    thread; windows must be committed in the order they were handed out.
+    """
+
+    def __init__(self, path, size, offset=0):
+        if offset > size:
+            raise ValueError(f"Offset {offset} is past the end of the {size} byte file.")
+        self.path = path
+        self.size = size
+        self.position = offset  # end of the committed data
+        self.reserved = offset  # end of the windows handed out
+        self.allocated = offset  # end of the disk reserved by this object
+        self.lock = threading.Lock()
+        self.descriptor = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o666)
+        try:
+            if os.fstat(self.descriptor).st_size < size:
+                os.ftruncate(self.descriptor, size)
+            # The map has to start at a multiple of the allocation granularity
+            self.start = offset - offset % mmap.ALLOCATIONGRANULARITY
+            self.mapping = mmap.mmap(self.descriptor, size - self.start, offset=self.start) if size > offset else None
+        except BaseException:
+            os.close(self.descriptor)
+            raise
+        self.view = memoryview(self.mapping) if self.mapping is not None else None
+
+    def allocate(self, end):
+        """Reserve disk for the file up to at least end; raises OSError (ENOSPC) if the disk is full."""
+        if end <= self.allocated or not hasattr(os, "posix_fallocate"):
+            return
+        end = min(self.size, max(end, self.allocated + ALLOCATION_STEP))
+        os.posix_fallocate(self.descriptor, self.allocated, end - self.allocated)
+        self.allocated = end
+
+    def window(self, length):
+        """
+        Hand out the next length bytes of the file as a writable memoryview, or
+        None if they do not fit (or the file is closed); the caller then reads
+        the data elsewhere and passes it to write.
+        """
+        with self.lock:
+            begin = self.reserved - self.start
+            if self.view is None or length <= 0 or begin + length > len(self.view):
+                return None
+            try:
+                self.allocate(self.reserved + length)
+            except OSError:
+                return None  # the frame is copied instead, and write reports the error
+            self.reserved += length
+            return self.view[begin:begin + length]
+
+    def expect(self, count):
+        """Leave room for count bytes that are still to be copied in with write before the first window."""
+        with self.lock:
+            self.reserved += count
+
+    def write(self, data):
+        """
+        Commit the next len(data) bytes of the file and return their count. A
+        window is already in place and is released; any other data is copied.
+        """
+        count = len(data)
+        if not count:
+            return 0
+        if isinstance(data, memoryview) and self.mapping is not None and data.obj is self.mapping:
+            data.release()
+        else:
+            begin = self.position - self.start
+            if self.view is None or begin + count > len(self.view):
+                raise ValueError(f"Received more than the announced {self.size} bytes.")
+            with self.lock:
+                self.allocate(self.position + count)
+                self.reserved = max(self.reserved, self.position + count)
+            self.view[begin:begin + count] = data
+        self.position += count
+        return count
+
+    def close(self):
+        """Unmap the file. The data reaches the disk with the page cache, like any write."""
+        with self.lock:
+            view, self.view = self.view, None
+            descriptor, self.descriptor = self.descriptor, None
+        if descriptor is not None:
+            os.close(descriptor)
+        if view is None:
+            return
+        view.release()
+        try:
+            self.mapping.close()
+        except BufferError:
+            pass  # a window is still being received into; the map goes away with it
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,63 @@
+import queue
+import time
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+DELIVERY_BUDGET = 0.008  # seconds of callbacks per engine tick, so a burst of results never stalls a frame
+
+
+class RequestDispatcher:
+    """
+    Runs blocking client calls for the GUI off the Tk thread.
+
+    submit() runs a call on a small pool of I/O threads and returns its Future.
+    Its on_done/on_error callbacks, and anything passed to call_in_ui() from
+    another thread, are queued and run on the Tk thread by deliver(), which the
+    engine calls from its root.after loop. Tk is therefore only ever touched
+    from the Tk thread. The calls may share the client's connection: replies
+    are matched to their request by id.
+    """
+
+    def __init__(self, workers=4):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Request")
+        self.results = queue.Queue()
+
+    def submit(self, function, *args, on_done=None, on_error=None):
+        """
+        Run function(*args) in the background. on_done(result) or on_error(exception)
+        is then called on the Tk thread; exceptions without an on_error are printed.
+        """
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(lambda done: self.results.put(partial(self.finish, done, on_done, on_error)))
+        return future
+
+    def call_in_ui(self, function, *args):
+        """Run function(*args) on the Tk thread; safe to call from any thread."""
+        self.results.put(partial(function, *args))
+
+    def finish(self, future, on_done, on_error):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            if on_error is not None:
+                on_error(future.exception())
+            else:
+                print(f"Background request failed: {future.exception()}")
+        elif on_done is not None:
+            on_done(future.result())
+
+    def deliver(self):
+        """Run queued callbacks on the Tk thread until the queue is empty or the budget is spent."""
+        deadline = time.monotonic() + DELIVERY_BUDGET
+        while time.monotonic() < deadline:
+            try:
+                callback = self.results.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error in request callback: {e}")
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
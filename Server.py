@@ -1,33 +1,119 @@
 import socket
 import os
 import threading
+import asyncio
+import argparse
+import contextlib
+import queue
+import selectors
+import time
+from concurrent.futures import ThreadPoolExecutor
 from cryptography.hazmat.primitives.serialization import load_pem_public_key
-from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives import hashes
 import SqlDataBase
 import json
 import random
+import hashlib
+import string
+import tempfile
+import base64
+import DeltaSync
+import Compression
+from Compression import StreamCompressor, StreamDecompressor, TransferStats
 from JsonDataBase import JsonDataBase
+from BlobStore import BlobStore
+from Thumbnails import ThumbnailCache, ThumbnailService, can_preview
+from FileManifest import file_sha256
+from FileLock import FileLock
+from PreallocatedFile import PreallocatedFile
+from KeyStore import load_or_create_private_key
+from AsyncConnection import AsyncConnection
+from SessionCipher import SessionCipher
+from ClientSession import ClientSession, INBOX_WAIT
+from ServerStats import ServerStats
+from ServerLogging import start_logging, ACTION_RECEIVED
+from FrameCodec import FrameCodec, HELLO, REQUEST, RESPONSE, DATA, FILE, END, EVENT, PING, PONG, CHUNK_SIZE, \
+    TRANSFER_CHUNK, UPLOAD_CHUNK
 import logging
 
+GROUP_PAGE_SIZE = 50
+MAX_GROUP_PAGE_SIZE = 500
+THUMBNAIL_CACHE_SIZE = 256 * 1024 * 1024
+MAX_MANIFEST_THUMBNAILS = 2 * 1024 * 1024  # thumbnail bytes per manifest reply; the rest come with later ones
+LOG_FILE = 'server_logs.log'
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUPS = 5
+SHARED_STATE_POLL = 1.0  # seconds between checks for changes other worker processes made
+LISTEN_BACKLOG = 1024  # the kernel caps it at net.core.somaxconn
+MAX_SESSIONS = 1000
+MAX_TRANSFERS_PER_USER = 8
+TRANSFER_ACTIONS = {"receiveFile", "sendAllFiles", "deltaUpload", "sendDelta", "uploadChunk"}
+RETRY_AFTER = 2  # seconds a turned-away client is told to wait
+TRANSFER_WAIT = 0.5  # seconds a transfer waits for a slot before the client is told to retry
+HANDSHAKE_TIMEOUT = 10  # seconds a new connection has to set up its session
+IDLE_TIMEOUT = 120  # clients send a heartbeat every FrameCodec.HEARTBEAT_INTERVAL seconds
+TURN_AWAY_TIMEOUT = 1.0
+UPLOAD_EXPIRY = 24 * 60 * 60  # seconds an unfinished upload is kept after its last chunk
+UPLOAD_SWEEP_INTERVAL = 60 * 60
+
 class Server:
-    def __init__(self, host='127.0.0.1', port=65432, udp_port=12345, save_dir="Groups"):
+    def __init__(self, host='127.0.0.1', port=65432, udp_port=12345, save_dir="Groups", mode="threaded",
+                 max_workers=32, encrypt_payloads=True, key_file="server_key.pem", stats_file=None,
+                 stats_interval=60, log_sample=1, log_file=LOG_FILE, shared_state=False, reuse_port=False,
+                 listen_socket=None, backlog=LISTEN_BACKLOG, max_sessions=MAX_SESSIONS,
+                 max_transfers_per_user=MAX_TRANSFERS_PER_USER, idle_timeout=IDLE_TIMEOUT):
         """
-        Initialize the Server, generate keys, and start the server socket.
+        Initialize the Server, load its keys, and start the server socket. The
+        options are described by the command line flags in __main__;
+        ServerCluster sets shared_state, reuse_port and listen_socket for its workers.
         """
-        # Initialize the databases (SQL and JSON)
+        self.shared_state = shared_state
+        # Initialize the databases (SQL and JSON); SQLite coordinates processes by itself
         self.sql_data_base = SqlDataBase.SqlDataBase()
-        self.json_data_base = JsonDataBase()
+        self.json_data_base = JsonDataBase(shared=shared_state)
         self.save_dir = save_dir
+        os.makedirs(save_dir, exist_ok=True)
+        # Group files live in a content-addressed store; thumbnails are rendered in the background
+        self.blob_store = BlobStore(save_dir, shared=shared_state)
+        self.thumbnails = ThumbnailService(ThumbnailCache(os.path.join(save_dir, ".thumbnails"),
+                                                          THUMBNAIL_CACHE_SIZE))
+        # Partial files of resumable uploads, one per upload id
+        self.uploads_dir = os.path.join(save_dir, ".uploads")
+        os.makedirs(self.uploads_dir, exist_ok=True)
+        self.upload_locks = {}
+        self.upload_locks_lock = threading.Lock()
+        # Sessions that asked to be told about group and file changes
+        self.subscribers = set()
+        self.subscribers_lock = threading.Lock()
+        self.json_data_base.add_listener(lambda group_name: self.publish("group_added", group_name=group_name))
+        # Encoded sendAllGroups reply and the group store version it was built from
+        self.group_list = (None, b"")
+        self.group_list_lock = threading.Lock()
         # Set host and ports for the server
         self.host = host
         self.port = port
         self.udp_port = udp_port
         self.players = []
+        self.mode = mode
+        self.max_workers = max_workers
+        self.max_sessions = max_sessions
+        self.max_transfers_per_user = max_transfers_per_user
+        self.idle_timeout = idle_timeout
+        # Open sessions, sessions turned away, and running transfers per user
+        self.sessions_lock = threading.Lock()
+        self.transfers_changed = threading.Condition(self.sessions_lock)
+        self.session_count = 0
+        self.sessions_turned_away = 0
+        self.transfers = {}
+        self.connected_users = {}  # username -> its logged-in sessions
+        self.encrypt_payloads = encrypt_payloads
+        # Action handlers run on this pool in both modes so requests on one connection can overlap
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ServerWorker")
 
-        # Generate RSA keys (private and public) for encryption/decryption
+        # Load (or create on first run) the RSA keys used for the session handshake
+        self.key_file = key_file
         self.private_key, self.public_key = self.make_keys()
         self.public_key_pem = self.public_key.public_bytes(
             encoding=serialization.Encoding.PEM,
@@ -35,35 +121,54 @@ class Server:
         )
 
         # Set up logging
-        self.setup_logging()
+        self.setup_logging(log_sample, log_file)
+
+        self.stats = ServerStats()
+        if stats_file:
+            self.stats.dump_periodically(stats_file, stats_interval, self.logger)
+
+        # Files left in plain group folders by older versions move into the blob store
+        migrated = self.blob_store.migrate()
+        if migrated:
+            self.logger.info("Moved %s files from group folders into the blob store", migrated)
 
         # Print all users from the database (for debugging)
         self.sql_data_base.print_all_users()
 
         # Set up the server socket and start listening for incoming connections
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)
-        self.logger.info(f"Server listening on {self.host}:{self.port}...")
+        if listen_socket is not None:
+            self.server_socket = listen_socket
+        else:
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # Closing idle connections leaves TIME_WAIT entries that would otherwise block a restart
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.server_socket.bind((self.host, self.port))
+            self.server_socket.listen(backlog)
+        self.logger.info("Server listening on %s:%s...", self.host, self.port)
+        if shared_state:
+            threading.Thread(target=self.watch_shared_state, daemon=True, name="SharedStateWatcher").start()
+        threading.Thread(target=self.sweep_uploads_periodically, daemon=True, name="UploadSweeper").start()
 
         # Start accepting incoming connections in a loop
         self.logger.info("Server is running...")
-        self.connected_users = {}
-        self.listen_for_clients()
+        if self.mode == "async":
+            self.serve_async()
+        else:
+            self.listen_for_clients()
 
-    def setup_logging(self):
-        """Setup a basic logging configuration."""
+    def setup_logging(self, sample_every=1, log_file=LOG_FILE):
+        """Log to a rotating file through a queue and a writer thread."""
         self.logger = logging.getLogger('ServerLogger')
         self.logger.setLevel(logging.INFO)
-        handler = logging.FileHandler('server_logs.log')
-        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-        self.logger.addHandler(handler)
+        self.log_listener = start_logging(self.logger, log_file, LOG_MAX_BYTES, LOG_BACKUPS, sample_every)
 
     def make_keys(self):
         """
-        Generate a new RSA key pair (private and public).
+        Load the server's RSA key pair from key_file, generating it on the first run.
         """
-        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        private_key = load_or_create_private_key(self.key_file)
         public_key = private_key.public_key()
         return private_key, public_key
 
@@ -80,69 +185,368 @@ class Server:
             )
         )
 
+    def server_hello(self, compression):
+        """
+        The server's handshake message: its public key and the session options it enforces,
+        including the compression algorithm picked from the ones the client offered.
+        """
+        return json.dumps({
+            "public_key": self.public_key_pem.decode(),
+            "plain_data": not self.encrypt_payloads,
+            "compression": compression,
+        }).encode()
+
+    def open_session(self, encrypted_key):
+        """
+        Unwrap the session key the client sent with our public key and build
+        the cipher used for every following message on the connection.
+        """
+        return SessionCipher(self.decrypt(encrypted_key), is_server=True)
+
     def listen_for_clients(self):
         """
         Accept incoming client connections and handle them using separate threads.
         """
+        self.turned_away = queue.Queue()
+        threading.Thread(target=self.close_turned_away, daemon=True, name="TurnAwayCloser").start()
         while True:
             client_socket, client_address = self.server_socket.accept()
-            self.logger.info(f"Connection established with {client_address}")
+            if not self.admit_session():
+                self.logger.warning("Turned away %s: %s sessions open", client_address, self.max_sessions)
+                self.turn_away(client_socket)
+                continue
+            self.logger.info("Connection established with %s", client_address)
             client_thread = threading.Thread(target=self.handle_client, args=(client_socket, client_address))
             client_thread.start()
 
     def handle_client(self, client_socket, client_address):
         """
-        Handle communication with a connected client.
+        Read every frame from a connected client and route it (runs on the client's own thread).
         """
+        codec = FrameCodec(client_socket)
+        session = None
         try:
+            client_socket.settimeout(HANDSHAKE_TIMEOUT)
             # Receive the public key of the client and send the server's public key
-            public_client_key_pem = client_socket.recv(1024)
-            public_client_key = load_pem_public_key(public_client_key_pem)
-            client_socket.send(self.public_key_pem)
+            hello = json.loads(codec.read_frame().payload)
+            public_client_key = load_pem_public_key(hello["public_key"].encode())
+            compression = Compression.negotiate(hello.get("compression"))
+            codec.send(HELLO, 0, self.server_hello(compression))
+
+            # One RSA operation per session: receive the wrapped session key
+            codec.cipher = self.open_session(codec.read_frame().payload)
+            codec.plain_data = not self.encrypt_payloads
+            codec.compression = compression
+            session = ClientSession(codec, client_address, self.idle_timeout)
+            client_socket.settimeout(self.idle_timeout)
 
             while True:
-                try:
-                    message = self.decrypt(client_socket.recv(1024))
-                except Exception as e:
-                    self.logger.error(f"Decryption error with client {client_address}: {e}")
-                    message = client_socket.recv(1024).decode()
-
-                data = json.loads(message)  # Decode the JSON data
-
-                action = data.get("action")
-                self.logger.info(f"Action received: {action}")
-
-                if action == 'login':
-                    self.handle_login(data, client_socket)
-
-                elif action == 'register':
-                    self.handle_register(data, client_socket)
-                elif action == 'receiveFile':
-                    self.receive_file(data, client_socket)
-                elif action == 'sendAllFiles':
-                    self.send_all_files(data["group_name"], client_socket)
-                elif action == "removeFile":
-                    self.remove_file(data["group_name"], data["filename"])
-                elif action == 'sendAllGroups':
-                    self.send_groups(client_socket)
-                elif action == 'addGroup':
-                    self.json_data_base.add_group(data["group_name"], data["group_password"])
-                elif action == "verifyGroupPassword":
-                    self.verify_password(client_socket, data["group_name"],  data["password"])
-
-                elif action == 'disconnect':
-                    self.handle_disconnect(data, client_socket)
-                elif action == 'logout':
-                    self.handle_logout(data, client_socket)
+                frame = codec.read_frame(session.payload_target)
+                if frame is None:
+                    break
+                self.route_frame(session, frame)
+
+        except socket.timeout:
+            self.logger.info("Connection with %s timed out", client_address)
 
         except Exception as e:
-            self.logger.error(f"Error with client {client_address}: {e}")
+            self.logger.error("Error with client %s: %s", client_address, e)
 
         finally:
+            self.end_session(session)
             client_socket.close()
-            self.logger.info(f"Closed connection with {client_address}")
+            self.logger.info("Closed connection with %s", client_address)
+
+    def admit_session(self):
+        """Count a new connection in, unless max_sessions are open already."""
+        with self.sessions_lock:
+            if self.session_count >= self.max_sessions:
+                self.sessions_turned_away += 1
+                return False
+            self.session_count += 1
+            return True
+
+    def end_session(self, session):
+        """Forget a closed connection (session is None if it closed during the handshake)."""
+        with self.sessions_lock:
+            self.session_count -= 1
+        if session:
+            self.forget_login(session)
+            self.unsubscribe(session)
+            session.close()
+
+    def busy_hello(self):
+        """The handshake reply to a connection turned away: the client raises ServerBusy on it."""
+        return json.dumps({"busy": True, "error": "Server busy, too many connections.",
+                           "retry_after": RETRY_AFTER}).encode()
+
+    def turn_away(self, client_socket):
+        """
+        Answer a connection over the session limit with a busy HELLO and leave
+        closing it to close_turned_away. Never waits on the client, so the
+        accept loop goes straight on.
+        """
+        try:
+            client_socket.setblocking(False)
+            # A few hundred bytes always fit into the empty send buffer of a new connection
+            client_socket.send(FrameCodec(client_socket).encode(HELLO, 0, self.busy_hello()))
+            client_socket.shutdown(socket.SHUT_WR)
+        except OSError:
+            client_socket.close()
+            return
+        self.turned_away.put(client_socket)
+
+    def close_turned_away(self):
+        """
+        Close turned-away connections once the client has closed its side, or
+        after TURN_AWAY_TIMEOUT (runs on its own thread). Whatever the client
+        sent is read first, since closing a socket with unread data resets the
+        connection and could lose the busy reply.
+        """
+        selector = selectors.DefaultSelector()
+        while True:
+            try:
+                block = not selector.get_map()
+                while True:
+                    client_socket = self.turned_away.get(block=block)
+                    selector.register(client_socket, selectors.EVENT_READ, time.monotonic() + TURN_AWAY_TIMEOUT)
+                    block = False
+            except queue.Empty:
+                pass
+            for key, _ in selector.select(timeout=0.05):
+                try:
+                    if key.fileobj.recv(CHUNK_SIZE):
+                        continue
+                except OSError:
+                    pass
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+            now = time.monotonic()
+            for key in list(selector.get_map().values()):
+                if key.data <= now:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+
+    def route_frame(self, session, frame):
+        """
+        Start a new action for REQUEST frames, hand any other frame to the request it belongs to.
+        """
+        if frame.type == REQUEST:
+            session.open_inbox(frame.request_id, len(frame.payload))
+            self.executor.submit(self.handle_request, session, frame, time.perf_counter())
+        elif frame.type == PING:
+            if self.mode == "async":
+                self.executor.submit(session.send, PONG, frame.request_id)  # sends block on the loop
+            else:
+                session.send(PONG, frame.request_id)
+        elif not session.route(frame):
+            self.logger.warning("Dropped frame %s for unknown request %s from %s",
+                                frame.type, frame.request_id, session.address)
+
+    def handle_request(self, session, frame, queued_at):
+        """
+        Dispatch a single request from a client to its action handler (runs on the worker pool).
+        """
+        request_id = frame.request_id
+        started = time.perf_counter()
+        action = "invalid"  # until the request is parsed
+        failed = False
+        transfer_owner = None
+        try:
+            data = json.loads(frame.payload)  # Decode the JSON data
+
+            action = data.get("action")
+            self.logger.info(ACTION_RECEIVED, action)
+
+            if action in TRANSFER_ACTIONS:
+                transfer_owner = self.start_transfer(session)
+                if transfer_owner is None:
+                    session.error(request_id, "Server busy, too many transfers in progress.",
+                                  busy=True, retry_after=RETRY_AFTER)
+                    return
+
+            if action == 'login':
+                self.handle_login(data, session, request_id)
+            elif action == 'register':
+                self.handle_register(data, session, request_id)
+            elif action == 'receiveFile':
+                self.receive_file(data, session, request_id)
+            elif action == 'sendAllFiles':
+                self.send_all_files(data["group_name"], session, request_id, data.get("filenames"))
+            elif action == 'linkBlob':
+                self.link_blob(data, session, request_id)
+            elif action == 'blockSignatures':
+                self.send_signatures(data["group_name"], data["filename"], session, request_id)
+            elif action == 'deltaUpload':
+                self.receive_delta(data, session, request_id)
+            elif action == 'sendDelta':
+                self.send_delta(data["group_name"], data["filename"], session, request_id)
+            elif action == 'uploadBegin':
+                self.upload_begin(data, session, request_id)
+            elif action == 'uploadQuery':
+                self.upload_query(data["upload_id"], session, request_id)
+            elif action == 'uploadChunk':
+                self.upload_chunk(data["upload_id"], data["offset"], session, request_id, data.get("compression"))
+            elif action == 'uploadCommit':
+                self.upload_commit(data["upload_id"], session, request_id)
+            elif action == 'groupManifest':
+                self.send_manifest(data, session, request_id)
+            elif action == "removeFile":
+                self.remove_file(data["group_name"], data["filename"], session, request_id)
+            elif action == 'sendAllGroups':
+                self.send_groups(session, request_id, data.get("version"))
+            elif action == 'listGroups':
+                self.list_groups(data, session, request_id)
+            elif action == 'addGroup':
+                added = self.json_data_base.add_group(data["group_name"], data["group_password"])
+                session.reply(request_id, {"success": added})
+            elif action == "verifyGroupPassword":
+                self.verify_password(session, request_id, data["group_name"], data["password"])
+            elif action == 'disconnect':
+                self.handle_disconnect(data, session, request_id)
+            elif action == 'logout':
+                self.handle_logout(data, session, request_id)
+            elif action == 'subscribe':
+                self.subscribe(session, request_id)
+            elif action == 'stats':
+                session.reply(request_id, self.stats_snapshot())
+            else:
+                session.error(request_id, f"Unknown action: {action}")
+                action = "unknown"  # arbitrary names must not each get their own stats
+
+        except Exception as e:
+            self.logger.error("Error handling request from %s: %s", session.address, e)
+            failed = True
+            try:
+                session.error(request_id, str(e))
+            except OSError:
+                pass
+
+        finally:
+            if transfer_owner is not None:
+                self.finish_transfer(transfer_owner)
+            received, sent, error_sent = session.close_inbox(request_id)
+            self.stats.record(action if isinstance(action, str) else "invalid", time.perf_counter() - started,
+                              received, sent, failed or error_sent, started - queued_at)
 
-    def handle_login(self, data, client_socket):
+    def start_transfer(self, session):
+        """
+        Count a transfer in for the session's user (its address before login).
+        At max_transfers_per_user it waits up to TRANSFER_WAIT for one to finish,
+        which also covers a client sending its next chunk as soon as the previous
+        one is answered. Returns the key it was counted under, or None.
+        """
+        owner = session.username or session.address[0]
+        deadline = time.monotonic() + TRANSFER_WAIT
+        with self.transfers_changed:
+            while self.transfers.get(owner, 0) >= self.max_transfers_per_user:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.transfers_changed.wait(remaining)
+            self.transfers[owner] = self.transfers.get(owner, 0) + 1
+        return owner
+
+    def finish_transfer(self, owner):
+        with self.transfers_changed:
+            self.transfers[owner] -= 1
+            if not self.transfers[owner]:
+                del self.transfers[owner]
+            self.transfers_changed.notify_all()
+
+    def stats_snapshot(self):
+        """Request statistics plus the current load: sessions, logged-in users and running transfers."""
+        snapshot = self.stats.snapshot()
+        with self.sessions_lock:
+            snapshot["sessions"] = {
+                "open": self.session_count,
+                "turned_away": self.sessions_turned_away,
+                "users": len(self.connected_users),
+                "transfers": sum(self.transfers.values()),
+            }
+        return snapshot
+
+    def serve_async(self):
+        """
+        Serve all clients from one asyncio event loop. Blocking work (the RSA
+        handshake, SQL and JSON database calls, file I/O) runs on the bounded
+        worker pool so a single slow client cannot stall the loop.
+        """
+        try:
+            asyncio.run(self.run_async_server())
+        finally:
+            self.executor.shutdown(wait=False)
+            self.thumbnails.shutdown()
+
+    async def run_async_server(self):
+        """
+        Start the asyncio server on the already bound listening socket.
+        """
+        self.server_socket.setblocking(False)
+        server = await asyncio.start_server(self.handle_async_client, sock=self.server_socket)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_async_client(self, reader, writer):
+        """
+        Read every frame from a connected client on the event loop and route it.
+        Idle clients cost no thread; each request is handed to the worker pool.
+        """
+        client_address = writer.get_extra_info("peername")
+        if not self.admit_session():
+            self.logger.warning("Turned away %s: %s sessions open", client_address, self.max_sessions)
+            await self.turn_away_async(reader, writer)
+            return
+        self.logger.info("Connection established with %s", client_address)
+        loop = asyncio.get_running_loop()
+        connection = AsyncConnection(reader, writer, loop)
+        codec = FrameCodec(connection)
+        session = None
+        try:
+            # Receive the public key of the client and send the server's public key
+            hello = json.loads((await asyncio.wait_for(connection.read_frame(codec), HANDSHAKE_TIMEOUT)).payload)
+            public_client_key = load_pem_public_key(hello["public_key"].encode())
+            compression = Compression.negotiate(hello.get("compression"))
+            await connection.write(codec.encode(HELLO, 0, self.server_hello(compression)))
+
+            hello = await asyncio.wait_for(connection.read_frame(codec), HANDSHAKE_TIMEOUT)
+            codec.cipher = await loop.run_in_executor(self.executor, self.open_session, hello.payload)
+            codec.plain_data = not self.encrypt_payloads
+            codec.compression = compression
+            session = ClientSession(codec, client_address, self.idle_timeout)
+
+            while True:
+                frame = await asyncio.wait_for(connection.read_frame(codec), self.idle_timeout)
+                if frame is None:
+                    break
+                while not session.has_room(frame.request_id):
+                    await asyncio.sleep(INBOX_WAIT)  # the request's handler is behind: stop reading from this client
+                self.route_frame(session, frame)
+
+        except asyncio.TimeoutError:
+            self.logger.info("Connection with %s timed out", client_address)
+
+        except Exception as e:
+            self.logger.error("Error with client %s: %s", client_address, e)
+
+        finally:
+            self.end_session(session)
+            writer.close()
+            self.logger.info("Closed connection with %s", client_address)
+
+    async def turn_away_async(self, reader, writer):
+        """turn_away for the event loop."""
+        try:
+            writer.write(FrameCodec(None).encode(HELLO, 0, self.busy_hello()))
+            await writer.drain()
+            writer.write_eof()
+            await asyncio.wait_for(reader.read(CHUNK_SIZE), TURN_AWAY_TIMEOUT)
+        except (OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    def handle_login(self, data, session, request_id):
         """
         Handle user login by checking credentials.
         """
@@ -151,142 +555,624 @@ class Server:
 
         if not username or not password:
             self.logger.warning("Error: Missing username or password.")
-            client_socket.send(b'False')
+            session.reply(request_id, {"success": False})
             return
 
-        self.logger.info(f"Login attempt for {username}")
+        self.logger.info("Login attempt for %s", username)
 
-        if self.sql_data_base.check_credentials(username, password):
-            client_socket.send(b'True')
-        else:
-            client_socket.send(b'False')
+        success = self.sql_data_base.check_credentials(username, password)
+        if success:
+            session.username = username
+            with self.sessions_lock:
+                self.connected_users.setdefault(username, set()).add(session)
+        session.reply(request_id, {"success": success})
 
-    def handle_register(self, data, client_socket):
+    def handle_register(self, data, session, request_id):
         """
         Handle user registration and store new user in the database.
         """
         username = data.get('username')
         password = data.get('password')
 
-        self.logger.info(f"Registering user {username}")
+        self.logger.info("Registering user %s", username)
 
         if self.sql_data_base.create_user(username, password):
-            client_socket.send(b'Registration successful')
+            session.reply(request_id, {"success": True, "message": "Registration successful"})
         else:
-            client_socket.send(b'Registration failed')
+            session.reply(request_id, {"success": False, "message": "Registration failed"})
 
-    def handle_logout(self, data, client_socket):
+    def handle_logout(self, data, session, request_id):
         """
         Handle client logout and remove the player from the players list.
         """
-        try:
-            if data["username"] in self.connected_users:
-                del self.connected_users[data["username"]]
-                self.logger.info(f"User {data['username']} has been logged out.")
-            else:
-                self.logger.warning(f"User {data['username']} not found in the connected users list.")
+        username = session.username
+        if self.forget_login(session):
+            session.username = None
+            self.logger.info("User %s has been logged out.", username)
+        else:
+            self.logger.warning("User %s not found in the connected users list.", data.get('username'))
+        session.reply(request_id, {"success": True})
 
+    def handle_disconnect(self, data, session, request_id):
+        """
+        Handle disconnection request.
+        """
+        if self.forget_login(session):
+            self.logger.info("User %s disconnected.", session.username)
+        else:
+            self.logger.warning("User %s not found for disconnection.", data.get("username"))
+        session.reply(request_id, {"success": True})
+
+    def forget_login(self, session):
+        """Remove a session from connected_users. Returns False if it was not logged in."""
+        with self.sessions_lock:
+            sessions = self.connected_users.get(session.username)
+            if not sessions or session not in sessions:
+                return False
+            sessions.discard(session)
+            if not sessions:
+                del self.connected_users[session.username]
+        return True
+
+    def subscribe(self, session, request_id):
+        """
+        Push group_added, file_added and file_removed events to this session from now on.
+        """
+        with self.subscribers_lock:
+            self.subscribers.add(session)
+        self.logger.info("Client %s subscribed to change events", session.address)
+        session.reply(request_id, {"success": True})
+
+    def unsubscribe(self, session):
+        with self.subscribers_lock:
+            self.subscribers.discard(session)
+
+    def publish(self, event, **data):
+        """
+        Send a change event to every subscribed session. Each send runs on the
+        worker pool so a slow subscriber never holds up the action that changed
+        something.
+        """
+        data["event"] = event
+        with self.subscribers_lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            self.executor.submit(self.push_event, subscriber, data)
+
+    def watch_shared_state(self):
+        """
+        Pick up the groups and files other worker processes added or removed and
+        tell this process's subscribers, every SHARED_STATE_POLL seconds.
+        New groups reach them through the group store's listener.
+        """
+        while True:
+            time.sleep(SHARED_STATE_POLL)
+            try:
+                self.json_data_base.refresh()
+                for event, group_name, filename in self.blob_store.take_changes():
+                    self.publish(event, group_name=group_name, filename=filename)
+            except Exception as e:
+                self.logger.error("Could not check for changes of other workers: %s", e)
+
+    def push_event(self, session, data):
+        try:
+            session.send_json(EVENT, 0, data)
         except Exception as e:
-            self.logger.error(f"Error during logout: {e}")
+            self.logger.warning("Dropping subscriber %s: %s", session.address, e)
+            self.unsubscribe(session)
 
-    def handle_disconnect(self, data, client_socket):
+    def send_groups(self, session, request_id, known_version=None):
         """
-        Handle disconnection request.
+        Send all groups to the connected client. A client that already has the
+        current version of the list gets a short not-modified reply instead.
         """
-        username = data.get("username")
-        if username in self.connected_users:
-            del self.connected_users[username]
-            self.logger.info(f"User {username} disconnected.")
+        version, payload = self.encoded_group_list()
+        if known_version == version:
+            session.reply(request_id, {"version": version, "not_modified": True})
         else:
-            self.logger.warning(f"User {username} not found for disconnection.")
+            session.send(RESPONSE, request_id, payload)
 
-    def send_groups(self, client_socket):
-        """Send all groups to the connected client."""
-        groups = self.json_data_base.get_all_groups()
-        formatted_groups = [{"name": group} for group in groups]
-        groups_data = json.dumps({"groups": formatted_groups})
+    def list_groups(self, data, session, request_id):
+        """
+        Send one page of group names in sorted order, starting after data["cursor"]
+        and filtered by an optional prefix and case-insensitive search string.
+        A client asking for the first page with the current version gets a
+        not-modified reply.
+        """
+        if (data.get("cursor") is None and data.get("version") is not None
+                and data["version"] == self.json_data_base.current_version()):
+            session.reply(request_id, {"version": data["version"], "not_modified": True})
+            return
+        limit = max(1, min(int(data.get("limit", GROUP_PAGE_SIZE)), MAX_GROUP_PAGE_SIZE))
+        version, names, next_cursor = self.json_data_base.list_groups(data.get("cursor"), limit,
+                                                                      data.get("prefix"), data.get("search"))
+        session.reply(request_id, {"groups": [{"name": name} for name in names],
+                                   "next_cursor": next_cursor, "version": version})
 
-        data_length = f"{len(groups_data):<10}"
-        client_socket.sendall(data_length.encode())
-        client_socket.sendall(groups_data.encode())
+    def encoded_group_list(self):
+        """Return (version, encoded reply) of the group list, encoding it again only after a change."""
+        with self.group_list_lock:
+            if self.group_list[0] != self.json_data_base.current_version():
+                version, groups = self.json_data_base.get_versioned_groups()
+                formatted_groups = [{"name": group} for group in groups]
+                self.group_list = (version, json.dumps({"groups": formatted_groups, "version": version}).encode())
+            return self.group_list
 
-    def verify_password(self, client_socket, group_name, password):
+    def verify_password(self, session, request_id, group_name, password):
         """Verify the group password."""
-        self.logger.info(f"Verifying password for group: {group_name}")
-        if self.json_data_base.verify_password(group_name, password):
-            client_socket.send(b"True")
-        else:
-            client_socket.send(b"False")
+        self.logger.info("Verifying password for group: %s", group_name)
+        session.reply(request_id, {"success": self.json_data_base.verify_password(group_name, password)})
 
-    def receive_file(self, data, client_socket):
+    def receive_file(self, data, session, request_id):
         """
-        Receive a file from the client and save it into a folder corresponding to the group name.
+        Receive a file from the client and store it under the group's filename.
+        The file arrives as DATA frames for this request followed by an END frame.
         """
+        save_path = None
         try:
-            filename = data.get('filename')
+            filename = os.path.basename(data.get('filename') or '')
             filesize = data.get('filesize')
             group_name = data.get('group_name')
 
-            if not filename or not filesize or not group_name:
+            if not filename or filesize is None or not group_name:
                 raise ValueError("Missing filename, filesize, or group name.")
+            if not isinstance(filesize, int) or filesize < 0:
+                raise ValueError("Invalid filesize.")
 
-            self.logger.info(f"Receiving file: {filename} ({filesize} bytes) for group '{group_name}'")
+            self.logger.info("Receiving file: %s (%s bytes) for group '%s'", filename, filesize, group_name)
 
-            group_folder_path = os.path.join(self.save_dir, group_name)
-            os.makedirs(group_folder_path, exist_ok=True)
+            os.makedirs(self.uploads_dir, exist_ok=True)
+            descriptor, save_path = tempfile.mkstemp(suffix=".receiving", dir=self.uploads_dir)
+            os.close(descriptor)
 
-            save_path = os.path.join(group_folder_path, filename)
+            compression = data.get('compression')
+            decompressor = StreamDecompressor(compression) if compression else None
+            stats = TransferStats(f"Received '{filename}'", compression)
+            digest = hashlib.sha256()
+            bytes_received = 0
+            with PreallocatedFile(save_path, filesize) as output:
+                if decompressor is None:
+                    session.receive_into(request_id, output)
+                while True:
+                    frame = session.next_frame(request_id)
+                    if frame.type == END:
+                        break
+                    payload = frame.payload if decompressor is None else decompressor.decompress(frame.payload)
+                    digest.update(payload)
+                    stats.add(len(payload), len(frame.payload))
+                    bytes_received += output.write(payload)
 
-            with open(save_path, "wb") as f:
-                bytes_received = 0
-                while bytes_received < filesize:
-                    chunk = client_socket.recv(4096)
-                    if not chunk:
-                        raise Exception("Connection lost during file transfer.")
-                    f.write(chunk)
-                    bytes_received += len(chunk)
+            if bytes_received != filesize:
+                raise ValueError(f"Expected {filesize} bytes but received {bytes_received}.")
 
-            self.logger.info(f"File '{filename}' received successfully and saved to {save_path}")
+            sha256 = self.blob_store.store(group_name, filename, save_path, digest.hexdigest())
+            self.request_thumbnail(filename, sha256)
+            self.logger.info("File '%s' received successfully for group '%s'", filename, group_name)
+            self.logger.info(stats.summary())
+            session.reply(request_id, {"success": True})
+            self.publish("file_added", group_name=group_name, filename=filename)
 
         except Exception as e:
-            self.logger.error(f"Error receiving file: {e}")
-            if os.path.exists(save_path):
+            self.logger.error("Error receiving file: %s", e)
+            if save_path and os.path.exists(save_path):
                 os.remove(save_path)
+            session.error(request_id, str(e))
 
-    def send_all_files(self, group_name, client_socket):
+    def link_blob(self, data, session, request_id):
         """
-        Send all files from a specific group folder to the client.
+        Add a file to a group without uploading it if the server already stores
+        content with its SHA-256. Replies {"stored": False} when the client has to upload.
         """
+        filename = os.path.basename(data.get('filename') or '')
+        group_name = data.get('group_name')
+        sha256 = data.get('sha256')
+        if not filename or not group_name or not sha256:
+            raise ValueError("Missing filename, group name, or sha256.")
+
+        stored = self.blob_store.link(group_name, filename, sha256)
+        session.reply(request_id, {"stored": stored})
+        if stored:
+            self.logger.info("File '%s' for group '%s' deduplicated, upload skipped", filename, group_name)
+            self.publish("file_added", group_name=group_name, filename=filename)
+
+    def send_signatures(self, group_name, filename, session, request_id):
+        """
+        Send the block signatures of the group's current copy of a file as DATA
+        frames while they are computed, so the client can upload a delta
+        against it. The END trailer carries the copy's SHA-256, or None if the
+        group has no such file.
+        """
+        entry = self.blob_store.entry(group_name, os.path.basename(filename))
+        if entry is None:
+            session.send_json(END, request_id, {"sha256": None})
+            return
+        with self.blob_store.open(entry["sha256"]) as file:
+            for piece in DeltaSync.signature_pieces(file, entry["size"]):
+                session.send(DATA, request_id, piece)
+        session.send_json(END, request_id, {"sha256": entry["sha256"]})
+
+    def receive_delta(self, data, session, request_id):
+        """
+        Rebuild an uploaded file from the delta operations in its DATA frames and
+        the stored base blob they refer to, then store it like a full upload.
+        """
+        save_path = None
         try:
-            group_folder_path = os.path.join(self.save_dir, group_name)
-            if not os.path.exists(group_folder_path):
-                client_socket.send(b'0')
-                return
+            filename = os.path.basename(data.get('filename') or '')
+            group_name = data.get('group_name')
+            filesize = data.get('filesize')
+            sha256 = data.get('sha256')
+            if not filename or not group_name or filesize is None or not sha256 or not data.get('base_sha256'):
+                raise ValueError("Missing filename, group name, filesize, sha256, or base.")
+
+            os.makedirs(self.uploads_dir, exist_ok=True)
+            descriptor, save_path = tempfile.mkstemp(suffix=".delta", dir=self.uploads_dir)
+            digest = hashlib.sha256()
+            received = 0
+            with os.fdopen(descriptor, "wb") as output, self.blob_store.open(data["base_sha256"]) as base:
+                while True:
+                    frame = session.next_frame(request_id)
+                    if frame.type == END:
+                        break
+                    received += len(frame.payload)
+                    DeltaSync.apply_delta(frame.payload, base, output, digest)
+
+            if os.path.getsize(save_path) != filesize or digest.hexdigest() != sha256:
+                raise ValueError("File rebuilt from the delta does not match its checksum.")
 
-            files = [f for f in os.listdir(group_folder_path) if os.path.isfile(os.path.join(group_folder_path, f))]
-            client_socket.send(str(len(files)).encode())
+            self.blob_store.store(group_name, filename, save_path, sha256)
+            self.request_thumbnail(filename, sha256)
+            self.logger.info("File '%s' for group '%s' rebuilt from a %s byte delta (%s bytes)",
+                             filename, group_name, received, filesize)
+            session.reply(request_id, {"success": True})
+            self.publish("file_added", group_name=group_name, filename=filename)
 
-            if files:
-                for filename in files:
-                    file_path = os.path.join(group_folder_path, filename)
-                    filesize = os.path.getsize(file_path)
+        except Exception as e:
+            self.logger.error("Error receiving delta: %s", e)
+            if save_path and os.path.exists(save_path):
+                os.remove(save_path)
+            session.error(request_id, str(e))
+
+    def send_delta(self, group_name, filename, session, request_id):
+        """
+        Send a file as a delta against the client's copy. The client's block
+        signatures arrive as DATA frames followed by END; the reply is a FILE
+        frame with the metadata, DATA frames of delta operations and END.
+        """
+        signature = bytearray()
+        while True:
+            frame = session.next_frame(request_id)
+            if frame.type == END:
+                break
+            signature += frame.payload
+
+        filename = os.path.basename(filename)
+        entry = self.blob_store.entry(group_name, filename)
+        if entry is None:
+            raise ValueError(f"File '{filename}' not found in group '{group_name}'.")
+
+        session.send_json(FILE, request_id, {"filename": filename, "filesize": entry["size"],
+                                             "sha256": entry["sha256"], "group_name": group_name})
+        with self.blob_store.open(entry["sha256"]) as file:
+            sent = DeltaSync.encode_delta(file, bytes(signature),
+                                          lambda ops: session.send(DATA, request_id, ops))
+        session.send_json(END, request_id, {"count": 1})
+        self.logger.info("Sent '%s' of group '%s' as a %s byte delta (%s bytes)",
+                         filename, group_name, sent, entry['size'])
 
-                    metadata = {"action": "sendFile", "filename": filename, "filesize": filesize, "group_name": group_name}
-                    metadata_json = json.dumps(metadata).encode()
+    def upload_paths(self, upload_id):
+        """Return the partial file and metadata paths of an upload."""
+        if not upload_id or not all(c in string.hexdigits for c in upload_id):
+            raise ValueError("Invalid upload id.")
+        base = os.path.join(self.uploads_dir, upload_id)
+        return base + ".partial", base + ".json"
 
-                    client_socket.sendall(len(metadata_json).to_bytes(4, 'big'))
-                    client_socket.sendall(metadata_json)
+    def upload_lock(self, upload_id):
+        """Lock of an upload; with shared state a file lock, since its chunks may reach any worker."""
+        if self.shared_state:
+            return FileLock(os.path.join(self.uploads_dir, upload_id + ".lock")).hold()
+        with self.upload_locks_lock:
+            return self.upload_locks.setdefault(upload_id, threading.Lock())
 
-                    with open(file_path, "rb") as file:
-                        while chunk := file.read(4096):
-                            client_socket.sendall(chunk)
+    def forget_upload(self, upload_id):
+        """Drop the lock of an upload that was committed or removed."""
+        if self.shared_state:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.uploads_dir, upload_id + ".lock"))
+        with self.upload_locks_lock:
+            self.upload_locks.pop(upload_id, None)
 
-                self.logger.info(f"All files for group '{group_name}' sent successfully.")
+    def expire_upload(self, upload_id, expired):
+        """Remove an upload whose files were last written before the time expired. Returns whether it was."""
+        partial_path, meta_path = self.upload_paths(upload_id)
+        with self.upload_lock(upload_id):
+            paths = [path for path in (partial_path, meta_path) if os.path.exists(path)]
+            if meta_path not in paths or max(os.path.getmtime(path) for path in paths) >= expired:
+                return False
+            for path in paths:
+                os.remove(path)
+        self.forget_upload(upload_id)
+        return True
+
+    def sweep_uploads(self):
+        """
+        Remove uploads nobody sent a chunk for in UPLOAD_EXPIRY seconds, and
+        files of interrupted transfers (temporary receive files, partial files
+        and locks without an upload) as old. Returns the number of uploads removed.
+        """
+        expired = time.time() - UPLOAD_EXPIRY
+        removed = 0
+        for name in os.listdir(self.uploads_dir):
+            upload_id, _, extension = name.partition(".")
+            path = os.path.join(self.uploads_dir, name)
+            try:
+                if extension == "json":
+                    removed += self.expire_upload(upload_id, expired)
+                elif not os.path.exists(os.path.join(self.uploads_dir, upload_id + ".json")) \
+                        and os.path.getmtime(path) < expired:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass  # finished, or removed by another worker, while we looked
+            except (OSError, ValueError) as e:
+                self.logger.warning("Could not clean up upload file %s: %s", name, e)
+        return removed
+
+    def sweep_uploads_periodically(self):
+        """Run sweep_uploads now and then every UPLOAD_SWEEP_INTERVAL seconds."""
+        while True:
+            try:
+                removed = self.sweep_uploads()
+                if removed:
+                    self.logger.info("Removed %s abandoned uploads", removed)
+            except Exception as e:
+                self.logger.error("Could not clean up abandoned uploads: %s", e)
+            time.sleep(UPLOAD_SWEEP_INTERVAL)
+
+    def read_upload(self, meta_path):
+        with open(meta_path, "r") as file:
+            return json.load(file)
+
+    def save_upload(self, meta_path, upload):
+        with open(meta_path + ".tmp", "w") as file:
+            json.dump(upload, file)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def resume_offset(self, partial_path, upload):
+        """
+        Offset an upload continues from: the end of its last complete chunk.
+        Partial files are extended to the full size, so this is kept in the
+        upload's metadata. Uploads begun by older servers have only the partial
+        file's size, rounded down to a whole chunk so a chunk cut off by a
+        dropped connection is sent again.
+        """
+        if "received" in upload:
+            return upload["received"]
+        if not os.path.exists(partial_path):
+            return 0
+        offset = os.path.getsize(partial_path) // UPLOAD_CHUNK * UPLOAD_CHUNK
+        os.truncate(partial_path, offset)
+        return offset
+
+    def upload_begin(self, data, session, request_id):
+        """
+        Start or resume an upload. The upload id is derived from the target and
+        the file's size and checksum, so the same file resumes after a reconnect.
+        """
+        filename = os.path.basename(data.get('filename') or '')
+        group_name = data.get('group_name')
+        filesize = data.get('filesize')
+        sha256 = data.get('sha256')
+        if not filename or not group_name or filesize is None or not sha256:
+            raise ValueError("Missing filename, group name, filesize, or sha256.")
+        if not isinstance(filesize, int) or filesize < 0:
+            raise ValueError("Invalid filesize.")
+
+        upload_id = hashlib.sha256(f"{group_name}/{filename}/{filesize}/{sha256}".encode()).hexdigest()[:32]
+        partial_path, meta_path = self.upload_paths(upload_id)
+        with self.upload_lock(upload_id):
+            os.makedirs(self.uploads_dir, exist_ok=True)
+            if not os.path.exists(meta_path):
+                self.save_upload(meta_path, {"group_name": group_name, "filename": filename,
+                                             "filesize": filesize, "sha256": sha256, "received": 0})
+                open(partial_path, "ab").close()
+            offset = self.resume_offset(partial_path, self.read_upload(meta_path))
+
+        self.logger.info("Upload %s of '%s' (%s bytes) for group '%s' starts at %s",
+                         upload_id, filename, filesize, group_name, offset)
+        session.reply(request_id, {"upload_id": upload_id, "offset": offset})
+
+    def upload_query(self, upload_id, session, request_id):
+        """Tell the client where to resume an upload."""
+        partial_path, meta_path = self.upload_paths(upload_id)
+        if not os.path.exists(meta_path):
+            raise ValueError("Unknown upload id.")
+        with self.upload_lock(upload_id):
+            session.reply(request_id, {"offset": self.resume_offset(partial_path, self.read_upload(meta_path))})
+
+    def upload_chunk(self, upload_id, offset, session, request_id, compression=None):
+        """
+        Write one chunk of an upload into its partial file, which has the
+        upload's full size; disk is reserved only for the chunks written. The
+        chunk arrives as DATA frames followed by END, compressed as one stream
+        if compression is set, and must start exactly where the previous
+        chunk ended.
+        """
+        partial_path, meta_path = self.upload_paths(upload_id)
+        if not os.path.exists(meta_path):
+            raise ValueError("Unknown upload id.")
+        decompressor = StreamDecompressor(compression) if compression else None
+        wire = 0
+        with self.upload_lock(upload_id):
+            upload = self.read_upload(meta_path)
+            current = self.resume_offset(partial_path, upload)
+            if offset != current:
+                raise ValueError(f"Chunk offset {offset} does not match the upload offset {current}.")
+            with PreallocatedFile(partial_path, upload["filesize"], offset) as output:
+                if decompressor is None:
+                    session.receive_into(request_id, output)
+                while True:
+                    frame = session.next_frame(request_id)
+                    if frame.type == END:
+                        break
+                    wire += len(frame.payload)
+                    output.write(frame.payload if decompressor is None else decompressor.decompress(frame.payload))
+                current = output.position
+            upload["received"] = current
+            self.save_upload(meta_path, upload)
+        session.reply(request_id, {"offset": current, "wire": wire})
+
+    def upload_commit(self, upload_id, session, request_id):
+        """
+        Verify a finished upload's size and checksum and move it into the blob store.
+        """
+        partial_path, meta_path = self.upload_paths(upload_id)
+        with self.upload_lock(upload_id):
+            if not os.path.exists(meta_path):  # e.g. committed by another client uploading the same file
+                raise ValueError("Unknown upload id.")
+            upload = self.read_upload(meta_path)
+            exists = os.path.exists(partial_path)
+            received = upload.get("received", os.path.getsize(partial_path) if exists else 0)
+            if not exists or received != upload["filesize"] or file_sha256(partial_path) != upload["sha256"]:
+                if exists:
+                    os.remove(partial_path)
+                upload["received"] = 0
+                self.save_upload(meta_path, upload)
+                raise ValueError("Uploaded file does not match its checksum, upload discarded.")
+
+            self.blob_store.store(upload["group_name"], upload["filename"], partial_path, upload["sha256"])
+            os.remove(meta_path)
+        self.forget_upload(upload_id)
+        self.request_thumbnail(upload["filename"], upload["sha256"])
+
+        self.logger.info("Upload %s committed as '%s' in group '%s'",
+                         upload_id, upload['filename'], upload['group_name'])
+        session.reply(request_id, {"success": True})
+        self.publish("file_added", group_name=upload["group_name"], filename=upload["filename"])
+
+    def send_manifest(self, data, session, request_id):
+        """
+        Send the manifest of a group (name, size, mtime and SHA-256 of each file)
+        so the client can fetch only what changed.
+
+        If the request has a "thumbnails" list (the hashes whose thumbnails the
+        client already has), the reply carries {sha256: base64 JPEG} for the other
+        files with a thumbnail ready, up to MAX_MANIFEST_THUMBNAILS bytes.
+        """
+        files = self.blob_store.files(data["group_name"])
+        reply = {"files": files}
+        if "thumbnails" in data:
+            reply["thumbnails"] = self.manifest_thumbnails(files, set(data["thumbnails"] or []))
+        session.reply(request_id, reply)
+
+    def manifest_thumbnails(self, files, known):
+        """Ready thumbnails of files the client does not have; missing ones are rendered for later manifests."""
+        thumbnails = {}
+        budget = MAX_MANIFEST_THUMBNAILS
+        for filename, entry in files.items():
+            sha256 = entry["sha256"]
+            if sha256 in known or sha256 in thumbnails or not can_preview(filename):
+                continue
+            data = self.thumbnails.cache.get(sha256)
+            if data is None:
+                self.request_thumbnail(filename, sha256)
+            elif len(data) <= budget:
+                thumbnails[sha256] = base64.b64encode(data).decode()
+                budget -= len(data)
+        return thumbnails
+
+    def request_thumbnail(self, filename, sha256):
+        """Render the thumbnail of a stored file in the background if it can have one."""
+        try:
+            self.thumbnails.request(sha256, self.blob_store.blob_path(sha256), filename)
+        except (OSError, ValueError) as e:
+            self.logger.warning("No thumbnail for '%s': %s", filename, e)
+
+    def send_all_files(self, group_name, session, request_id, filenames=None):
+        """
+        Send all files of a group, or only those in filenames: per file a FILE
+        frame with its metadata and its DATA frames, then END with the count.
+        """
+        try:
+            files = self.blob_store.files(group_name)
+            if filenames is not None:
+                wanted = set(filenames)
+                files = {name: entry for name, entry in files.items() if name in wanted}
+            buffer = bytearray(TRANSFER_CHUNK)  # shared by the files not sent with sendfile
+
+            for filename, entry in files.items():
+                with self.blob_store.open(entry["sha256"]) as file:
+                    compression = Compression.choose(session.codec.compression, filename,
+                                                     file.read(Compression.SAMPLE_SIZE))
+                    file.seek(0)
+                    # Files that compress well go out as one compressed stream named in the metadata
+                    metadata = {"filename": filename, "filesize": entry["size"], "group_name": group_name,
+                                "compression": compression}
+                    session.send_json(FILE, request_id, metadata)
+
+                    stats = TransferStats(f"Sent '{filename}'", compression)
+                    compressor = StreamCompressor(compression) if compression else None
+                    stats.add(entry["size"], session.send_file(request_id, file, entry["size"], buffer, compressor))
+                    self.logger.info(stats.summary())
+
+            session.send_json(END, request_id, {"count": len(files)})
+            self.logger.info("All files for group '%s' sent successfully.", group_name)
 
         except Exception as e:
-            self.logger.error(f"Error sending files: {e}")
-            client_socket.send(b'0')
+            self.logger.error("Error sending files: %s", e)
+            session.error(request_id, str(e))
+
+    def remove_file(self, group_name, filename, session, request_id):
+        """
+        Remove a file from a group.
+        """
+        filename = os.path.basename(filename)
+        if self.blob_store.unlink(group_name, filename):
+            self.logger.info("Removed file '%s' from group '%s'", filename, group_name)
+            session.reply(request_id, {"success": True})
+            self.publish("file_removed", group_name=group_name, filename=filename)
+        else:
+            self.logger.warning("File '%s' not found in group '%s'", filename, group_name)
+            session.reply(request_id, {"success": False})
 
 # Main entry point for the server
 if __name__ == "__main__":
-    server = Server()
+    parser = argparse.ArgumentParser(description="ShareFiles server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=65432)
+    parser.add_argument("--key-file", default="server_key.pem", help="PEM file holding the server's RSA key, generated on the first run")
+    parser.add_argument("--mode", choices=["threaded", "async"], default="threaded",
+                        help="connection engine: one thread per client or a single asyncio event loop; "
+                             "action handlers run on the --workers pool in both")
+    parser.add_argument("--workers", type=int, default=32, help="size of the action handler worker pool")
+    parser.add_argument("--plain-payloads", action="store_true",
+                        help="send file payloads unencrypted so downloads can use zero-copy sendfile")
+    parser.add_argument("--stats-file", help="write per-action request statistics (also returned by the stats action) "
+                             "to this JSON file periodically")
+    parser.add_argument("--stats-interval", type=float, default=60, help="seconds between writes of --stats-file")
+    parser.add_argument("--log-sample", type=int, default=1,
+                        help="log only every n-th request of frequent polling actions such as sendAllGroups")
+    parser.add_argument("--backlog", type=int, default=LISTEN_BACKLOG, help="listen backlog of the server socket")
+    parser.add_argument("--max-sessions", type=int, default=MAX_SESSIONS,
+                        help="connections served at once (per process); more are told to retry later")
+    parser.add_argument("--max-transfers-per-user", type=int, default=MAX_TRANSFERS_PER_USER,
+                        help="uploads and downloads one user (or client address, before login) runs at "
+                             "once, split evenly between the --processes workers; more are told to retry later")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT,
+                        help="seconds a connection may stay silent (clients send heartbeats), or in threaded "
+                             "mode stop reading in the middle of a frame, before it is closed")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="run this many worker processes on the port, restarted when they exit, sharing "
+                             "groups, users and uploads (0: one per CPU core)")
+    args = parser.parse_args()
+    server_args = dict(host=args.host, port=args.port, mode=args.mode, max_workers=args.workers,
+                       encrypt_payloads=not args.plain_payloads, key_file=args.key_file, stats_file=args.stats_file,
+                       stats_interval=args.stats_interval, log_sample=args.log_sample, log_file=LOG_FILE,
+                       backlog=args.backlog, max_sessions=args.max_sessions,
+                       max_transfers_per_user=args.max_transfers_per_user, idle_timeout=args.idle_timeout)
+    processes = args.processes or os.cpu_count() or 1
+    if processes > 1:
+        from ServerCluster import ServerCluster
+        load_or_create_private_key(args.key_file)  # once, so all workers share the key
+        ServerCluster(Server, processes, **server_args).run()
+    else:
+        server = Server(**server_args)
@@ -0,0 +1,153 @@
+"""
+Runs the server as several worker processes so request handling uses every
+core instead of sharing one interpreter lock.
+
+Each worker is a complete server on the same port. Where the platform has
+SO_REUSEPORT every worker binds the port itself and the kernel spreads new
+connections over them; otherwise the supervisor binds once and the forked
+workers accept on the inherited socket. The workers run with shared_state,
+so the group store, blob store and uploads are coordinated through file
+locks; users live in SQLite, which handles several processes by itself.
+Connected users, statistics and running transfers are per worker, so each
+worker gets an equal share of max_transfers_per_user.
+
+The supervisor restarts workers that exit, waiting longer each time a worker
+dies soon after starting so a crashing configuration does not spin.
+"""
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import time
+from ServerLogging import stop_logging, LOG_FORMAT
+
+RESTART_DELAY = 1.0  # seconds before restarting a worker that died young, doubled per crash
+MAX_RESTART_DELAY = 30.0
+STABLE_AFTER = 30.0  # a worker that ran this long is restarted right away
+STOP_TIMEOUT = 5.0
+
+
+def worker_path(path, index):
+    """A per-worker variant of a file name: server_logs.log -> server_logs.2.log."""
+    root, extension = os.path.splitext(path)
+    return f"{root}.{index}{extension}"
+
+
+def stop_worker(signum, frame):
+    """SIGTERM in a worker: write out the queued log records and exit without waiting for client threads."""
+    stop_logging()
+    os._exit(0)
+
+
+def run_worker(target, kwargs, listen_socket):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C reaches the whole group; the supervisor stops us
+    signal.signal(signal.SIGTERM, stop_worker)
+    target(**kwargs, shared_state=True, listen_socket=listen_socket, reuse_port=listen_socket is None)
+
+
+class ServerCluster:
+    def __init__(self, target, processes, host, port, log_file, stats_file=None, **server_args):
+        """
+        Supervise processes workers, each running target (the Server class) with
+        server_args. Every worker logs to its own numbered log_file, and writes
+        its own numbered stats_file if one is given. A worker only counts its
+        own transfers, so each gets max_transfers_per_user // processes (at least 1).
+        """
+        if "max_transfers_per_user" in server_args:
+            server_args["max_transfers_per_user"] = max(1, server_args["max_transfers_per_user"] // processes)
+        self.target = target
+        self.processes = processes
+        self.host = host
+        self.port = port
+        self.log_file = log_file
+        self.stats_file = stats_file
+        self.server_args = server_args
+        self.logger = logging.getLogger("ServerCluster")
+        self.logger.setLevel(logging.INFO)
+        if not self.logger.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            self.logger.addHandler(handler)
+        self.listen_socket = None
+        self.workers = {}  # index -> Process
+        self.started = {}  # index -> time the worker was started
+        self.crashes = {}  # index -> deaths in a row soon after starting
+        self.restart_at = {}  # index -> time a dead worker is due to be restarted
+        self.stopping = False
+        # Workers are forked: they inherit the listening socket, and the supervisor has no other threads
+        self.context = multiprocessing.get_context("fork")
+
+    def start_worker(self, index):
+        kwargs = dict(self.server_args, host=self.host, port=self.port, log_file=worker_path(self.log_file, index))
+        if self.stats_file:
+            kwargs["stats_file"] = worker_path(self.stats_file, index)
+        process = self.context.Process(target=run_worker, args=(self.target, kwargs, self.listen_socket),
+                                       name=f"ServerWorker-{index}", daemon=False)
+        process.start()
+        self.workers[index] = process
+        self.started[index] = time.monotonic()
+        self.logger.info("Started worker %s (pid %s)", index, process.pid)
+
+    def worker_exited(self, index):
+        process = self.workers.pop(index)
+        ran = time.monotonic() - self.started[index]
+        if ran < STABLE_AFTER:
+            self.crashes[index] = self.crashes.get(index, 0) + 1
+        else:
+            self.crashes[index] = 0
+        delay = min(RESTART_DELAY * 2 ** (self.crashes[index] - 1), MAX_RESTART_DELAY) if self.crashes[index] else 0
+        self.logger.warning("Worker %s (pid %s) exited with code %s after %.1fs, restarting in %.1fs",
+                            index, process.pid, process.exitcode, ran, delay)
+        self.restart_at[index] = time.monotonic() + delay
+
+    def run(self):
+        """Start the workers and supervise them until SIGTERM or Ctrl+C."""
+        if not hasattr(socket, "SO_REUSEPORT"):
+            self.listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listen_socket.bind((self.host, self.port))
+            self.listen_socket.listen(self.server_args.get("backlog", socket.SOMAXCONN))
+        signal.signal(signal.SIGTERM, self.request_stop)
+        self.logger.info("Starting %s workers on %s:%s (%s)", self.processes, self.host, self.port,
+                         "shared socket" if self.listen_socket else "SO_REUSEPORT")
+        try:
+            for index in range(self.processes):
+                self.start_worker(index)
+            self.supervise()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def supervise(self):
+        while not self.stopping:
+            now = time.monotonic()
+            for index, due in list(self.restart_at.items()):
+                if due <= now:
+                    del self.restart_at[index]
+                    self.start_worker(index)
+            timeout = min(self.restart_at.values(), default=now + 1.0) - now
+            sentinels = {process.sentinel: index for index, process in self.workers.items()}
+            for sentinel in multiprocessing.connection.wait(list(sentinels), timeout=max(0.0, timeout)):
+                self.workers[sentinels[sentinel]].join()
+                self.worker_exited(sentinels[sentinel])
+
+    def request_stop(self, signum, frame):
+        self.stopping = True
+
+    def stop(self):
+        """Terminate the workers, killing those that do not exit within STOP_TIMEOUT."""
+        self.logger.info("Stopping %s workers", len(self.workers))
+        for process in self.workers.values():
+            process.terminate()
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for process in self.workers.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+        self.workers.clear()
+        if self.listen_socket is not None:
+            self.listen_socket.close()
@@ -0,0 +1,77 @@
+import atexit
+import itertools
+import logging
+import logging.handlers
+import queue
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+ACTION_RECEIVED = "Action received: %s"
+# Actions clients send all the time; with sampling on only every n-th of them is logged
+SAMPLED_ACTIONS = ("sendAllGroups", "listGroups", "groupManifest", "verifyGroupPassword", "stats")
+
+writers = []  # LogWriters started in this process
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread. The stock
+    prepare() merges the message and its arguments on the logging thread so
+    records can cross process boundaries; these stay in the process, so they
+    are queued as they are.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class LogWriter(logging.handlers.QueueListener):
+    """QueueListener whose stop() may be called more than once (explicitly and at exit)."""
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+class ActionSampler(logging.Filter):
+    """Passes only every n-th "Action received" record of the sampled actions."""
+
+    def __init__(self, actions, every):
+        super().__init__()
+        self.every = every
+        self.counters = {action: itertools.count() for action in actions}
+
+    def filter(self, record):
+        if record.msg == ACTION_RECEIVED and record.args and isinstance(record.args[0], str):
+            counter = self.counters.get(record.args[0])
+            if counter is not None:
+                return next(counter) % self.every == 0
+        return True
+
+
+def start_logging(logger, path, max_bytes, backup_count, sample_every=1, sampled_actions=SAMPLED_ACTIONS):
+    """
+    Send logger's records through a queue to a writer thread that appends them
+    to path, rotating the file at max_bytes and keeping backup_count old ones.
+    Logging threads only append to the queue: no lock on the file, no disk
+    write and no formatting on their side. Returns the started LogWriter,
+    which is also stopped (and the queue drained) at exit.
+    """
+    file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                        encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    records = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    if sample_every > 1:
+        handler.addFilter(ActionSampler(sampled_actions, sample_every))
+    logger.addHandler(handler)
+    listener = LogWriter(records, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    writers.append(listener)
+    return listener
+
+
+def stop_logging():
+    """Stop every LogWriter of this process, writing out what is still queued (for exits that skip atexit)."""
+    for writer in writers:
+        writer.stop()
@@ -0,0 +1,152 @@
+import json
+import os
+import threading
+import time
+
+SUB_BUCKET_BITS = 3  # 8 linear steps per power of two: values are kept within 12.5%
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+
+class Histogram:
+    """
+    HDR-style histogram of non-negative integers (microseconds here). Values
+    below 2 * SUB_BUCKETS get a bucket each; above, every power of two is split
+    into SUB_BUCKETS equal buckets. Recording is one bit_length and a list
+    increment, and a few hundred buckets cover any latency.
+    """
+
+    def __init__(self):
+        self.counts = []
+        self.total = 0
+
+    @staticmethod
+    def bucket(value):
+        if value < 2 * SUB_BUCKETS:
+            return value
+        exponent = value.bit_length() - SUB_BUCKET_BITS - 1
+        return exponent * SUB_BUCKETS + (value >> exponent)
+
+    @staticmethod
+    def highest_value(bucket):
+        """Largest value that falls into a bucket."""
+        if bucket < 2 * SUB_BUCKETS:
+            return bucket
+        exponent = bucket // SUB_BUCKETS - 1
+        return ((SUB_BUCKETS + bucket % SUB_BUCKETS + 1) << exponent) - 1
+
+    def record(self, value):
+        bucket = self.bucket(value)
+        if bucket >= len(self.counts):
+            self.counts.extend([0] * (bucket + 1 - len(self.counts)))
+        self.counts[bucket] += 1
+        self.total += 1
+
+    def percentile(self, percent):
+        """Upper edge of the bucket holding the given percentile, or None if empty."""
+        if not self.total:
+            return None
+        rank = max(1, round(percent / 100 * self.total))
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.highest_value(bucket)
+        return self.highest_value(len(self.counts) - 1)
+
+    def buckets(self):
+        """[[highest value, count], ...] of the non-empty buckets."""
+        return [[self.highest_value(bucket), count] for bucket, count in enumerate(self.counts) if count]
+
+
+class ActionStats:
+    """Counters and latency histogram of one action."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.total_us = 0
+        self.max_us = 0
+        self.latency = Histogram()
+
+    def record(self, microseconds, received, sent, failed):
+        with self.lock:
+            self.count += 1
+            self.errors += failed
+            self.bytes_in += received
+            self.bytes_out += sent
+            self.total_us += microseconds
+            self.max_us = max(self.max_us, microseconds)
+            self.latency.record(microseconds)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "count": self.count,
+                "errors": self.errors,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "mean_ms": self.total_us / self.count / 1000 if self.count else None,
+                **{f"p{p}_ms": self.percentile_ms(p) for p in (50, 90, 99)},
+                "max_ms": self.max_us / 1000,
+                "histogram_us": self.latency.buckets(),
+            }
+
+    def percentile_ms(self, percent):
+        value = self.latency.percentile(percent)
+        return min(value, self.max_us) / 1000 if value is not None else None
+
+
+class ServerStats:
+    """
+    Per-action request statistics of the server: requests, error replies,
+    payload bytes in and out, and a latency histogram of the handler time,
+    plus one histogram of how long requests waited for a worker thread.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.actions = {}
+        self.queue_wait = ActionStats()
+
+    def record(self, action, seconds, received, sent, failed, waited):
+        """Record one finished request; seconds is the handler time, waited the time queued before it."""
+        stats = self.actions.get(action)
+        if stats is None:
+            with self.lock:
+                stats = self.actions.setdefault(action, ActionStats())
+        stats.record(int(seconds * 1_000_000), received, sent, failed)
+        self.queue_wait.record(int(waited * 1_000_000), 0, 0, False)
+
+    def snapshot(self):
+        with self.lock:
+            actions = dict(self.actions)
+        queue_wait = self.queue_wait.snapshot()
+        return {
+            "started": self.started,
+            "uptime": time.time() - self.started,
+            "actions": {name: stats.snapshot() for name, stats in sorted(actions.items())},
+            "queue_wait": {key: value for key, value in queue_wait.items()
+                           if key not in ("errors", "bytes_in", "bytes_out")},
+        }
+
+    def dump(self, path):
+        """Write a snapshot as JSON, atomically."""
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(self.snapshot(), file, indent=4)
+        os.replace(temporary_path, path)
+
+    def dump_periodically(self, path, interval, logger):
+        """Dump to path every interval seconds on a daemon thread."""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.dump(path)
+                except OSError as e:
+                    logger.error("Could not write stats to %s: %s", path, e)
+        threading.Thread(target=run, daemon=True, name="StatsDump").start()
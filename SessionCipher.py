@@ -0,0 +1,47 @@
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+
+class SessionCipher:
+    """
+    AES-GCM cipher for one client session.
+
+    The session key is agreed once during the RSA handshake. Every frame after
+    that is sealed with a fresh nonce made of a 4-byte direction tag and an
+    8-byte frame counter, so both sides derive the nonce without sending it and
+    a replayed or reordered frame fails authentication.
+    """
+
+    KEY_SIZE = 32
+
+    def __init__(self, key, is_server):
+        self.aead = AESGCM(key)
+        self.send_prefix = b"SRV>" if is_server else b"CLI>"
+        self.recv_prefix = b"CLI>" if is_server else b"SRV>"
+        self.send_counter = 0
+        self.recv_counter = 0
+
+    @staticmethod
+    def generate_key():
+        """Generate a new random session key."""
+        return AESGCM.generate_key(bit_length=SessionCipher.KEY_SIZE * 8)
+
+    def seal(self, data, associated_data=None):
+        """Encrypt and authenticate the next outgoing frame."""
+        nonce = self.send_prefix + self.send_counter.to_bytes(8, 'big')
+        self.send_counter += 1
+        return self.aead.encrypt(nonce, data, associated_data)
+
+    def open(self, data, associated_data=None):
+        """Decrypt and verify the next incoming frame."""
+        nonce = self.recv_prefix + self.recv_counter.to_bytes(8, 'big')
+        self.recv_counter += 1
+        return self.aead.decrypt(nonce, data, associated_data)
+
+    def open_into(self, data, associated_data, output):
+        """Like open, but write the plaintext into output, a writable buffer of len(data) - 16 bytes."""
+        nonce = self.recv_prefix + self.recv_counter.to_bytes(8, 'big')
+        self.recv_counter += 1
+        if hasattr(self.aead, "decrypt_into"):  # recent cryptography releases only
+            self.aead.decrypt_into(nonce, data, associated_data, output)
+        else:
+            output[:] = self.aead.decrypt(nonce, bytes(data), associated_data)
@@ -66,11 +66,17 @@ class SignUpState(State):
             print("Passwords do not match")
             self.error_label.config(text="Passwords do not match")
         else:
-            # Call client's register function (simulate account creation)
-            self.engine.client.register(username, password)
-            print("Account created (dummy logic)")
-            self.destroy()
-            self.engine.pop_state()
+            # Register on a background thread and go back once the server answered
+            self.engine.dispatcher.submit(self.engine.client.register, username, password,
+                                          on_done=self.on_registered, on_error=self.on_registered)
+
+    def on_registered(self, result):
+        """Called on the Tk thread once register returned or failed."""
+        if not self.frame.winfo_exists():
+            return  # the user left this screen meanwhile
+        print("Account created (dummy logic)")
+        self.destroy()
+        self.engine.pop_state()
 
     def back_clicked(self):
         self.destroy()
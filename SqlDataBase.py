@@ -1,22 +1,44 @@
 import sqlite3
 import hashlib
+import threading
+
+BUSY_TIMEOUT = 5.0  # seconds a connection waits for another writer before giving up
+CACHED_STATEMENTS = 32
 
 class SqlDataBase:
-    def __init__(self, host='127.0.0.1', port=65432):
-        db_name = 'users.db'
+    def __init__(self, host='127.0.0.1', port=65432, db_name='users.db'):
+        """
+        Each thread that uses the database gets its own sqlite3 connection, so
+        concurrent logins never share a cursor. The database runs in WAL mode:
+        readers do not block the writer or each other, and a writer waits up to
+        BUSY_TIMEOUT for another one instead of failing. sqlite3 keeps the
+        compiled statements of each connection in its statement cache, so the
+        same queries are prepared once per thread.
+        """
         # Initialize the server and database connection
         self.db_name = db_name
-        self.conn = sqlite3.connect(self.db_name, check_same_thread=False)
-        self.cursor = self.conn.cursor()
+        self.local = threading.local()
+
+        conn = self.connection()
+        conn.execute('PRAGMA journal_mode=WAL')
 
         # Create or update the users table with only username and password
-        self.cursor.execute('''
+        with conn:
+            conn.execute('''
                       CREATE TABLE IF NOT EXISTS users (
                           username TEXT PRIMARY KEY,
                           password TEXT
                       )
                   ''')
-        self.conn.commit()
+
+    def connection(self):
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_name, timeout=BUSY_TIMEOUT, cached_statements=CACHED_STATEMENTS)
+            conn.execute('PRAGMA synchronous=NORMAL')  # safe with WAL, fsyncs only at checkpoints
+            self.local.conn = conn
+        return conn
 
     def check_credentials(self, username, password):
         """Check user credentials for login"""
@@ -24,8 +46,7 @@ class SqlDataBase:
             # Hashing password
             password = hashlib.sha256((password + "daddy").encode('utf-8')).hexdigest()
 
-            self.cursor.execute('SELECT * FROM users WHERE username=?', (username,))
-            result = self.cursor.fetchone()
+            result = self.connection().execute('SELECT * FROM users WHERE username=?', (username,)).fetchone()
             if result:
                 stored_password = result[1]  # Password stored as hashed text
                 if stored_password == password:
@@ -42,11 +63,11 @@ class SqlDataBase:
             # Hashing password
             password = hashlib.sha256((password + "daddy").encode('utf-8')).hexdigest()
 
-            self.cursor.execute(
-                'INSERT INTO users (username, password) VALUES (?, ?)',  # Removed extra column
-                (username, password)
-            )
-            self.conn.commit()
+            with self.connection() as conn:  # commits, or rolls back on error
+                conn.execute(
+                    'INSERT INTO users (username, password) VALUES (?, ?)',  # Removed extra column
+                    (username, password)
+                )
             print("User created successfully.")
             return True
         except sqlite3.IntegrityError:
@@ -59,8 +80,7 @@ class SqlDataBase:
     def print_all_users(self):
         """Print all users in the database"""
         try:
-            self.cursor.execute('SELECT * FROM users')
-            rows = self.cursor.fetchall()
+            rows = self.connection().execute('SELECT * FROM users').fetchall()
             if rows:
                 print("Users in the database:")
                 for row in rows:
@@ -0,0 +1,198 @@
+"""
+Small previews of group files.
+
+Thumbnails are JPEGs of at most THUMBNAIL_SIZE, rendered from images with
+Pillow and from the first page of PDFs with PyMuPDF when it is installed.
+Rendering runs in a pool of worker processes so decoding large images never
+holds up the threads serving requests. Finished thumbnails are kept in an
+on-disk cache keyed by the SHA-256 of the file they were made from, so every
+copy and every name of the same content shares one thumbnail.
+"""
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+THUMBNAIL_SIZE = (160, 160)
+JPEG_QUALITY = 80
+MAX_SOURCE_SIZE = 200 * 1024 * 1024  # larger files are not worth decoding for a preview
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".tif", ".tiff"}
+
+
+def can_preview(filename):
+    """True if a thumbnail can be made for a file of this name with the libraries installed."""
+    extension = os.path.splitext(filename)[1].lower()
+    if Image is None:
+        return False
+    return extension in IMAGE_EXTENSIONS or (extension == ".pdf" and fitz is not None)
+
+
+def render(path, filename):
+    """Return the JPEG thumbnail of a file (runs in a worker process)."""
+    if os.path.splitext(filename)[1].lower() == ".pdf":
+        with fitz.open(path) as document:
+            page = document[0]
+            zoom = min(THUMBNAIL_SIZE[0] / page.rect.width, THUMBNAIL_SIZE[1] / page.rect.height)
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            image = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+    else:
+        image = Image.open(path)
+        image.draft("RGB", THUMBNAIL_SIZE)  # lets JPEGs decode at a reduced scale
+        image = ImageOps.exif_transpose(image)
+    image.thumbnail(THUMBNAIL_SIZE)
+    output = io.BytesIO()
+    image.convert("RGB").save(output, "JPEG", quality=JPEG_QUALITY)
+    return output.getvalue()
+
+
+class ThumbnailCache:
+    """
+    Thumbnails on disk under folder/<first two hex digits>/<sha256>.jpg, capped
+    at max_bytes. When the cap is exceeded the least recently used thumbnails
+    are deleted; a file's mtime records its last use, so the order survives
+    restarts.
+    """
+
+    def __init__(self, folder, max_bytes=64 * 1024 * 1024):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # sha256 -> size, least recently used first
+        self.total = 0
+        os.makedirs(folder, exist_ok=True)
+        found = []
+        for root, _, filenames in os.walk(folder):
+            for filename in filenames:
+                if filename.endswith(".jpg"):
+                    stat = os.stat(os.path.join(root, filename))
+                    found.append((stat.st_mtime, filename[:-len(".jpg")], stat.st_size))
+        for _, sha256, size in sorted(found):
+            self.entries[sha256] = size
+            self.total += size
+
+    def path(self, sha256):
+        if len(sha256) != 64 or not all(c in "0123456789abcdef" for c in sha256):
+            raise ValueError("Invalid SHA-256.")
+        return os.path.join(self.folder, sha256[:2], f"{sha256}.jpg")
+
+    def __contains__(self, sha256):
+        with self.lock:
+            return sha256 in self.entries
+
+    def get(self, sha256):
+        """Return a cached thumbnail and mark it as used, or None."""
+        with self.lock:
+            if sha256 not in self.entries:
+                return None
+            self.entries.move_to_end(sha256)
+        try:
+            path = self.path(sha256)
+            with open(path, "rb") as file:
+                data = file.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            with self.lock:
+                self.total -= self.entries.pop(sha256, 0)
+            return None
+
+    def put(self, sha256, data):
+        """Store a thumbnail, evicting the least recently used ones over the cap."""
+        path = self.path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(data)
+        os.replace(temporary_path, path)
+        with self.lock:
+            self.total += len(data) - self.entries.pop(sha256, 0)
+            self.entries[sha256] = len(data)
+            evicted = []
+            while self.total > self.max_bytes and len(self.entries) > 1:
+                old, size = self.entries.popitem(last=False)
+                self.total -= size
+                evicted.append(old)
+        for old in evicted:
+            try:
+                os.remove(self.path(old))
+            except FileNotFoundError:
+                pass
+
+
+class ThumbnailService:
+    """
+    Renders thumbnails into a ThumbnailCache on a pool of worker processes,
+    started on first use. A thumbnail is rendered once however often it is
+    requested, and content that failed to render is not tried again.
+    """
+
+    def __init__(self, cache, workers=2):
+        self.cache = cache
+        self.workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+        self.pending = {}  # sha256 -> Future of the thumbnail being rendered
+        self.failed = set()
+
+    def request(self, sha256, path, filename):
+        """
+        Start rendering the thumbnail of a file unless it is cached, in progress or
+        cannot be made. Returns the Future of its JPEG bytes, or None.
+        """
+        if not can_preview(filename) or sha256 in self.cache:
+            return None
+        with self.lock:
+            if sha256 in self.failed:
+                return None
+            future = self.pending.get(sha256)
+            if future is not None:
+                return future
+            if os.path.getsize(path) > MAX_SOURCE_SIZE:
+                self.failed.add(sha256)
+                return None
+            if self.executor is None:
+                # Worker processes are spawned, not forked, since the caller runs many threads
+                self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                    mp_context=multiprocessing.get_context("spawn"))
+            future = self.executor.submit(render, path, filename)
+            self.pending[sha256] = future
+        future.add_done_callback(lambda done: self.finish(sha256, done))
+        return future
+
+    def finish(self, sha256, future):
+        with self.lock:
+            self.pending.pop(sha256, None)
+            if future.cancelled() or future.exception() is not None:
+                self.failed.add(sha256)
+                return
+        self.cache.put(sha256, future.result())
+
+    def thumbnail(self, sha256, path, filename):
+        """Return the thumbnail of a file, rendering it first if needed (blocks), or None."""
+        data = self.cache.get(sha256)
+        if data is not None:
+            return data
+        future = self.request(sha256, path, filename)
+        if future is None:
+            return self.cache.get(sha256)
+        try:
+            return future.result()
+        except Exception:
+            return None
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,193 @@
+import itertools
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class RateLimiter:
+    """
+    Token bucket shared by any number of threads. consume(count) blocks until
+    sending or receiving count more bytes stays within rate bytes per second.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, count):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= count
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+class TransferManager:
+    """
+    Runs uploads and downloads for the GUI in parallel.
+
+    Transfers run on a bounded pool of worker threads. Each transfer borrows
+    one of up to max_connections extra connections to the server, opened on
+    first use, so a large transfer never queues behind the GUI's own requests.
+    Bandwidth can be capped per transfer (transfer_rate) and for all transfers
+    together (max_rate), in bytes per second. Progress is reported as dicts
+    that the GUI polls with take_progress; only the latest update of each
+    transfer is kept, so a final status is never lost while nobody polls.
+    """
+
+    def __init__(self, client, workers=4, max_connections=4, max_rate=None, transfer_rate=None):
+        self.client = client
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Transfer")
+        self.max_connections = max_connections
+        self.idle_connections = []  # most recently used last
+        self.open_connections = 0
+        self.closed = False
+        self.pool_changed = threading.Condition()  # a connection was returned, discarded or could not be opened
+        self.global_limiter = RateLimiter(max_rate) if max_rate else None
+        self.transfer_rate = transfer_rate
+        self.transfer_ids = itertools.count(1)
+        self.progress = {}  # transfer id -> its latest update not taken yet
+        self.progress_lock = threading.Lock()
+
+    def acquire_connection(self):
+        """Borrow an idle pooled connection, opening a new one while under the limit."""
+        connection = self.open_or_wait()
+        # Downloads land in the GUI client's folders
+        connection.save_dir = self.client.save_dir
+        connection.sync_dir = self.client.sync_dir
+        return connection
+
+    def open_or_wait(self):
+        with self.pool_changed:
+            while True:
+                if self.closed:
+                    raise ConnectionError("The transfer manager was closed.")
+                if self.idle_connections:
+                    return self.idle_connections.pop()
+                if self.open_connections < self.max_connections:
+                    self.open_connections += 1
+                    break
+                self.pool_changed.wait()
+        try:
+            connection = type(self.client)(self.client.server_host, self.client.tcp_port, self.client.profile,
+                                           start_engine=False)
+            if self.client.credentials:
+                # Logged in as the GUI's user, so the server limits its transfers per user rather than per address
+                connection.log_in(*self.client.credentials)
+            return connection
+        except Exception:
+            with self.pool_changed:
+                self.open_connections -= 1
+                self.pool_changed.notify()
+            raise
+
+    def release_connection(self, connection):
+        connection.receive_throttle = None
+        with self.pool_changed:
+            if not self.closed:
+                self.idle_connections.append(connection)
+                self.pool_changed.notify()
+                return
+        self.discard_connection(connection)
+
+    def discard_connection(self, connection):
+        """Close a connection that may be broken instead of returning it to the pool."""
+        connection.close_connection()
+        with self.pool_changed:
+            self.open_connections -= 1
+            self.pool_changed.notify()
+
+    def upload(self, file_path, group_name, copy_to=None):
+        """
+        Queue an upload, first copying the file to copy_to if given.
+        Returns a Future that resolves to True on success.
+        """
+        def run(connection, progress, throttle):
+            if copy_to is not None:
+                shutil.copy2(file_path, copy_to)
+
+            def sent(count):
+                throttle(count)
+                progress(count)
+            return connection.send_file(file_path, group_name, progress=sent)
+        return self.submit("upload", os.path.basename(file_path), os.path.getsize(file_path), run)
+
+    def download(self, group_name, filename, size=0):
+        """Queue the download of one file of a group. Returns a Future that resolves to True on success."""
+        def run(connection, progress, throttle):
+            connection.receive_throttle = throttle
+            return connection.receive_all_files(group_name, [filename], progress=progress)
+        return self.submit("download", filename, size, run)
+
+    def download_all(self, group_name, filenames):
+        """Download several files of a group in parallel and wait for all of them."""
+        wait([self.download(group_name, filename) for filename in filenames])
+
+    def sync_group(self, group_name):
+        """Client.sync_group with the changed files fetched in parallel."""
+        return self.client.sync_group(group_name, fetch=self.download_all)
+
+    def submit(self, kind, name, total, run):
+        transfer_id = next(self.transfer_ids)
+        self.report(transfer_id, kind, name, 0, total, "queued")
+        return self.executor.submit(self.run_transfer, transfer_id, kind, name, total, run)
+
+    def run_transfer(self, transfer_id, kind, name, total, run):
+        """Run one transfer on a pooled connection with its own rate limit."""
+        limiter = RateLimiter(self.transfer_rate) if self.transfer_rate else None
+        done = 0
+
+        def throttle(count):
+            if limiter is not None:
+                limiter.consume(count)
+            if self.global_limiter is not None:
+                self.global_limiter.consume(count)
+
+        def progress(count):
+            nonlocal done
+            done += count
+            self.report(transfer_id, kind, name, done, total, "running")
+
+        connection = None
+        success = False
+        try:
+            connection = self.acquire_connection()
+            success = run(connection, progress, throttle)
+        except Exception as e:
+            print(f"Transfer of {name} failed: {e}")
+        finally:
+            if connection is not None:
+                if success:
+                    self.release_connection(connection)
+                else:
+                    self.discard_connection(connection)
+        self.report(transfer_id, kind, name, done, total, "done" if success else "failed")
+        return success
+
+    def report(self, transfer_id, kind, name, done, total, status):
+        with self.progress_lock:
+            self.progress[transfer_id] = {"id": transfer_id, "kind": kind, "name": name,
+                                          "done": done, "total": total, "status": status}
+
+    def take_progress(self):
+        """Return the latest update of every transfer that reported since the last call."""
+        with self.progress_lock:
+            updates, self.progress = list(self.progress.values()), {}
+        return updates
+
+    def close(self):
+        """Cancel the queued transfers and close the pooled connections; running ones close as they finish."""
+        with self.pool_changed:
+            self.closed = True
+            idle, self.idle_connections = self.idle_connections, []
+            self.pool_changed.notify_all()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for connection in idle:
+            self.discard_connection(connection)
@@ -0,0 +1,177 @@
+import bisect
+import os
+import time
+import tkinter as tk
+import tkinter.font as tkfont
+
+
+class FolderSnapshot:
+    """
+    os.scandir listing of a folder: {filename: (size, mtime)}. The folder is
+    only listed again when its own mtime changed, which every file added,
+    removed or replaced in it (synced files are renamed into place) causes.
+    Files edited in place leave the folder's mtime alone, so otherwise only
+    the known entries are stat'ed again.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.folder_mtime = None
+        self.entries = {}
+
+    def scan(self):
+        try:
+            folder_mtime = os.stat(self.folder).st_mtime_ns
+        except FileNotFoundError:
+            self.folder_mtime, self.entries = None, {}
+            return self.entries
+        if folder_mtime == self.folder_mtime:
+            entries = self.restat()
+            if entries is not None:
+                self.entries = entries
+                return entries
+
+        entries = {}
+        with os.scandir(self.folder) as listing:
+            for entry in listing:
+                if entry.is_file() and not entry.name.startswith("."):
+                    stat = entry.stat()
+                    entries[entry.name] = (stat.st_size, stat.st_mtime)
+        self.folder_mtime, self.entries = folder_mtime, entries
+        return entries
+
+    def restat(self):
+        """Return the known entries with fresh stats, or None if one is gone and the folder must be listed."""
+        entries = {}
+        for name in self.entries:
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                return None
+            entries[name] = (stat.st_size, stat.st_mtime)
+        return entries
+
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+class VirtualFileList:
+    """
+    Sorted file list of any length shown in a Listbox that only ever holds the
+    rows in view. The rows live in a sorted model; update() applies only what
+    changed and render() rewrites only the visible lines whose text differs.
+    The scrollbar and mouse wheel move the window over the model.
+    Must only be used from the Tk thread.
+    """
+
+    def __init__(self, parent, font=("Helvetica", 12)):
+        self.names = []  # sorted model
+        self.metadata = {}  # filename -> (size, mtime)
+        self.first = 0  # model index of the top visible row
+        self.shown = []  # lines currently in the Listbox
+        self.selected_name = None
+        self.line_height = tkfont.Font(font=font).metrics("linespace") + 1
+
+        self.listbox = tk.Listbox(parent, font=font, bg="white", fg="#333", bd=0, highlightthickness=0,
+                                  activestyle="none", exportselection=False)
+        self.listbox.pack(side="left", fill="both", expand=True, padx=5, pady=5)
+        self.scrollbar = tk.Scrollbar(parent, command=self.on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+
+        self.listbox.bind("<Configure>", lambda event: self.render())
+        self.listbox.bind("<<ListboxSelect>>", self.on_select)
+        self.listbox.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.listbox.bind("<Button-4>", self.on_mouse_wheel)
+        self.listbox.bind("<Button-5>", self.on_mouse_wheel)
+
+    def bind(self, sequence, callback):
+        """Bind an event of the Listbox, after the list's own handlers."""
+        self.listbox.bind(sequence, callback, add="+")
+
+    def __contains__(self, name):
+        return name in self.metadata
+
+    def update(self, entries):
+        """Make the list show entries ({filename: (size, mtime)}), touching only what changed."""
+        removed = self.metadata.keys() - entries.keys()
+        added = entries.keys() - self.metadata.keys()
+        for name in removed:
+            del self.names[bisect.bisect_left(self.names, name)]
+        for name in added:
+            bisect.insort(self.names, name)
+        self.metadata = dict(entries)
+        self.render()
+
+    def add(self, name, size=0, mtime=None):
+        """Show one file right away, before the next folder scan picks it up."""
+        if name not in self.metadata:
+            bisect.insort(self.names, name)
+        self.metadata[name] = (size, time.time() if mtime is None else mtime)
+        self.render()
+
+    def remove(self, name):
+        if name in self.metadata:
+            del self.metadata[name]
+            del self.names[bisect.bisect_left(self.names, name)]
+            self.render()
+
+    def visible_rows(self):
+        return max(1, self.listbox.winfo_height() // self.line_height + 1)
+
+    def line(self, name):
+        size, mtime = self.metadata[name]
+        return f"📄 {name}    {format_size(size)}, {time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime))}"
+
+    def render(self):
+        """Rewrite the visible lines that differ from the model and update the scrollbar."""
+        count = self.visible_rows()
+        self.first = max(0, min(self.first, len(self.names) - count + 1))
+        window = self.names[self.first:self.first + count]
+        lines = [self.line(name) for name in window]
+
+        for index, text in enumerate(lines):
+            if index < len(self.shown):
+                if self.shown[index] != text:
+                    self.listbox.delete(index)
+                    self.listbox.insert(index, text)
+            else:
+                self.listbox.insert(tk.END, text)
+        if len(self.shown) > len(lines):
+            self.listbox.delete(len(lines), tk.END)
+        self.shown = lines
+
+        self.listbox.selection_clear(0, tk.END)
+        if self.selected_name in window:
+            self.listbox.selection_set(window.index(self.selected_name))
+
+        total = max(len(self.names), 1)
+        self.scrollbar.set(self.first / total, min(1.0, (self.first + count) / total))
+
+    def scroll_to(self, first):
+        self.first = first
+        self.render()
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * len(self.names)))
+        elif unit == "pages":
+            self.scroll_to(self.first + int(amount) * (self.visible_rows() - 1))
+        else:
+            self.scroll_to(self.first + int(amount))
+
+    def on_mouse_wheel(self, event):
+        self.scroll_to(self.first + (-3 if event.num == 4 or event.delta > 0 else 3))
+        return "break"  # the Listbox must not scroll its few rows itself
+
+    def on_select(self, event):
+        selection = self.listbox.curselection()
+        if selection and self.first + selection[0] < len(self.names):
+            self.selected_name = self.names[self.first + selection[0]]
+
+    def selected(self):
+        """Return the selected filename, or None."""
+        return self.selected_name if self.selected_name in self.metadata else None